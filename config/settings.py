@@ -51,6 +51,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'downloader.tracing.tracing_middleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -88,6 +89,15 @@ DATABASES = {
     }
 }
 
+# DB_ENGINE=sqlite for single-process use (`manage.py fetch_anime`) without Postgres
+if os.environ.get('DB_ENGINE') == 'sqlite':
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('DB_NAME', str(BASE_DIR / 'db.sqlite3')),
+        # Download threads write progress concurrently, wait for the lock instead of failing
+        'OPTIONS': {'timeout': 30},
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -142,15 +152,170 @@ CELERY_TIMEZONE = TIME_ZONE
 from celery.schedules import crontab
 
 CELERY_BEAT_SCHEDULE = {
-    'check-for-new-episodes-every-morning': {
-        'task': 'downloader.tasks.check_for_new_episodes_task',
-        'schedule': crontab(hour=4, minute=0),
+    'poll-due-anime': {
+        'task': 'downloader.tasks.poll_due_anime_task',
+        'schedule': int(os.environ.get('POLL_TICK_INTERVAL', '300')),
     },
     'retry-failed-episodes-hourly': {
         'task': 'downloader.tasks.retry_failed_episodes_task',
         'schedule': crontab(minute=0),
     },
+    'reap-stale-downloads-every-minute': {
+        'task': 'downloader.tasks.reap_stale_downloads_task',
+        'schedule': crontab(),
+    },
+    'release-waiting-for-space-every-minute': {
+        'task': 'downloader.tasks.release_waiting_episodes_task',
+        'schedule': crontab(),
+    },
+    'sync-catalog-nightly': {
+        'task': 'downloader.tasks.sync_catalog_task',
+        'schedule': crontab(hour=3, minute=0),
+    },
+    'flush-media-refreshes': {
+        'task': 'downloader.tasks.flush_media_refreshes_task',
+        'schedule': int(os.environ.get('MEDIA_REFRESH_FLUSH_INTERVAL', '15')),
+    },
+}
+
+# A downloading episode is owned by one worker for DOWNLOAD_LEASE_SECONDS,
+# renewed every DOWNLOAD_HEARTBEAT_SECONDS while the transfer runs
+DOWNLOAD_LEASE_SECONDS = int(os.environ.get('DOWNLOAD_LEASE_SECONDS', '120'))
+DOWNLOAD_HEARTBEAT_SECONDS = int(os.environ.get('DOWNLOAD_HEARTBEAT_SECONDS', '30'))
+
+# Broker health is probed in the background and cached per process (seconds)
+BROKER_HEALTH_INTERVAL = int(os.environ.get('BROKER_HEALTH_INTERVAL', '5'))
+
+# Download outbox: intents written with the episodes, drained by `manage.py dispatch_outbox`
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', '100'))
+OUTBOX_POLL_INTERVAL = int(os.environ.get('OUTBOX_POLL_INTERVAL', '5'))
+
+# Timeout (seconds) for the async upstream client used by the search views
+UPSTREAM_TIMEOUT = int(os.environ.get('UPSTREAM_TIMEOUT', '15'))
+
+# AnimeUnity mirrors (comma separated). With more than one, each process probes them every
+# UPSTREAM_PROBE_INTERVAL seconds and uses the fastest healthy one, failing over on errors.
+# Stored anime/episode URLs are moved to the chosen mirror when next used.
+UPSTREAM_MIRRORS = [url.strip().rstrip('/') for url in os.environ.get('UPSTREAM_MIRRORS', 'https://www.animeunity.so').split(',') if url.strip()]
+UPSTREAM_PROBE_INTERVAL = int(os.environ.get('UPSTREAM_PROBE_INTERVAL', '60'))
+UPSTREAM_PROBE_TIMEOUT = int(os.environ.get('UPSTREAM_PROBE_TIMEOUT', '5'))
+
+# Local catalog search: results scoring at least CATALOG_MIN_SCORE are served without
+# asking upstream; each process re-checks the table for changes every CATALOG_INDEX_REFRESH seconds
+CATALOG_MIN_SCORE = float(os.environ.get('CATALOG_MIN_SCORE', '0.5'))
+CATALOG_INDEX_REFRESH = int(os.environ.get('CATALOG_INDEX_REFRESH', '30'))
+# On a catalog miss the search views wait this long (seconds) for upstream, then serve the
+# fuzzy local results; the upstream search still completes and fills the catalog
+CATALOG_UPSTREAM_DEADLINE = float(os.environ.get('CATALOG_UPSTREAM_DEADLINE', '5'))
+
+# Add-anime jobs still running after this many seconds are assumed dead and re-queued
+ADD_JOB_TIMEOUT = int(os.environ.get('ADD_JOB_TIMEOUT', '900'))
+
+# Bulk watchlist import (api/import/ and `manage.py import_watchlist`)
+BULK_IMPORT_CONCURRENCY = int(os.environ.get('BULK_IMPORT_CONCURRENCY', '4'))
+BULK_IMPORT_BATCH_SIZE = int(os.environ.get('BULK_IMPORT_BATCH_SIZE', '20'))
+BULK_IMPORT_MIN_CONFIDENCE = float(os.environ.get('BULK_IMPORT_MIN_CONFIDENCE', '0.8'))
+BULK_IMPORT_MAX_ITEMS = int(os.environ.get('BULK_IMPORT_MAX_ITEMS', '500'))
+
+# Fast scratch directory downloads are written to before being promoted into MEDIA_ROOT.
+# Unset: downloads go to a hidden .partial file next to their final name.
+DOWNLOAD_STAGING_ROOT = os.environ.get('DOWNLOAD_STAGING_ROOT') or None
+# Cross-device promotions copied at the same time, and their copy buffer size
+PROMOTION_CONCURRENCY = int(os.environ.get('PROMOTION_CONCURRENCY', '2'))
+PROMOTION_BUFFER_SIZE = int(os.environ.get('PROMOTION_BUFFER_SIZE', str(16 * 1024 * 1024)))
+
+# Free space always kept on the download volumes (bytes), on top of running downloads' reservations
+DISK_SPACE_MARGIN = int(os.environ.get('DISK_SPACE_MARGIN', str(1024 ** 3)))
+
+# Serving downloaded episodes (episode/<id>/file/). MEDIA_ACCEL=nginx answers with
+# X-Accel-Redirect to MEDIA_ACCEL_PREFIX, an `internal` nginx location aliased to MEDIA_ROOT;
+# MEDIA_ACCEL=sendfile answers with X-Sendfile (Apache, lighttpd). Unset: streamed by Django.
+MEDIA_ACCEL = os.environ.get('MEDIA_ACCEL', '')
+MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX', '/protected-media/')
+# Watching while downloading (episode/<id>/stream/): readers ahead of the download check for
+# new bytes every STREAM_POLL_INTERVAL seconds and give up after STREAM_STALL_TIMEOUT without any
+STREAM_POLL_INTERVAL = float(os.environ.get('STREAM_POLL_INTERVAL', '0.5'))
+STREAM_STALL_TIMEOUT = int(os.environ.get('STREAM_STALL_TIMEOUT', '30'))
+
+# Optional post-download stage moving the MP4 index (moov) to the front of the file.
+# It runs on its own queue, served by a dedicated worker (see docker-compose.yml).
+MP4_FASTSTART = os.environ.get('MP4_FASTSTART', 'False') == 'True'
+CELERY_TASK_ROUTES = {
+    'downloader.tasks.faststart_episode_task': {'queue': 'postprocess'},
+}
+
+# Media servers told to rescan an anime folder once its downloads settle.
+# MEDIA_SERVER_TYPE is jellyfin, emby, plex or kodi; MEDIA_SERVER_PATH_PREFIX is where
+# MEDIA_ROOT is mounted on the media server, if different.
+MEDIA_SERVERS = []
+if os.environ.get('MEDIA_SERVER_TYPE') and os.environ.get('MEDIA_SERVER_URL'):
+    MEDIA_SERVERS.append({
+        'type': os.environ['MEDIA_SERVER_TYPE'],
+        'url': os.environ['MEDIA_SERVER_URL'],
+        'token': os.environ.get('MEDIA_SERVER_TOKEN'),
+        'path_prefix': os.environ.get('MEDIA_SERVER_PATH_PREFIX'),
+        'section': os.environ.get('PLEX_SECTION_ID', '1'),
+        'username': os.environ.get('KODI_USERNAME'),
+        'password': os.environ.get('KODI_PASSWORD'),
+    })
+# Completions in the same folder less than MEDIA_REFRESH_WINDOW seconds apart share one
+# refresh, which is never held back more than MEDIA_REFRESH_MAX_DELAY seconds
+MEDIA_REFRESH_WINDOW = int(os.environ.get('MEDIA_REFRESH_WINDOW', '60'))
+MEDIA_REFRESH_MAX_DELAY = int(os.environ.get('MEDIA_REFRESH_MAX_DELAY', '300'))
+
+# Celery children pre-build their scraper session (and pass Cloudflare) when they start
+WORKER_WARMUP = os.environ.get('WORKER_WARMUP', 'True') == 'True'
+
+# Tracing: spans of web requests, tasks and upstream calls appended as JSON lines to
+# TRACE_EXPORT_PATH (unset disables tracing). TRACE_SAMPLE_RATE of new traces are recorded.
+TRACE_EXPORT_PATH = os.environ.get('TRACE_EXPORT_PATH') or None
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0.1'))
+
+# Downloads cut short or corrupted in transit are retried right away up to this many times
+DOWNLOAD_RETRIES = int(os.environ.get('DOWNLOAD_RETRIES', '2'))
+
+# Per CDN host transfer slots, learned with additive increase / multiplicative decrease.
+# Worker concurrency should be at least HOST_CONCURRENCY_MAX. A download finding its host
+# full goes back to the outbox and is sent again after HOST_SLOT_RETRY_DELAY seconds, so no
+# worker sits waiting; `manage.py fetch_anime` waits up to HOST_SLOT_WAIT seconds instead.
+HOST_CONCURRENCY_INITIAL = int(os.environ.get('HOST_CONCURRENCY_INITIAL', '2'))
+HOST_CONCURRENCY_MIN = int(os.environ.get('HOST_CONCURRENCY_MIN', '1'))
+HOST_CONCURRENCY_MAX = int(os.environ.get('HOST_CONCURRENCY_MAX', '8'))
+HOST_CONCURRENCY_DECREASE = float(os.environ.get('HOST_CONCURRENCY_DECREASE', '0.5'))
+HOST_CONCURRENCY_COOLDOWN = int(os.environ.get('HOST_CONCURRENCY_COOLDOWN', '30'))
+HOST_TTFB_FACTOR = float(os.environ.get('HOST_TTFB_FACTOR', '3'))
+HOST_SLOT_WAIT = int(os.environ.get('HOST_SLOT_WAIT', '300'))
+HOST_SLOT_RETRY_DELAY = int(os.environ.get('HOST_SLOT_RETRY_DELAY', '30'))
+
+# New-episode polling: each anime is checked every POLL_WINDOW_INTERVAL seconds from
+# POLL_WINDOW_BEFORE before to POLL_WINDOW_AFTER after its expected release time, learned
+# from when its past episodes appeared. Shows that missed POLL_STALE_RELEASES releases, or
+# have no history yet, back off between POLL_MIN_BACKOFF and POLL_MAX_BACKOFF seconds.
+POLL_WINDOW_BEFORE = int(os.environ.get('POLL_WINDOW_BEFORE', '3600'))
+POLL_WINDOW_AFTER = int(os.environ.get('POLL_WINDOW_AFTER', '10800'))
+POLL_WINDOW_INTERVAL = int(os.environ.get('POLL_WINDOW_INTERVAL', '900'))
+POLL_STALE_RELEASES = int(os.environ.get('POLL_STALE_RELEASES', '3'))
+POLL_MIN_BACKOFF = int(os.environ.get('POLL_MIN_BACKOFF', '86400'))
+POLL_MAX_BACKOFF = int(os.environ.get('POLL_MAX_BACKOFF', '2592000'))
+
+# Storage nodes for multi-host deployments, "name=directory,..." (directory defaults to the name).
+# Each node's anime folders live in MEDIA_ROOT/<directory>, on that node's local disk, and its
+# downloads are routed to the `downloads.<name>` queue served by the workers running there.
+# New animes go to STORAGE_NODE_DEFAULT, or to the node with the most free space.
+STORAGE_NODES = {
+    name.strip(): (directory.strip() or name.strip())
+    for name, _, directory in (
+        entry.partition('=') for entry in os.environ.get('STORAGE_NODES', '').split(',') if entry.strip()
+    )
 }
+STORAGE_NODE_DEFAULT = os.environ.get('STORAGE_NODE_DEFAULT') or None
+
+# After a search, the episode lists of the first EPISODE_PREFETCH_TOP_N results are scraped in
+# the background (EPISODE_PREFETCH_CONCURRENCY at a time, 0 disables) and kept for
+# EPISODE_PREFETCH_TTL seconds, so adding one of them skips the scrape
+EPISODE_PREFETCH_TOP_N = int(os.environ.get('EPISODE_PREFETCH_TOP_N', '3'))
+EPISODE_PREFETCH_CONCURRENCY = int(os.environ.get('EPISODE_PREFETCH_CONCURRENCY', '2'))
+EPISODE_PREFETCH_TTL = int(os.environ.get('EPISODE_PREFETCH_TTL', '1800'))
 
 # Eager mode (sync) only if explicitly enabled via env
 CELERY_TASK_ALWAYS_EAGER = os.environ.get('CELERY_ALWAYS_EAGER', 'False') == 'True'
@@ -1,14 +1,48 @@
 from django.contrib import admin
-from .models import Anime, Episode
+from .models import Anime, Episode, DownloadIntent, CatalogEntry, AddAnimeJob, MediaRefresh, DownloadAttempt, DownloadDailyStats, HostConcurrency
 
 @admin.register(Anime)
 class AnimeAdmin(admin.ModelAdmin):
-    list_display = ('title', 'status', 'created_at')
+    list_display = ('title', 'status', 'storage_node', 'next_check_at', 'airing_finished', 'created_at')
     search_fields = ('title',)
-    list_filter = ('status',)
+    list_filter = ('status', 'storage_node', 'airing_finished')
 
 @admin.register(Episode)
 class EpisodeAdmin(admin.ModelAdmin):
     list_display = ('anime', 'number', 'status', 'progress', 'updated_at')
     search_fields = ('anime__title', 'number')
     list_filter = ('status', 'anime')
+
+@admin.register(DownloadIntent)
+class DownloadIntentAdmin(admin.ModelAdmin):
+    list_display = ('episode', 'attempts', 'created_at')
+    search_fields = ('episode__anime__title',)
+
+@admin.register(CatalogEntry)
+class CatalogEntryAdmin(admin.ModelAdmin):
+    list_display = ('title_eng', 'title', 'year', 'episodes_count', 'synced_at')
+    search_fields = ('title_eng', 'title', 'slug')
+
+@admin.register(AddAnimeJob)
+class AddAnimeJobAdmin(admin.ModelAdmin):
+    list_display = ('title', 'status', 'anime', 'created_at')
+    list_filter = ('status',)
+
+@admin.register(MediaRefresh)
+class MediaRefreshAdmin(admin.ModelAdmin):
+    list_display = ('path', 'first_event_at', 'due_at')
+
+@admin.register(DownloadAttempt)
+class DownloadAttemptAdmin(admin.ModelAdmin):
+    list_display = ('episode', 'outcome', 'host', 'bytes', 'average_speed', 'ttfb_ms', 'finished_at')
+    list_filter = ('outcome', 'host')
+    search_fields = ('episode__anime__title',)
+
+@admin.register(DownloadDailyStats)
+class DownloadDailyStatsAdmin(admin.ModelAdmin):
+    list_display = ('day', 'host', 'attempts', 'completed', 'failed', 'bytes', 'peak_speed')
+    list_filter = ('host',)
+
+@admin.register(HostConcurrency)
+class HostConcurrencyAdmin(admin.ModelAdmin):
+    list_display = ('host', 'limit', 'throughput', 'ttfb_ms', 'congestion_events', 'updated_at')
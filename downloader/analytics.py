@@ -0,0 +1,170 @@
+import time
+from datetime import timedelta
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum, Max
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from .models import Episode, DownloadAttempt, DownloadDailyStats
+
+# Episode status after an attempt -> recorded outcome
+OUTCOMES = {
+    'completed': 'completed',
+    'failed': 'failed',
+    'cancelled': 'cancelled',
+    'skipped': 'skipped',
+    'waiting_for_space': 'waiting_for_space',
+}
+
+
+def attempt_outcome(status, error):
+    if status in OUTCOMES:
+        return OUTCOMES[status]
+    if error:
+        # Pending again after an error: retry_or_fail put it back, the attempt itself failed
+        return 'retried'
+    # Anything else (pending again, deleted) means the attempt was taken away
+    return 'requeued'
+
+
+class AttemptRecorder:
+    """
+    Collects the numbers of one download attempt in memory and writes them once at the end.
+    """
+    def __init__(self, episode_id):
+        self.episode_id = episode_id
+        self.claimed = False
+        self.started_at = timezone.now()
+        self.host = ''
+        self.ttfb_ms = None
+        self.status_code = None
+        self.error = None
+        self.bytes = 0
+        self.peak_speed = None
+        self._transfer_start = None
+        self._window_start = None
+        self._window_bytes = 0
+
+    def start_transfer(self, ttfb=None, status_code=None):
+        self.ttfb_ms = int(ttfb * 1000) if ttfb is not None else None
+        self.status_code = status_code
+        self._transfer_start = self._window_start = time.monotonic()
+
+    def update(self, downloaded):
+        """Called per chunk: peak speed is measured over windows of at least one second."""
+        self.bytes = downloaded
+        now = time.monotonic()
+        if now - self._window_start >= 1:
+            speed = (downloaded - self._window_bytes) / (now - self._window_start)
+            self.peak_speed = max(self.peak_speed or 0, speed)
+            self._window_start, self._window_bytes = now, downloaded
+
+    @property
+    def transfer_seconds(self):
+        return time.monotonic() - self._transfer_start if self._transfer_start else 0
+
+    def save(self):
+        """
+        Write the attempt and fold it into the daily rollup. Never raises: statistics
+        must not break a download.
+        """
+        if not self.claimed:
+            return None
+        try:
+            status = Episode.objects.filter(id=self.episode_id).values_list('status', flat=True).first()
+            seconds = self.transfer_seconds
+            average_speed = self.bytes / seconds if seconds > 0 else None
+            attempt = DownloadAttempt(
+                episode_id=self.episode_id if status else None,
+                started_at=self.started_at,
+                finished_at=timezone.now(),
+                bytes=self.bytes,
+                average_speed=average_speed,
+                peak_speed=self.peak_speed or average_speed,
+                host=self.host,
+                ttfb_ms=self.ttfb_ms,
+                status_code=self.status_code,
+                outcome=attempt_outcome(status, self.error),
+                error_class=type(self.error).__name__ if self.error else '',
+            )
+            with transaction.atomic():
+                attempt.save()
+                add_to_rollup(attempt, seconds)
+            return attempt
+        except Exception as e:
+            print(f"Could not record download attempt for episode {self.episode_id}: {e}")
+            return None
+
+def add_to_rollup(attempt, transfer_seconds):
+    day = timezone.localdate(attempt.finished_at)
+    try:
+        with transaction.atomic():
+            DownloadDailyStats.objects.get_or_create(day=day, host=attempt.host)
+    except IntegrityError:
+        # Created concurrently by another worker, the update below still applies
+        pass
+    DownloadDailyStats.objects.filter(day=day, host=attempt.host).update(
+        attempts=F('attempts') + 1,
+        completed=F('completed') + int(attempt.outcome == 'completed'),
+        # Retried attempts failed too, even if the episode may still complete later
+        failed=F('failed') + int(attempt.outcome in ('failed', 'retried')),
+        bytes=F('bytes') + attempt.bytes,
+        transfer_seconds=F('transfer_seconds') + transfer_seconds,
+        peak_speed=Greatest(F('peak_speed'), attempt.peak_speed or 0),
+    )
+
+def rebuild_rollups(since=None):
+    """
+    Recompute DownloadDailyStats from the attempts table, e.g. after pruning attempts.
+    """
+    attempts = DownloadAttempt.objects.all()
+    stats = DownloadDailyStats.objects.all()
+    if since:
+        attempts = attempts.filter(finished_at__date__gte=since)
+        stats = stats.filter(day__gte=since)
+    with transaction.atomic():
+        stats.delete()
+        for attempt in attempts.order_by('id').iterator(chunk_size=2000):
+            seconds = attempt.bytes / attempt.average_speed if attempt.average_speed else 0
+            add_to_rollup(attempt, seconds)
+
+ROLLUP_TOTALS = ('attempts', 'completed', 'failed', 'bytes', 'transfer_seconds')
+
+def _summarize(queryset, *group_by):
+    """
+    Sum the rollup counters (grouped by `group_by` if given) and derive speed and failure rate.
+    """
+    sums = {f'sum_{field}': Sum(field) for field in ROLLUP_TOTALS}
+    if group_by:
+        rows = queryset.values(*group_by).annotate(**sums, peak=Max('peak_speed')).order_by(*group_by)
+    else:
+        rows = [queryset.aggregate(**sums, peak=Max('peak_speed'))]
+
+    summary = []
+    for row in rows:
+        row = {key.removeprefix('sum_'): value for key, value in row.items()}
+        for field in ROLLUP_TOTALS + ('peak',):
+            row[field] = row[field] or 0
+        row['speed'] = row['bytes'] / row['transfer_seconds'] if row['transfer_seconds'] else None
+        row['failure_rate'] = row['failed'] * 100 / row['attempts'] if row['attempts'] else 0
+        summary.append(row)
+    return summary
+
+def analytics_summary(days=30):
+    """
+    Data for the analytics page, read from the daily rollups only.
+    """
+    since = timezone.localdate() - timedelta(days=days - 1)
+    stats = DownloadDailyStats.objects.filter(day__gte=since)
+    per_day = _summarize(stats, 'day')
+    per_host = sorted(_summarize(stats, 'host'), key=lambda row: row['bytes'], reverse=True)
+    overall, = _summarize(stats)
+
+    # Relative bar widths for the page
+    max_bytes = max((row['bytes'] for row in per_day), default=0)
+    for row in per_day:
+        row['bar'] = row['bytes'] * 100 // max_bytes if max_bytes else 0
+    max_speed = max((row['speed'] or 0 for row in per_host), default=0)
+    for row in per_host:
+        row['bar'] = round((row['speed'] or 0) * 100 / max_speed) if max_speed else 0
+
+    return {'days': days, 'per_day': per_day, 'per_host': per_host, 'overall': overall}
@@ -0,0 +1,91 @@
+import asyncio
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from .mirrors import mirror_monitor
+from .tracing import span
+from .catalog import search_catalog, store_catalog_records, normalize_title
+from .utils import animeunity_headers, csrf_headers, parse_anime_record, search_anime
+
+# In-flight upstream searches, keyed by (event loop, normalized query)
+_inflight = {}
+
+
+async def async_search_anime(query):
+    """
+    Async counterpart of utils.search_anime built on httpx.
+    Falls back to the cloudscraper implementation (in a thread) when the plain
+    client is rejected, e.g. by a Cloudflare challenge, or no mirror answers.
+    """
+    # Only needed on catalog misses, keep it out of web process startup
+    import httpx
+
+    timeout = getattr(settings, 'UPSTREAM_TIMEOUT', 15)
+    records = None
+    for base_url in mirror_monitor.candidates():
+        headers = animeunity_headers(base_url)
+        try:
+            async with httpx.AsyncClient(headers=headers, timeout=timeout, follow_redirects=True) as client:
+                # 1. Hit homepage for cookies/CSRF
+                with span('upstream.homepage', url=base_url, method='GET') as current:
+                    resp = await client.get(base_url)
+                    current.set(status_code=resp.status_code, bytes=len(resp.content))
+                resp.raise_for_status()
+                headers.update(csrf_headers(resp.text, client.cookies.get('XSRF-TOKEN')))
+
+                # 2. Search
+                with span('upstream.livesearch', url=f"{base_url}/livesearch", method='POST') as current:
+                    res = await client.post(f"{base_url}/livesearch", json={"title": query}, headers=headers)
+                    current.set(status_code=res.status_code, bytes=len(res.content))
+                res.raise_for_status()
+                records = res.json().get('records', [])
+                break
+        except httpx.TransportError as e:
+            # Unreachable or timing out: try the next mirror
+            mirror_monitor.mark_down(base_url, e)
+        except Exception as e:
+            print(f"Async search failed ({e}), falling back to cloudscraper")
+            break
+
+    if records is None:
+        return await sync_to_async(search_anime, thread_sensitive=False)(query)
+
+    await sync_to_async(store_catalog_records)(records)
+    return [parse_anime_record(record, base_url) for record in records]
+
+async def coalesced_search_anime(query):
+    """
+    Share one upstream search between all concurrent callers asking for the same query.
+    """
+    loop = asyncio.get_running_loop()
+    key = (loop, normalize_title(query))
+    task = _inflight.get(key)
+    if task is None:
+        task = loop.create_task(async_search_anime(query))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    # shield: a caller that disconnects must not cancel the search for the others
+    return await asyncio.shield(task)
+
+async def find_anime_async(query, limit=20):
+    """
+    Async counterpart of catalog.find_anime: local catalog first, coalesced upstream on a miss.
+    Upstream gets CATALOG_UPSTREAM_DEADLINE seconds before the local results are served.
+    """
+    try:
+        local_results, best_score = await sync_to_async(search_catalog)(query, limit=limit)
+    except Exception as e:
+        print(f"Catalog search failed: {e}")
+        local_results, best_score = [], 0
+
+    if local_results and best_score >= getattr(settings, 'CATALOG_MIN_SCORE', 0.5):
+        return local_results
+
+    try:
+        # The shared search is shielded: it keeps running for the others and the catalog
+        results = await asyncio.wait_for(
+            coalesced_search_anime(query), getattr(settings, 'CATALOG_UPSTREAM_DEADLINE', 5)
+        )
+    except asyncio.TimeoutError:
+        print(f"Upstream search for {query!r} too slow, serving local results")
+        return local_results
+    return results or local_results
@@ -0,0 +1,223 @@
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from django.conf import settings
+from django.db.models import Count, Max
+from .models import CatalogEntry
+
+CATALOG_FIELDS = ['slug', 'title', 'title_eng', 'year', 'episodes_count', 'cover_image', 'plot', 'studio', 'synced_at']
+
+
+def normalize_title(text):
+    """
+    Lowercase, strip accents and punctuation so "Shingeki no Kyojin: The Final" ~ "shingeki no kyojin the final".
+    """
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(re.sub(r'[^0-9a-z]+', ' ', text.lower()).split())
+
+def trigrams(text):
+    """
+    pg_trgm style trigrams: every word padded with two leading and one trailing space.
+    """
+    grams = set()
+    for word in normalize_title(text).split():
+        padded = f"  {word} "
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return grams
+
+def store_catalog_records(records):
+    """
+    Upsert AnimeUnity JSON records (livesearch or archive pages) into the catalog.
+    Records identical to the stored row are skipped, so repeated searches neither touch
+    synced_at nor force every process to rebuild its index. Returns the rows written.
+    """
+    entries = []
+    for record in records:
+        if not record.get('id') or not record.get('slug'):
+            continue
+        episodes_count = record.get('episodes_count')
+        entries.append(CatalogEntry(
+            animeunity_id=record['id'],
+            slug=record['slug'],
+            title=record.get('title'),
+            title_eng=record.get('title_eng'),
+            year=str(record['date'])[:10] if record.get('date') else None,
+            episodes_count=int(episodes_count) if str(episodes_count or '').isdigit() else None,
+            cover_image=record.get('imageurl'),
+            plot=record.get('plot'),
+            studio=record.get('studio'),
+        ))
+    if not entries:
+        return 0
+    fields = [field for field in CATALOG_FIELDS if field != 'synced_at']
+    stored = {
+        row[0]: row[1:]
+        for row in CatalogEntry.objects.filter(
+            animeunity_id__in=[entry.animeunity_id for entry in entries]
+        ).values_list('animeunity_id', *fields)
+    }
+    entries = [
+        entry for entry in entries
+        if stored.get(entry.animeunity_id) != tuple(getattr(entry, field) for field in fields)
+    ]
+    if not entries:
+        return 0
+    try:
+        CatalogEntry.objects.bulk_create(
+            entries,
+            update_conflicts=True,
+            unique_fields=['animeunity_id'],
+            update_fields=CATALOG_FIELDS,
+        )
+    except Exception as e:
+        print(f"Failed to store catalog records: {e}")
+        return 0
+    catalog_index.invalidate()
+    return len(entries)
+
+def sync_catalog(page_delay=0.5):
+    """
+    Walk the AnimeUnity archive and refresh the local catalog.
+    Returns the number of records stored.
+    """
+    from .mirrors import with_failover
+    from .tracing import upstream_post
+    from .utils import animeunity_session
+
+    base_url, scraper, headers = with_failover(lambda base_url: (base_url, *animeunity_session(base_url)))
+    archive_url = f"{base_url}/archivio/get-animes"
+    payload = {
+        "title": False, "type": False, "year": False, "order": False,
+        "status": False, "genres": False, "season": False, "dubbed": False,
+        "offset": 0,
+    }
+    stored = 0
+    while True:
+        res = upstream_post(scraper, archive_url, 'upstream.archive', json=payload, headers=headers)
+        res.raise_for_status()
+        data = res.json()
+        records = data.get('records', [])
+        if not records:
+            break
+        stored += store_catalog_records(records)
+        payload['offset'] += len(records)
+        if data.get('tot') and payload['offset'] >= int(data['tot']):
+            break
+        # Be gentle with upstream, this runs in the background anyway
+        time.sleep(page_delay)
+
+    catalog_index.invalidate()
+    print(f"Catalog sync stored {stored} records")
+    return stored
+
+
+class CatalogIndex:
+    """
+    In-memory trigram index over CatalogEntry titles.
+    Built lazily per process and rebuilt when the table changes.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = []
+        # One document per distinct title of an entry: (entry index, normalized title, trigrams)
+        self._docs = []
+        self._postings = {}
+        self._version = None
+        self._checked_at = 0
+
+    def invalidate(self):
+        self._checked_at = 0
+
+    def _current_version(self):
+        stats = CatalogEntry.objects.aggregate(count=Count('id'), latest=Max('synced_at'))
+        return stats['count'], stats['latest']
+
+    def ensure_fresh(self):
+        refresh = getattr(settings, 'CATALOG_INDEX_REFRESH', 30)
+        if time.monotonic() - self._checked_at < refresh:
+            return
+        with self._lock:
+            if time.monotonic() - self._checked_at < refresh:
+                return
+            version = self._current_version()
+            if version != self._version:
+                self._build()
+                self._version = version
+            self._checked_at = time.monotonic()
+
+    def _build(self):
+        entries, docs, postings = [], [], {}
+        for entry in CatalogEntry.objects.all().iterator():
+            for name in {normalize_title(entry.title_eng), normalize_title(entry.title)}:
+                if not name:
+                    continue
+                name_grams = trigrams(name)
+                for gram in name_grams:
+                    postings.setdefault(gram, []).append(len(docs))
+                docs.append((len(entries), name, name_grams))
+            entries.append(entry)
+        # Swap everything at once so concurrent searches never see a half-built index
+        self._entries, self._docs, self._postings = entries, docs, postings
+
+    def search(self, query, limit=20):
+        """
+        Return [(score, CatalogEntry)] best first. Score is trigram similarity in [0, 1],
+        prefix matches are lifted above 0.75.
+        """
+        self.ensure_fresh()
+        entries, docs, postings = self._entries, self._docs, self._postings
+        norm = normalize_title(query)
+        query_grams = trigrams(norm)
+        if not query_grams:
+            return []
+
+        shared = Counter()
+        for gram in query_grams:
+            for doc in postings.get(gram, ()):
+                shared[doc] += 1
+
+        best = {}
+        for doc, common in shared.items():
+            entry_idx, name, name_grams = docs[doc]
+            score = common / (len(query_grams) + len(name_grams) - common)
+            # Search-as-you-type: partial words at the start of a title are a strong signal
+            if name.startswith(norm) or f" {norm}" in name:
+                score = 0.75 + score / 4
+            if score > best.get(entry_idx, 0):
+                best[entry_idx] = score
+
+        ranked = sorted(best.items(), key=lambda x: (-x[1], x[0]))[:limit]
+        return [(score, entries[idx]) for idx, score in ranked]
+
+catalog_index = CatalogIndex()
+
+def search_catalog(query, limit=20):
+    """
+    Local search: returns (results, best_score) with results shaped like utils.search_anime.
+    """
+    hits = catalog_index.search(query, limit=limit)
+    results = [entry.to_result() for _, entry in hits]
+    return results, (hits[0][0] if hits else 0)
+
+def find_anime(query, limit=20):
+    """
+    Answer from the local catalog and only go upstream on a miss.
+    Falls back to the fuzzy local results if upstream is slow or down.
+    """
+    from .utils import search_anime
+
+    try:
+        local_results, best_score = search_catalog(query, limit=limit)
+    except Exception as e:
+        print(f"Catalog search failed: {e}")
+        local_results, best_score = [], 0
+
+    if local_results and best_score >= getattr(settings, 'CATALOG_MIN_SCORE', 0.5):
+        return local_results
+
+    results = search_anime(query)
+    return results or local_results
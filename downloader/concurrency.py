@@ -0,0 +1,160 @@
+import math
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .models import Episode, HostConcurrency
+
+# Responses that mean the CDN wants fewer connections from us
+CONGESTION_STATUS_CODES = {429, 503}
+# Transport errors that usually come from an overloaded host rather than a bad episode
+CONGESTION_ERRORS = {'ConnectionError', 'ConnectTimeout', 'ReadTimeout', 'Timeout', 'ChunkedEncodingError'}
+# Weight of the newest sample in the moving averages
+EWMA_ALPHA = 0.3
+# Aggregate throughput this far below the baseline means the last increase hurt
+THROUGHPUT_TOLERANCE = 0.1
+
+
+def _bounds():
+    minimum = getattr(settings, 'HOST_CONCURRENCY_MIN', 1)
+    maximum = getattr(settings, 'HOST_CONCURRENCY_MAX', 8)
+    return minimum, max(minimum, maximum)
+
+def _ewma(previous, sample):
+    return sample if previous is None else previous + EWMA_ALPHA * (sample - previous)
+
+def _locked_state(host):
+    """
+    The host's row, locked until the end of the caller's transaction.
+    """
+    minimum, maximum = _bounds()
+    initial = min(max(getattr(settings, 'HOST_CONCURRENCY_INITIAL', 2), minimum), maximum)
+    try:
+        with transaction.atomic():
+            HostConcurrency.objects.get_or_create(host=host, defaults={'limit': initial})
+    except IntegrityError:
+        # Created concurrently by another worker
+        pass
+    return HostConcurrency.objects.select_for_update().get(host=host)
+
+def running_transfers(host, exclude_id=None):
+    return Episode.objects.filter(
+        status='downloading', transfer_host=host, lease_expires_at__gt=timezone.now(),
+    ).exclude(id=exclude_id).count()
+
+def try_acquire_slot(episode_id, worker_id, host):
+    """
+    Count an owned episode against `host`'s limit if a slot is free.
+    The slot is given back by release_episode clearing transfer_host.
+    """
+    with transaction.atomic():
+        state = _locked_state(host)
+        if running_transfers(host, exclude_id=episode_id) >= state.slots:
+            return False
+        return Episode.objects.filter(id=episode_id, worker_id=worker_id, status='downloading').update(
+            transfer_host=host
+        ) == 1
+
+def wait_for_slot(episode_id, worker_id, host, heartbeat, wait=0):
+    """
+    Poll for a transfer slot on `host` for up to `wait` seconds (0: try once), renewing
+    the lease with heartbeat() meanwhile. Returns 'acquired', 'lost' (heartbeat failed)
+    or 'timeout'.
+    """
+    deadline = time.monotonic() + wait
+    poll = getattr(settings, 'HOST_SLOT_POLL_INTERVAL', 2)
+    while True:
+        if try_acquire_slot(episode_id, worker_id, host):
+            return 'acquired'
+        if not heartbeat():
+            return 'lost'
+        if time.monotonic() >= deadline:
+            return 'timeout'
+        time.sleep(poll)
+
+def is_congestion(attempt):
+    return attempt.status_code in CONGESTION_STATUS_CODES or attempt.error_class in CONGESTION_ERRORS
+
+def observe_attempt(attempt):
+    """
+    Feed a finished DownloadAttempt into its host's AIMD controller:
+    - 429/503 or transport errors: multiply the limit by HOST_CONCURRENCY_DECREASE, at most
+      once per HOST_CONCURRENCY_COOLDOWN so one burst of failures counts as one event
+    - time to first byte above HOST_TTFB_FACTOR times its average: same decrease
+    - aggregate throughput below the level measured before the last increase: undo it
+    - otherwise, while the host is saturated, add 1/limit (one slot per round of completions)
+    Returns the updated HostConcurrency, or None when the attempt carries no signal.
+    """
+    if not attempt.host or attempt.outcome in ('skipped', 'cancelled', 'requeued'):
+        return None
+    congested = is_congestion(attempt)
+    if not congested and attempt.outcome != 'completed':
+        # Errors specific to the episode (404, bad file) say nothing about the host
+        return None
+
+    minimum, maximum = _bounds()
+    now = timezone.now()
+    with transaction.atomic():
+        state = _locked_state(attempt.host)
+        old_slots = state.slots
+        cooldown = timedelta(seconds=getattr(settings, 'HOST_CONCURRENCY_COOLDOWN', 30))
+        slow_start = (
+            not congested and attempt.ttfb_ms is not None and state.ttfb_ms
+            and attempt.ttfb_ms > state.ttfb_ms * getattr(settings, 'HOST_TTFB_FACTOR', 3)
+        )
+
+        if congested or slow_start:
+            if not state.last_congestion_at or now - state.last_congestion_at >= cooldown:
+                state.limit = max(minimum, state.limit * getattr(settings, 'HOST_CONCURRENCY_DECREASE', 0.5))
+                state.last_congestion_at = now
+                state.congestion_events += 1
+                state.baseline_throughput = None
+                state.samples_since_change = 0
+                print(f"Host {attempt.host} congested ({attempt.status_code or attempt.error_class or 'slow first byte'}), limit {old_slots} -> {state.slots}")
+        else:
+            # This transfer already gave its slot back, count it as still running
+            running = running_transfers(attempt.host) + 1
+            if attempt.average_speed:
+                state.throughput = _ewma(state.throughput, attempt.average_speed * running)
+            state.samples_since_change += 1
+            regressed = (
+                state.baseline_throughput and state.throughput is not None
+                and state.samples_since_change >= old_slots
+                and state.throughput < state.baseline_throughput * (1 - THROUGHPUT_TOLERANCE)
+            )
+            if regressed:
+                # More streams made everything slower: go back to where we were
+                state.limit = max(minimum, math.floor(state.limit) - 1)
+                state.baseline_throughput = None
+                state.samples_since_change = 0
+                print(f"Host {attempt.host} throughput dropped after increase, limit {old_slots} -> {state.slots}")
+            elif running >= old_slots and state.limit < maximum:
+                state.limit = min(maximum, state.limit + 1 / state.limit)
+                if state.slots > old_slots:
+                    state.baseline_throughput = state.throughput
+                    state.samples_since_change = 0
+
+        if attempt.ttfb_ms is not None and not congested:
+            # Slow samples are included so a lasting change becomes the new normal
+            state.ttfb_ms = _ewma(state.ttfb_ms, attempt.ttfb_ms)
+        state.save()
+    return state
+
+def host_limits():
+    """
+    Current limits with the number of transfers running against each, for the API and analytics page.
+    """
+    limits = []
+    for state in HostConcurrency.objects.all():
+        limits.append({
+            'host': state.host,
+            'limit': state.slots,
+            'running': running_transfers(state.host),
+            'throughput': state.throughput,
+            'ttfb_ms': state.ttfb_ms,
+            'congestion_events': state.congestion_events,
+            'last_congestion_at': state.last_congestion_at,
+            'updated_at': state.updated_at,
+        })
+    return limits
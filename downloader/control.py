@@ -0,0 +1,89 @@
+import re
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import Anime, Episode
+from .dispatch import enqueue_episode_downloads
+
+# action -> (statuses it applies to, status it sets)
+ACTIONS = {
+    'cancel': (('pending', 'waiting_for_space', 'downloading'), 'cancelled'),
+    'skip': (('pending', 'waiting_for_space', 'downloading'), 'skipped'),
+    'resume': (('cancelled', 'skipped', 'failed'), 'pending'),
+    'retry': (('cancelled', 'skipped', 'failed'), 'pending'),
+}
+
+# worker_id is "<host>:<pid>:<task id>" for Celery downloads, fetch_anime uses its own suffix
+TASK_ID_RE = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+
+
+def running_task_ids(worker_ids):
+    task_ids = []
+    for worker_id in worker_ids:
+        task_id = (worker_id or '').rsplit(':', 1)[-1]
+        if TASK_ID_RE.match(task_id):
+            task_ids.append(task_id)
+    return task_ids
+
+def abort_tasks(task_ids):
+    """
+    Interrupt running downloads now instead of at their next heartbeat.
+    SIGUSR1 raises SoftTimeLimitExceeded inside the prefork child running the task,
+    so its cleanup (staged file, attempt record) still runs.
+    Returns the number of tasks signalled.
+    """
+    from celery import current_app
+    from .utils import check_broker_status
+
+    if not task_ids:
+        return 0
+    broker_ok, _ = check_broker_status()
+    if not broker_ok:
+        # The workers still notice the new status at their next heartbeat
+        return 0
+    try:
+        current_app.control.revoke(task_ids, terminate=True, signal='SIGUSR1')
+    except Exception as e:
+        print(f"Could not revoke tasks {task_ids}: {e}")
+        return 0
+    return len(task_ids)
+
+def apply_batch(action, episode_ids=(), anime_ids=(), force=False):
+    """
+    Apply `action` to the given episodes and to every episode of the given animes
+    with one UPDATE, abort the affected running downloads and recompute the status
+    of each affected anime once. With `force` it applies whatever the current status
+    (the single-episode cancel and skip buttons), otherwise only to ACTIONS' statuses.
+    Returns {'updated': <episodes changed>, 'revoked': <tasks signalled>}.
+    """
+    if action not in ACTIONS:
+        raise ValueError(f"Unknown action: {action}")
+    from_statuses, new_status = ACTIONS[action]
+    scope = Q(id__in=list(episode_ids)) | Q(anime_id__in=list(anime_ids))
+    current = ~Q(status=new_status) if force else Q(status__in=from_statuses)
+    now = timezone.now()
+
+    with transaction.atomic():
+        rows = list(
+            Episode.objects.select_for_update()
+            .filter(scope, current)
+            .values_list('id', 'anime_id', 'status', 'worker_id')
+        )
+        ids = [row[0] for row in rows]
+        if new_status == 'pending':
+            Episode.objects.filter(id__in=ids).update(
+                status='pending', progress=0, error_message=None, retries=0, updated_at=now,
+            )
+            enqueue_episode_downloads(ids)
+        else:
+            # Dropping the claim also stops the owner from writing its final state over ours
+            Episode.objects.filter(id__in=ids).update(
+                status=new_status, worker_id=None, lease_expires_at=None, transfer_host=None,
+                reserved_bytes=None, updated_at=now,
+            )
+    running = [worker_id for _, _, status, worker_id in rows if status == 'downloading']
+    revoked = abort_tasks(running_task_ids(running))
+
+    for anime in Anime.objects.filter(id__in={row[1] for row in rows}):
+        anime.update_status()
+    return {'updated': len(ids), 'revoked': revoked}
@@ -0,0 +1,138 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import DownloadIntent, AddAnimeJob, Episode
+from .utils import check_broker_status, broker_monitor
+from .tracing import activate, current_traceparent
+
+
+def enqueue_episode_downloads(episode_ids, delay=None):
+    """
+    Record download intents for the given episodes.
+    Call it inside the transaction that saved the episodes: the intents commit
+    (or roll back) together with them, and are handed to the broker right after
+    commit when it is reachable. Otherwise the dispatcher picks them up later.
+    With `delay` (seconds) the dispatcher sends them once it has passed.
+    """
+    episode_ids = [int(i) for i in episode_ids]
+    if not episode_ids:
+        return []
+
+    # Don't queue an episode twice while it is still waiting in the outbox
+    waiting = set(
+        DownloadIntent.objects.filter(episode_id__in=episode_ids).values_list('episode_id', flat=True)
+    )
+    traceparent = current_traceparent()
+    not_before = timezone.now() + timedelta(seconds=delay) if delay else None
+    intents = DownloadIntent.objects.bulk_create([
+        DownloadIntent(episode_id=i, traceparent=traceparent, not_before=not_before)
+        for i in dict.fromkeys(episode_ids) if i not in waiting
+    ])
+    intent_ids = [intent.id for intent in intents if intent.id]
+    if not_before:
+        return intents
+
+    def _dispatch_now():
+        broker_ok, _ = check_broker_status()
+        if broker_ok and intent_ids:
+            drain_outbox(intent_ids=intent_ids)
+
+    transaction.on_commit(_dispatch_now)
+    return intents
+
+def drain_outbox(batch_size=None, intent_ids=None):
+    """
+    Send one batch of pending intents to Celery and delete the sent ones.
+    Rows are locked with SKIP LOCKED so several dispatchers (or a web process
+    and the dispatcher) never send the same intent concurrently.
+    Returns the number of dispatched intents.
+    """
+    from .tasks import download_episode_task
+    from .placement import download_queue
+
+    batch_size = batch_size or getattr(settings, 'OUTBOX_BATCH_SIZE', 100)
+    dispatched = []
+
+    with transaction.atomic():
+        # Lock the intents only, not the episode and anime rows joined by the exclude
+        qs = DownloadIntent.objects.select_for_update(skip_locked=True, of=('self',)).exclude(
+            # Sent once the anime folder has reached its new storage node
+            episode__anime__moving=True
+        ).filter(Q(not_before__isnull=True) | Q(not_before__lte=timezone.now())).order_by('id')
+        if intent_ids:
+            qs = qs.filter(id__in=intent_ids)
+        batch = list(qs[:batch_size])
+        nodes = dict(
+            Episode.objects.filter(id__in=[intent.episode_id for intent in batch]).values_list('id', 'anime__storage_node')
+        )
+
+        for intent in batch:
+            # Downloads run on the node that stores the anime, so files are written to local disk
+            queue = download_queue(nodes.get(intent.episode_id))
+            options = {'queue': queue} if queue else {}
+            try:
+                # retry=False: fail fast instead of blocking while holding the row locks
+                with activate(intent.traceparent):
+                    download_episode_task.apply_async(args=[intent.episode_id], retry=False, **options)
+            except Exception as e:
+                print(f"Dispatch failed for episode {intent.episode_id}: {e}")
+                broker_monitor.mark_down(e)
+                DownloadIntent.objects.filter(id=intent.id).update(
+                    attempts=intent.attempts + 1, last_error=str(e)
+                )
+                break
+            dispatched.append(intent.id)
+
+        if dispatched:
+            DownloadIntent.objects.filter(id__in=dispatched).delete()
+
+    return len(dispatched)
+
+def enqueue_add_job(payload, title):
+    """
+    Create an AddAnimeJob and hand it to Celery after commit when the broker is up.
+    """
+    job = AddAnimeJob.objects.create(
+        payload=payload, title=title or payload.get('title') or '', traceparent=current_traceparent()
+    )
+
+    def _dispatch_now():
+        broker_ok, _ = check_broker_status()
+        if broker_ok:
+            drain_add_jobs(job_ids=[job.id])
+
+    transaction.on_commit(_dispatch_now)
+    return job
+
+def drain_add_jobs(batch_size=None, job_ids=None):
+    """
+    Send queued add-anime jobs that never reached the broker. Returns the number sent.
+    """
+    from .tasks import add_anime_task
+
+    batch_size = batch_size or getattr(settings, 'OUTBOX_BATCH_SIZE', 100)
+    dispatched = []
+
+    with transaction.atomic():
+        qs = AddAnimeJob.objects.select_for_update(skip_locked=True).filter(
+            status='queued', dispatched_at__isnull=True
+        ).order_by('created_at')
+        if job_ids:
+            qs = qs.filter(id__in=job_ids)
+
+        for job in qs[:batch_size]:
+            try:
+                with activate(job.traceparent):
+                    add_anime_task.apply_async(args=[str(job.id)], retry=False)
+            except Exception as e:
+                print(f"Dispatch failed for add job {job.id}: {e}")
+                broker_monitor.mark_down(e)
+                break
+            dispatched.append(job.id)
+
+        if dispatched:
+            AddAnimeJob.objects.filter(id__in=dispatched).update(dispatched_at=timezone.now())
+
+    return len(dispatched)
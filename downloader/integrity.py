@@ -0,0 +1,102 @@
+import hashlib
+import struct
+
+# Transport errors raised mid-body when the connection drops; a new attempt usually succeeds
+RETRYABLE_ERRORS = {
+    'ChunkedEncodingError', 'ConnectionError', 'ContentDecodingError', 'ReadTimeout',
+    'ConnectTimeout', 'Timeout', 'ProtocolError', 'IncompleteRead', 'ConnectionResetError',
+}
+
+
+class TransferIntegrityError(Exception):
+    """
+    The received body is not the complete, well-formed file. Retryable: the bytes
+    were lost or mangled in transit, not wrong at the source.
+    """
+    retryable = True
+
+
+def is_retryable(error):
+    return getattr(error, 'retryable', False) or type(error).__name__ in RETRYABLE_ERRORS
+
+
+class BoxWalker:
+    """
+    Follow the top-level MP4 box headers through a byte stream, chunk by chunk,
+    without keeping more than one header in memory.
+    """
+    def __init__(self):
+        self.offset = 0
+        self.next_box = 0
+        self.types = []
+        self.error = None
+        self._header = b''
+
+    def feed(self, chunk):
+        start = self.offset
+        self.offset += len(chunk)
+        if self.next_box is None:
+            # Inside the last box, which runs to the end of the file
+            return
+        while self.error is None and self.next_box + len(self._header) < self.offset:
+            position = self.next_box + len(self._header) - start
+            wanted = 16 if len(self._header) >= 8 and self._header[:4] == b'\x00\x00\x00\x01' else 8
+            self._header += chunk[position:position + wanted - len(self._header)]
+            if len(self._header) < wanted:
+                continue
+            size, box_type = struct.unpack('>I4s', self._header[:8])
+            if size == 1:
+                if len(self._header) < 16:
+                    continue
+                size = struct.unpack('>Q', self._header[8:16])[0]
+            elif size == 0:
+                # Last box, runs to the end of the file
+                self.types.append(box_type)
+                self.next_box = None
+                self._header = b''
+                return
+            if size < len(self._header):
+                self.error = f"Invalid size for box {box_type!r} at {self.next_box}"
+                return
+            self.types.append(box_type)
+            self.next_box += size
+            self._header = b''
+
+    @property
+    def complete(self):
+        """True when the stream ended exactly at the end of its last box."""
+        return self.next_box is None or (self.next_box == self.offset and not self._header)
+
+
+class StreamVerifier:
+    """
+    Checks a download in the same pass that writes it: byte count against
+    Content-Length, a SHA-256 of the body and the MP4 top-level box structure.
+    """
+    def __init__(self, expected_length=None):
+        self.expected_length = expected_length or None
+        self.bytes = 0
+        self.hash = hashlib.sha256()
+        self.boxes = BoxWalker()
+
+    def update(self, chunk):
+        self.bytes += len(chunk)
+        self.hash.update(chunk)
+        self.boxes.feed(chunk)
+
+    def verify(self):
+        """
+        Raise TransferIntegrityError if the body is incomplete or not an MP4.
+        Returns the hex SHA-256 of the body.
+        """
+        if self.expected_length and self.bytes != self.expected_length:
+            raise TransferIntegrityError(f"Received {self.bytes} of {self.expected_length} bytes")
+        if self.boxes.error:
+            raise TransferIntegrityError(f"Corrupt MP4: {self.boxes.error}")
+        if not self.boxes.complete:
+            raise TransferIntegrityError(f"Truncated MP4: body ends inside a box ({self.bytes} bytes)")
+        missing = [name for name in (b'ftyp', b'moov') if name not in self.boxes.types]
+        if missing:
+            names = ', '.join(name.decode() for name in missing)
+            raise TransferIntegrityError(f"Not a complete MP4: no {names} box")
+        return self.hash.hexdigest()
@@ -0,0 +1,243 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+from difflib import SequenceMatcher
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import Anime, Episode, CatalogEntry, AddAnimeJob
+from .dispatch import enqueue_episode_downloads
+from .placement import choose_node
+from .prefetch import cached_episode_list
+from .catalog import find_anime, normalize_title
+from .utils import clean_filename, get_episode_urls, save_anime_metadata, search_anime
+
+
+def ingest_animes(scraped, enqueue=True):
+    """
+    Write a batch of scraped animes to the library in one transaction.
+    `scraped` is a list of (result, episodes_urls, genres) where result is a
+    search result dict. Episodes not yet completed or downloading are (re)set to
+    pending and, unless `enqueue` is False, queued through the outbox.
+    Returns [(anime, num_episodes)].
+    """
+    added = []
+    with transaction.atomic():
+        pending_ids = []
+        for result, episodes_urls, genres in scraped:
+            defaults = {
+                'title': result['title'],
+                'directory_name': clean_filename(result['title']),
+                'cover_image': result.get('cover_image'),
+                'plot': result.get('plot'),
+                'slug': result.get('slug'),
+                'year': result.get('year'),
+                'studio': result.get('studio'),
+            }
+            if result.get('id'):
+                defaults['animeunity_id'] = result['id']
+            if genres:
+                defaults['genres'] = ",".join(genres)
+
+            # Match on the AnimeUnity id when known: the stored URL may be on another mirror
+            defaults['source_url'] = result['url']
+            if result.get('id') and Anime.objects.filter(animeunity_id=result['id']).exists():
+                anime, created = Anime.objects.update_or_create(animeunity_id=result['id'], defaults=defaults)
+            else:
+                anime, created = Anime.objects.update_or_create(source_url=result['url'], defaults=defaults)
+            if created and not anime.storage_node:
+                anime.storage_node = choose_node()
+                if anime.storage_node:
+                    Anime.objects.filter(id=anime.id).update(storage_node=anime.storage_node)
+
+            existing = {ep.number: ep for ep in anime.episodes.all()}
+            Episode.objects.bulk_create([
+                Episode(anime=anime, number=str(ep_num), source_url=ep_url)
+                for ep_num, ep_url in episodes_urls
+                if str(ep_num) not in existing
+            ])
+
+            to_queue = anime.episodes.filter(
+                number__in=[str(ep_num) for ep_num, _ in episodes_urls]
+            ).exclude(status__in=['completed', 'downloading'])
+            ids = list(to_queue.values_list('id', flat=True))
+            Episode.objects.filter(id__in=ids).update(status='pending')
+            pending_ids.extend(ids)
+            added.append((anime, len(episodes_urls)))
+
+        if enqueue:
+            enqueue_episode_downloads(pending_ids)
+
+    for anime, _ in added:
+        anime.update_status()
+    return added
+
+def add_anime(result, enqueue=True):
+    """
+    Scrape a search result's episode list, add it to the library and queue its episodes.
+    A list prefetched after the search (prefetch.py) is used when still fresh.
+    Returns (anime, num_episodes).
+    """
+    episodes_urls, genres = cached_episode_list(result['url']) or get_episode_urls(result['url'])
+    (anime, num_episodes), = ingest_animes([(result, episodes_urls, genres)], enqueue=enqueue)
+
+    # Save metadata files (nfo and poster)
+    save_anime_metadata(anime)
+    return anime, num_episodes
+
+def find_exact_match(title):
+    """
+    Search upstream and return the result whose title matches exactly (case-insensitive).
+    """
+    for result in search_anime(title):
+        if result['title'].lower() == title.lower():
+            return result
+    return None
+
+def run_add_job(job_id):
+    """
+    Execute a queued AddAnimeJob. Only one worker can move it from queued to running.
+    """
+    if not AddAnimeJob.objects.filter(id=job_id, status='queued').update(status='running'):
+        return None
+
+    job = AddAnimeJob.objects.get(id=job_id)
+    try:
+        result = job.payload
+        if not result.get('url') and 'items' not in result:
+            result = find_exact_match(job.payload.get('title', ''))
+            if not result:
+                raise Exception(f'No exact match found for "{job.title}"')
+
+        if 'items' in result:
+            # Bulk import: touch the job as items resolve so the reaper knows it is alive
+            job.report = bulk_import(
+                result['items'],
+                min_confidence=result.get('min_confidence'),
+                dry_run=bool(result.get('dry_run')),
+                on_progress=lambda: AddAnimeJob.objects.filter(id=job_id).update(updated_at=timezone.now()),
+            )
+            job.num_episodes = sum(entry.get('episodes', 0) for entry in job.report)
+            job.status = 'completed'
+        else:
+            anime, num_episodes = add_anime(result)
+            job.anime = anime
+            job.num_episodes = num_episodes
+            job.status = 'completed'
+    except Exception as e:
+        print(f"Add job {job_id} failed: {e}")
+        job.status = 'failed'
+        job.error_message = str(e)
+    job.save()
+    return job
+
+def title_confidence(query, result):
+    """
+    Similarity in [0, 1] between what the user typed and a search result title.
+    """
+    return SequenceMatcher(None, normalize_title(query), normalize_title(result['title'])).ratio()
+
+def resolve_item(item):
+    """
+    Resolve one watchlist entry (title, AnimeUnity id or AnimeUnity URL) to a search result.
+    Returns (result or None, confidence).
+    """
+    item = str(item).strip()
+    url_match = re.search(r'/anime/(\d+)-([^/?#]+)', item)
+    if item.isdigit() or url_match:
+        animeunity_id = int(url_match.group(1) if url_match else item)
+        entry = CatalogEntry.objects.filter(animeunity_id=animeunity_id).first()
+        if entry:
+            return entry.to_result(), 1.0
+        if url_match:
+            # A URL missing from the catalog: the id and slug are enough to get started
+            slug = url_match.group(2)
+            return {'title': slug.replace('-', ' ').title(), 'url': item, 'id': animeunity_id, 'slug': slug}, 1.0
+        return None, 0
+
+    best, best_score = None, 0
+    for result in find_anime(item):
+        score = title_confidence(item, result)
+        if score > best_score:
+            best, best_score = result, score
+    return best, round(best_score, 3)
+
+def bulk_import(items, min_confidence=None, dry_run=False, concurrency=None, batch_size=None, on_progress=None):
+    """
+    Resolve and add many animes at once.
+    Resolution and scraping run concurrently (bounded by BULK_IMPORT_CONCURRENCY),
+    matches are written in batches, and a report entry is returned per input item.
+    `on_progress` is called after each resolved item and each written batch.
+    """
+    min_confidence = min_confidence if min_confidence is not None else getattr(settings, 'BULK_IMPORT_MIN_CONFIDENCE', 0.8)
+    concurrency = concurrency or getattr(settings, 'BULK_IMPORT_CONCURRENCY', 4)
+    batch_size = batch_size or getattr(settings, 'BULK_IMPORT_BATCH_SIZE', 20)
+
+    def _resolve(item):
+        report = {'input': item, 'status': 'not_found', 'title': None, 'confidence': 0}
+        try:
+            result, confidence = resolve_item(item)
+            report['confidence'] = confidence
+            if not result:
+                if str(item).strip().isdigit():
+                    # Ids are only looked up locally, the catalog may not be synced yet
+                    report['status'] = 'not_in_catalog'
+                    report['error'] = "Unknown id: run `manage.py sync_catalog` or import its URL"
+                return report, None
+            report['title'] = result['title']
+            report['url'] = result['url']
+            if confidence < min_confidence:
+                report['status'] = 'low_confidence'
+                return report, None
+            if dry_run:
+                report['status'] = 'matched'
+                return report, None
+            episodes_urls, genres = get_episode_urls(result['url'])
+            if not episodes_urls:
+                report['status'] = 'error'
+                report['error'] = 'No episodes found'
+                return report, None
+            return report, (result, episodes_urls, genres)
+        except Exception as e:
+            report['status'] = 'error'
+            report['error'] = str(e)
+            return report, None
+        finally:
+            # Each pool thread opens its own DB connection, don't leak it
+            connection.close()
+
+    resolved = []
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for entry in pool.map(_resolve, items):
+            resolved.append(entry)
+            if on_progress:
+                on_progress()
+
+    matched = [(report, scraped) for report, scraped in resolved if scraped]
+    for start in range(0, len(matched), batch_size):
+        batch = matched[start:start + batch_size]
+        try:
+            added = ingest_animes([scraped for _, scraped in batch])
+        except Exception as e:
+            for report, _ in batch:
+                report['status'] = 'error'
+                report['error'] = str(e)
+            continue
+        for (report, _), (anime, num_episodes) in zip(batch, added):
+            report.update({'status': 'added', 'anime_id': anime.id, 'episodes': num_episodes})
+        if on_progress:
+            on_progress()
+
+    # Posters and NFOs are independent of each other, write them concurrently too
+    def _metadata(anime_id):
+        try:
+            save_anime_metadata(Anime.objects.get(id=anime_id))
+        except Exception as e:
+            print(f"Failed to save metadata for anime {anime_id}: {e}")
+        finally:
+            connection.close()
+
+    added_ids = [report['anime_id'] for report, _ in matched if report['status'] == 'added']
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(_metadata, added_ids))
+
+    return [report for report, _ in resolved]
@@ -0,0 +1,65 @@
+import json
+import statistics
+import subprocess
+import sys
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Modules only needed to talk to AnimeUnity, which the web tier should not load up front
+HEAVY_MODULES = ['cloudscraper', 'bs4', 'requests', 'httpx']
+
+# Each scenario runs in a fresh interpreter and reports its own wall time
+SCENARIOS = {
+    # `manage.py check` imports the URLconf, models and admin like most commands do
+    'manage': "from django.core.management import call_command; call_command('check', verbosity=0)",
+    # What an ASGI process loads before serving its first request
+    'web': "import config.asgi; import downloader.urls",
+    # What a Celery child loads through autodiscovery
+    'worker': "import config.celery; import downloader.tasks",
+}
+
+CHILD = """
+import json, os, sys, time
+start = time.perf_counter()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+import django
+django.setup()
+{code}
+print(json.dumps({{
+    'seconds': time.perf_counter() - start,
+    'loaded': [name for name in {heavy!r} if name in sys.modules],
+}}))
+"""
+
+
+class Command(BaseCommand):
+    help = "Measure cold-start time of manage.py, the web server and Celery workers in fresh interpreters."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--json', action='store_true')
+
+    def measure(self, code, runs):
+        timings, loaded = [], []
+        for _ in range(runs):
+            proc = subprocess.run(
+                [sys.executable, '-c', CHILD.format(code=code, heavy=HEAVY_MODULES)],
+                cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+            )
+            result = json.loads(proc.stdout.strip().splitlines()[-1])
+            timings.append(result['seconds'])
+            loaded = result['loaded']
+        return {
+            'median_ms': round(statistics.median(timings) * 1000, 1),
+            'min_ms': round(min(timings) * 1000, 1),
+            'heavy_modules': loaded,
+        }
+
+    def handle(self, *args, **options):
+        report = {name: self.measure(code, options['runs']) for name, code in SCENARIOS.items()}
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for name, result in report.items():
+            heavy = ', '.join(result['heavy_modules']) or 'none'
+            self.stdout.write(f"{name:>7}: median {result['median_ms']:7.1f} ms, min {result['min_ms']:7.1f} ms, heavy modules: {heavy}")
@@ -0,0 +1,35 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from downloader.dispatch import drain_outbox, drain_add_jobs
+from downloader.utils import check_broker_status
+
+
+class Command(BaseCommand):
+    help = "Hand pending download intents and add-anime jobs to the Celery broker."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'OUTBOX_BATCH_SIZE', 100))
+        parser.add_argument('--interval', type=float, default=getattr(settings, 'OUTBOX_POLL_INTERVAL', 5))
+        parser.add_argument('--once', action='store_true', help="Drain what is pending and exit.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        interval = options['interval']
+
+        while True:
+            sent = 0
+            broker_ok, broker_err = check_broker_status()
+            if broker_ok:
+                jobs = drain_add_jobs(batch_size=batch_size)
+                sent = drain_outbox(batch_size=batch_size)
+                if sent or jobs:
+                    self.stdout.write(f"Dispatched {sent} download(s), {jobs} add job(s)")
+            elif options['once']:
+                self.stderr.write(f"Broker unavailable: {broker_err}")
+
+            if options['once'] and sent < batch_size:
+                return
+            # A full batch means more is waiting, keep draining without sleeping
+            if sent < batch_size:
+                time.sleep(interval)
@@ -0,0 +1,160 @@
+import contextlib
+import io
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from celery import current_app
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from downloader.library import add_anime, resolve_item
+from downloader.models import Episode
+from downloader.notifiers import flush_refreshes
+from downloader.tasks import download_episode
+
+
+def parse_episode_numbers(spec):
+    """
+    "1-3,7" -> {"1", "2", "3", "7"}
+    """
+    numbers = set()
+    for part in spec.split(','):
+        part = part.strip()
+        if '-' in part:
+            start, end = part.split('-', 1)
+            numbers.update(str(n) for n in range(int(start), int(end) + 1))
+        elif part:
+            numbers.add(part)
+    return numbers
+
+
+class ProgressDisplay:
+    """
+    One status line redrawn in place on a terminal, plain lines otherwise.
+    """
+    def __init__(self, stdout, total):
+        self.stdout = stdout
+        self.total = total
+        self.tty = stdout.isatty()
+        self.lock = threading.Lock()
+        self.active = {}
+        self.done = 0
+        self.downloaded = 0
+        self.started = time.monotonic()
+        self.last_render = 0
+
+    def update(self, episode, downloaded, total):
+        with self.lock:
+            previous, _ = self.active.get(episode.number, (0, total))
+            self.downloaded += downloaded - previous
+            self.active[episode.number] = (downloaded, total)
+            if self.tty and time.monotonic() - self.last_render > 0.2:
+                self.render()
+
+    def finish(self, number, message):
+        with self.lock:
+            self.active.pop(number, None)
+            self.done += 1
+            if self.tty:
+                self.stdout.write('\r\033[K', ending='')
+            self.stdout.write(f"[{self.done}/{self.total}] Episode {number}: {message}")
+            if self.tty:
+                self.render()
+
+    def render(self):
+        self.last_render = time.monotonic()
+        rate = self.downloaded / max(time.monotonic() - self.started, 0.001) / 1024 ** 2
+        parts = []
+        for number, (downloaded, total) in sorted(self.active.items()):
+            if total:
+                parts.append(f"E{number} {downloaded * 100 // total}%")
+            else:
+                parts.append(f"E{number} {downloaded // 1024 ** 2} MiB")
+        line = f"[{self.done}/{self.total}] {' '.join(parts)} {rate:.1f} MiB/s"
+        self.stdout.write('\r\033[K' + line, ending='')
+        self.stdout.flush()
+
+
+class Command(BaseCommand):
+    help = (
+        "Find an anime by title or AnimeUnity URL and download it in this process, "
+        "without Celery or Redis. Works with DB_ENGINE=sqlite."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('query', nargs='+', help="Title, AnimeUnity ID or AnimeUnity URL.")
+        parser.add_argument('--episodes', help="Episodes to fetch, e.g. '1-12' or '3,5,7'. Default: all missing.")
+        parser.add_argument('--concurrency', type=int, default=3, help="Parallel downloads.")
+
+    def resolve(self, query):
+        result, confidence = resolve_item(query)
+        if not result:
+            raise CommandError(f'No anime found for "{query}"')
+        self.stdout.write(f"Found {result['title']} ({confidence:.2f})")
+        return result
+
+    def handle(self, *args, **options):
+        # Follow-up tasks (e.g. faststart) run inline instead of going to a broker.
+        # The app reads Django settings with the CELERY namespace, so use the prefixed key.
+        current_app.conf['CELERY_TASK_ALWAYS_EAGER'] = True
+
+        result = self.resolve(' '.join(options['query']))
+        anime, num_episodes = add_anime(result, enqueue=False)
+        self.stdout.write(f"{anime.title}: {num_episodes} episodes upstream")
+
+        # Claims left behind by an interrupted run
+        anime.episodes.filter(status='downloading', lease_expires_at__lt=timezone.now()).update(
+            status='pending', worker_id=None, lease_expires_at=None
+        )
+
+        episodes = anime.episodes.filter(status='pending')
+        if options['episodes']:
+            episodes = episodes.filter(number__in=parse_episode_numbers(options['episodes']))
+        episodes = sorted(episodes.values_list('id', 'number'), key=lambda e: (len(e[1]), e[1]))
+        if not episodes:
+            self.stdout.write("Nothing to download.")
+            return
+
+        display = ProgressDisplay(self.stdout, len(episodes))
+        hostname = socket.gethostname()
+
+        def fetch(episode_id):
+            worker_id = f"{hostname}:{os.getpid()}:fetch-{episode_id}"
+            try:
+                while True:
+                    result = download_episode(
+                        episode_id, worker_id, uuid.uuid4().hex[:8], on_progress=display.update,
+                        slot_wait=getattr(settings, 'HOST_SLOT_WAIT', 300),
+                    )
+                    # Retryable failures leave the episode pending for the queue, which may not run here
+                    if not result.startswith('Retrying'):
+                        return result
+            finally:
+                connection.close()
+
+        executor = ThreadPoolExecutor(max_workers=max(1, options['concurrency']))
+        # The download code logs with print(), which would break the redrawn status line
+        quiet = contextlib.redirect_stdout(io.StringIO()) if display.tty else contextlib.nullcontext()
+        try:
+            with quiet:
+                futures = {executor.submit(fetch, episode_id): number for episode_id, number in episodes}
+                for future in as_completed(futures):
+                    display.finish(futures[future], future.result())
+        except KeyboardInterrupt:
+            executor.shutdown(wait=False, cancel_futures=True)
+            # Running threads notice on their next heartbeat and drop their partial files
+            Episode.objects.filter(id__in=[episode_id for episode_id, _ in episodes], status='downloading').update(
+                status='pending', worker_id=None, lease_expires_at=None
+            )
+            anime.update_status()
+            raise CommandError("Interrupted, unfinished episodes are pending again")
+        executor.shutdown()
+
+        anime.update_status()
+        flush_refreshes(force=True)
+        completed = anime.episodes.filter(id__in=[episode_id for episode_id, _ in episodes], status='completed').count()
+        self.stdout.write(self.style.SUCCESS(f"Downloaded {completed}/{len(episodes)} episodes of {anime.title}"))
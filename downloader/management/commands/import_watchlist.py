@@ -0,0 +1,44 @@
+import json
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from downloader.library import bulk_import
+
+
+class Command(BaseCommand):
+    help = "Add many animes at once from a watchlist (one title, AnimeUnity ID or URL per line)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('items', nargs='*', help="Titles or AnimeUnity IDs. Use --file for long lists.")
+        parser.add_argument('--file', help="Watchlist file, one entry per line ('-' for stdin).")
+        parser.add_argument('--min-confidence', type=float, default=None)
+        parser.add_argument('--concurrency', type=int, default=None)
+        parser.add_argument('--dry-run', action='store_true', help="Only resolve titles, don't add anything.")
+        parser.add_argument('--json', action='store_true', help="Print the full report as JSON.")
+
+    def handle(self, *args, **options):
+        items = list(options['items'])
+        if options['file']:
+            handle = sys.stdin if options['file'] == '-' else open(options['file'], encoding='utf-8')
+            with handle:
+                items += [line.strip() for line in handle if line.strip() and not line.startswith('#')]
+        if not items:
+            raise CommandError("Nothing to import")
+
+        report = bulk_import(
+            items,
+            min_confidence=options['min_confidence'],
+            dry_run=options['dry_run'],
+            concurrency=options['concurrency'],
+        )
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        for entry in report:
+            line = f"[{entry['status']:>14}] {entry['input']}"
+            if entry.get('title'):
+                line += f" -> {entry['title']} ({entry['confidence']:.2f})"
+            if entry.get('error'):
+                line += f" ({entry['error']})"
+            self.stdout.write(line)
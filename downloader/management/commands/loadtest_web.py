@@ -0,0 +1,338 @@
+import json
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from downloader.models import Anime, Episode
+
+# Seeded animes are recognized (and replaced on the next run) by this URL prefix
+SEED_URL = 'http://loadtest.invalid/anime/'
+# Episode statuses of the synthetic library and their weights
+STATUS_WEIGHTS = {'completed': 60, 'pending': 18, 'downloading': 5, 'failed': 10, 'skipped': 5, 'cancelled': 2}
+
+
+def seed_library(animes, episodes, seed):
+    """
+    Replace the synthetic library with `animes` animes of `episodes` episodes each.
+    The same arguments always produce the same library. Returns the anime ids.
+    """
+    rng = random.Random(seed)
+    statuses, weights = zip(*STATUS_WEIGHTS.items())
+    with transaction.atomic():
+        clear_library()
+        created = Anime.objects.bulk_create([
+            Anime(
+                title=f"Loadtest {n:05d}", source_url=f"{SEED_URL}{n}-loadtest", directory_name=f"Loadtest {n:05d}",
+                plot="Synthetic anime for the web load test. " * 5, genres="Action,Comedy", year='2024',
+            )
+            for n in range(animes)
+        ])
+        rows = []
+        for anime in created:
+            for number in range(1, episodes + 1):
+                status = rng.choices(statuses, weights)[0]
+                rows.append(Episode(
+                    anime=anime, number=str(number), source_url=f"{anime.source_url}/{number}", status=status,
+                    progress=100 if status == 'completed' else rng.randint(1, 99) if status == 'downloading' else 0,
+                    error_message="Synthetic failure" if status == 'failed' else None,
+                    file_path=f"{settings.MEDIA_URL}{anime.directory_name}/Season 01/{anime.directory_name} - S01E{number:02d}.mp4"
+                    if status == 'completed' else None,
+                ))
+        Episode.objects.bulk_create(rows, batch_size=1000)
+        for anime in created:
+            anime.update_status()
+    return [anime.id for anime in created]
+
+def clear_library():
+    return Anime.objects.filter(source_url__startswith=SEED_URL).delete()[0]
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+def process_cpu_seconds(pid):
+    """User + system CPU time of a process, from /proc (Linux). None elsewhere."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+    except (OSError, IndexError):
+        return None
+    # utime and stime are fields 14 and 15 of the file, counted after the ") "
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Recorder:
+    """Latencies and sizes per endpoint, for requests started after `start`."""
+    def __init__(self):
+        self.start = None
+        self.stop = None
+        self.samples = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, started, seconds, size, ok):
+        if self.start is None or started < self.start or started >= self.stop:
+            return
+        with self._lock:
+            if ok:
+                self.samples.setdefault(endpoint, []).append((seconds, size))
+            else:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the queue/library pages: seed a synthetic library, poll api/queue/status/ from many "
+        "simulated open tabs while others load pages, and report latency percentiles, queries per "
+        "request, response sizes and server CPU. Runs against its own uvicorn unless --url is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--animes', type=int, default=200, help="Animes in the synthetic library.")
+        parser.add_argument('--episodes', type=int, default=24, help="Episodes per anime.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed of the library and the simulated users.")
+        parser.add_argument('--pollers', type=int, default=20, help="Open Queue tabs polling the status API.")
+        parser.add_argument('--poll-interval', type=float, default=3, help="Seconds between polls of one tab (queue.html uses 3).")
+        parser.add_argument('--browsers', type=int, default=4, help="Users loading the Queue, Library and anime pages.")
+        parser.add_argument('--think-time', type=float, default=0.5, help="Seconds a browser waits between page loads.")
+        parser.add_argument('--duration', type=float, default=30, help="Measured seconds.")
+        parser.add_argument('--warmup', type=float, default=5, help="Seconds of load before measuring.")
+        parser.add_argument('--url', help="Base URL of an already running server instead of starting one.")
+        parser.add_argument('--server-pid', type=int, help="With --url: process to measure server CPU on.")
+        parser.add_argument('--keep', action='store_true', help="Keep the synthetic library afterwards.")
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON.")
+        parser.add_argument('--output', help="Also write the JSON report to this file.")
+        parser.add_argument('--compare', help="JSON report of an earlier run to compare with.")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Seeding {options['animes']} animes x {options['episodes']} episodes...")
+        anime_ids = seed_library(options['animes'], options['episodes'], options['seed'])
+        server = None
+        try:
+            base_url, pid = options['url'], options['server_pid']
+            if not base_url:
+                server, base_url = self.start_server()
+                pid = server.pid
+            base_url = base_url.rstrip('/')
+
+            endpoints = {
+                'queue_status': reverse('queue_status'),
+                'queue': reverse('queue'),
+                'downloaded': reverse('downloaded'),
+                'anime_detail': reverse('anime_detail', args=[anime_ids[0]]) if anime_ids else None,
+            }
+            queries = self.count_queries(endpoints)
+            recorder, cpu_seconds = self.run_load(base_url, pid, anime_ids, options)
+        finally:
+            if server:
+                server.terminate()
+                server.wait(timeout=10)
+            if not options['keep']:
+                clear_library()
+
+        report = self.build_report(options, recorder, queries, cpu_seconds)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.print_report(report)
+        if options['compare']:
+            with open(options['compare']) as f:
+                self.print_comparison(json.load(f), report)
+
+    def start_server(self):
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        # One process, no reload, no access log: the numbers only depend on the code under test
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'config.asgi:application', '--host', '127.0.0.1',
+             '--port', str(port), '--log-level', 'warning', '--no-access-log'],
+            cwd=settings.BASE_DIR,
+        )
+        import requests
+
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError("uvicorn exited during startup")
+            try:
+                requests.get(f"{base_url}{reverse('queue_status')}", timeout=5)
+                return server, base_url
+            except requests.ConnectionError:
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError("uvicorn did not start within 30 seconds")
+
+    def count_queries(self, endpoints):
+        """Database queries of one request per endpoint, measured in this process."""
+        client = Client()
+        counts = {}
+        for name, path in endpoints.items():
+            if not path:
+                continue
+            with CaptureQueriesContext(connection) as captured:
+                client.get(path)
+            counts[name] = len(captured.captured_queries)
+        return counts
+
+    def run_load(self, base_url, pid, anime_ids, options):
+        import requests
+
+        recorder = Recorder()
+        rng = random.Random(options['seed'])
+        started = time.monotonic()
+        end = started + options['warmup'] + options['duration']
+
+        def fetch(session, endpoint, path):
+            request_start = time.monotonic()
+            try:
+                response = session.get(base_url + path, timeout=60)
+                recorder.record(endpoint, request_start, time.monotonic() - request_start, len(response.content), response.ok)
+            except requests.RequestException:
+                recorder.record(endpoint, request_start, time.monotonic() - request_start, 0, False)
+
+        def poller(offset):
+            session = requests.Session()
+            # Tabs are not opened in the same instant, spread their polls over the interval
+            time.sleep(offset)
+            path = reverse('queue_status')
+            while time.monotonic() < end:
+                poll_start = time.monotonic()
+                fetch(session, 'queue_status', path)
+                time.sleep(max(0, options['poll_interval'] - (time.monotonic() - poll_start)))
+
+        pages = ['queue', 'downloaded', 'anime_detail'] if anime_ids else ['queue', 'downloaded']
+
+        def browser(user_rng):
+            session = requests.Session()
+            while time.monotonic() < end:
+                page = user_rng.choice(pages)
+                if page == 'anime_detail':
+                    path = reverse('anime_detail', args=[user_rng.choice(anime_ids)])
+                else:
+                    path = reverse(page)
+                fetch(session, page, path)
+                time.sleep(options['think_time'])
+
+        threads = [
+            threading.Thread(target=poller, args=(rng.uniform(0, options['poll_interval']),), daemon=True)
+            for _ in range(options['pollers'])
+        ] + [
+            threading.Thread(target=browser, args=(random.Random(rng.random()),), daemon=True)
+            for _ in range(options['browsers'])
+        ]
+        recorder.start = started + options['warmup']
+        recorder.stop = end
+        for thread in threads:
+            thread.start()
+
+        time.sleep(max(0, recorder.start - time.monotonic()))
+        cpu_before = process_cpu_seconds(pid) if pid else None
+        time.sleep(max(0, end - time.monotonic()))
+        cpu_after = process_cpu_seconds(pid) if pid else None
+        for thread in threads:
+            thread.join()
+        cpu_seconds = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+        return recorder, cpu_seconds
+
+    def build_report(self, options, recorder, queries, cpu_seconds):
+        duration = options['duration']
+        endpoints = {}
+        for name in sorted(set(recorder.samples) | set(recorder.errors) | set(queries)):
+            samples = recorder.samples.get(name, [])
+            latencies = sorted(seconds * 1000 for seconds, _ in samples)
+            endpoints[name] = {
+                'requests': len(samples),
+                'errors': recorder.errors.get(name, 0),
+                'rps': round(len(samples) / duration, 2),
+                'p50_ms': round(percentile(latencies, 50), 1) if latencies else None,
+                'p95_ms': round(percentile(latencies, 95), 1) if latencies else None,
+                'p99_ms': round(percentile(latencies, 99), 1) if latencies else None,
+                'max_ms': round(latencies[-1], 1) if latencies else None,
+                'avg_bytes': round(sum(size for _, size in samples) / len(samples)) if samples else None,
+                'queries': queries.get(name),
+            }
+        return {
+            'commit': git_commit(),
+            'created_at': timezone.now().isoformat(),
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'debug': settings.DEBUG,
+                'cpus': os.cpu_count(),
+            },
+            'parameters': {
+                name: options[name] for name in (
+                    'animes', 'episodes', 'seed', 'pollers', 'poll_interval', 'browsers', 'think_time', 'duration', 'warmup',
+                )
+            },
+            'server_cpu_seconds': round(cpu_seconds, 2) if cpu_seconds is not None else None,
+            'server_cpu_percent': round(cpu_seconds / duration * 100, 1) if cpu_seconds is not None else None,
+            'endpoints': endpoints,
+        }
+
+    def print_report(self, report):
+        params = report['parameters']
+        self.stdout.write(
+            f"Commit {report['commit'] or '?'}: {params['animes']} animes x {params['episodes']} episodes, "
+            f"{params['pollers']} pollers, {params['browsers']} browsers, {params['duration']:g}s"
+        )
+        self.stdout.write(f"{'endpoint':<14}{'reqs':>7}{'err':>5}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'KiB':>9}{'queries':>9}")
+        for name, stats in report['endpoints'].items():
+            def fmt(value, digits=1):
+                return '-' if value is None else f"{value:.{digits}f}"
+            size = stats['avg_bytes'] / 1024 if stats['avg_bytes'] is not None else None
+            self.stdout.write(
+                f"{name:<14}{stats['requests']:>7}{stats['errors']:>5}{fmt(stats['p50_ms']):>9}{fmt(stats['p95_ms']):>9}"
+                f"{fmt(stats['p99_ms']):>9}{fmt(size):>9}{fmt(stats['queries'], 0):>9}"
+            )
+        if report['server_cpu_seconds'] is not None:
+            self.stdout.write(f"Server CPU: {report['server_cpu_seconds']}s ({report['server_cpu_percent']}% of one core)")
+
+    def print_comparison(self, baseline, report):
+        if baseline.get('parameters') != report['parameters']:
+            self.stderr.write("Parameters differ from the baseline, the comparison is only indicative.")
+        self.stdout.write(f"Compared with {baseline.get('commit') or '?'}:")
+        for name, stats in report['endpoints'].items():
+            old = baseline.get('endpoints', {}).get(name)
+            if not old:
+                continue
+            changes = []
+            for key in ('p50_ms', 'p95_ms', 'p99_ms', 'avg_bytes', 'queries'):
+                if old.get(key) and stats.get(key) is not None:
+                    changes.append(f"{key} {(stats[key] - old[key]) / old[key] * 100:+.0f}%")
+            self.stdout.write(f"  {name:<14}{', '.join(changes)}")
+        if baseline.get('server_cpu_percent') and report['server_cpu_percent'] is not None:
+            change = (report['server_cpu_percent'] - baseline['server_cpu_percent']) / baseline['server_cpu_percent'] * 100
+            self.stdout.write(f"  server CPU {change:+.0f}%")
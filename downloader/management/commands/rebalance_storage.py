@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from downloader.models import Anime
+from downloader.placement import move_anime, plan_rebalance, storage_nodes
+
+
+class Command(BaseCommand):
+    help = "Move whole anime folders between storage nodes (STORAGE_NODES)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--anime', type=int, action='append', default=[], help="Anime id to move (repeatable), with --to.")
+        parser.add_argument('--to', help="Target storage node for --anime.")
+        parser.add_argument('--dry-run', action='store_true', help="Only print the moves.")
+
+    def handle(self, *args, **options):
+        if not storage_nodes():
+            raise CommandError("No STORAGE_NODES configured")
+        if options['anime']:
+            if not options['to']:
+                raise CommandError("--anime needs --to")
+            moves = [(anime, anime.storage_node, options['to']) for anime in Anime.objects.filter(id__in=options['anime'])]
+        else:
+            # No explicit move: even out the bytes stored on each node
+            moves = plan_rebalance()
+
+        for anime, source, target in moves:
+            self.stdout.write(f"{anime.title}: {source or '(library root)'} -> {target}")
+            if options['dry_run']:
+                continue
+            try:
+                move_anime(anime, target)
+            except (ValueError, RuntimeError, OSError) as e:
+                self.stderr.write(f"Could not move {anime.title}: {e}")
+        self.stdout.write(self.style.SUCCESS(f"{len(moves)} move(s){' planned' if options['dry_run'] else ''}"))
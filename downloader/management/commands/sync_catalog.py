@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from downloader.catalog import sync_catalog
+
+
+class Command(BaseCommand):
+    help = "Download the AnimeUnity archive into the local search catalog."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-delay', type=float, default=0.5, help="Seconds to wait between archive pages.")
+
+    def handle(self, *args, **options):
+        stored = sync_catalog(page_delay=options['page_delay'])
+        self.stdout.write(self.style.SUCCESS(f"Stored {stored} catalog entries"))
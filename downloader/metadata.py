@@ -0,0 +1,119 @@
+import hashlib
+import os
+import tempfile
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from django.conf import settings
+from .utils import clean_filename, episode_relative_path, scraper_session, storage_node_dir
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+def write_if_changed(path, data):
+    """
+    Atomically write `data` to `path` unless the file already holds the same content.
+    Unchanged files keep their mtime, so media servers don't rescan them.
+    Returns True if the file was written.
+    """
+    path = Path(path)
+    mode = 0o644
+    try:
+        with open(path, 'rb') as f:
+            if content_hash(f.read()) == content_hash(data):
+                return False
+            mode = os.fstat(f.fileno()).st_mode & 0o777
+    except FileNotFoundError:
+        pass
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{path.name}.", suffix='.tmp', dir=path.parent)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        # mkstemp creates 0600 files, media servers often run as another user
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return True
+
+def _render(root):
+    ET.indent(root, space='  ')
+    return ET.tostring(root, encoding='UTF-8', xml_declaration=True) + b'\n'
+
+def _add(parent, tag, text):
+    element = ET.SubElement(parent, tag)
+    element.text = str(text) if text is not None else ''
+    return element
+
+def build_tvshow_nfo(anime):
+    """
+    Kodi/Jellyfin tvshow.nfo for an anime. ElementTree takes care of escaping.
+    """
+    root = ET.Element('tvshow')
+    _add(root, 'title', anime.title)
+    _add(root, 'plot', anime.plot or '')
+    _add(root, 'year', anime.year or '')
+    if anime.genres:
+        for genre in anime.genres.split(','):
+            if genre.strip():
+                _add(root, 'genre', genre.strip())
+    _add(root, 'studio', anime.studio or '')
+    if anime.animeunity_id:
+        uniqueid = _add(root, 'uniqueid', anime.animeunity_id)
+        uniqueid.set('type', 'animeunity')
+    return _render(root)
+
+def build_episode_nfo(episode):
+    root = ET.Element('episodedetails')
+    _add(root, 'title', f"Episode {episode.number}")
+    _add(root, 'showtitle', episode.anime.title)
+    _add(root, 'season', 1)
+    _add(root, 'episode', int(episode.number) if episode.number.isdigit() else episode.number)
+    return _render(root)
+
+def episode_nfo_path(episode):
+    return (Path(settings.MEDIA_ROOT) / episode_relative_path(episode)).with_suffix('.nfo')
+
+def write_episode_nfo(episode):
+    return write_if_changed(episode_nfo_path(episode), build_episode_nfo(episode))
+
+def write_anime_metadata(anime, batch_size=200):
+    """
+    Write tvshow.nfo, poster.jpg and one NFO per downloaded episode, skipping unchanged files.
+    Returns the number of files written.
+    """
+    if not anime.directory_name:
+        anime.directory_name = clean_filename(anime.title)
+        anime.save()
+
+    anime_path = Path(settings.MEDIA_ROOT) / storage_node_dir(anime.storage_node) / anime.directory_name
+    anime_path.mkdir(parents=True, exist_ok=True)
+    written = 0
+
+    # 1. tvshow.nfo
+    written += write_if_changed(anime_path / "tvshow.nfo", build_tvshow_nfo(anime))
+
+    # 2. Episode NFOs, only next to videos that exist
+    episodes = anime.episodes.filter(status='completed').select_related('anime')
+    for episode in episodes.iterator(chunk_size=batch_size):
+        written += write_episode_nfo(episode)
+
+    # 3. poster.jpg, fetched only when missing
+    poster_path = anime_path / "poster.jpg"
+    if anime.cover_image and not poster_path.exists():
+        try:
+            scraper = scraper_session()
+            resp = scraper.get(anime.cover_image)
+            resp.raise_for_status()
+            written += write_if_changed(poster_path, resp.content)
+            print(f"Saved poster to {poster_path}")
+        except Exception as e:
+            print(f"Failed to save poster: {e}")
+
+    if written:
+        print(f"Updated {written} metadata files for {anime.title}")
+    return written
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.27 on 2026-10-18 22:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0005_anime_genres_anime_studio_anime_year'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DownloadIntent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('episode', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='download_intents', to='downloader.episode')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
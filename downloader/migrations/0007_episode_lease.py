@@ -0,0 +1,23 @@
+# Generated by Django 4.2.27 on 2026-10-18 22:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0006_downloadintent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='episode',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='episode',
+            name='worker_id',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
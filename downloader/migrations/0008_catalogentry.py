@@ -0,0 +1,29 @@
+# Generated by Django 4.2.27 on 2026-10-18 22:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0007_episode_lease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('animeunity_id', models.IntegerField(unique=True)),
+                ('slug', models.CharField(max_length=255)),
+                ('title', models.CharField(blank=True, max_length=255, null=True)),
+                ('title_eng', models.CharField(blank=True, max_length=255, null=True)),
+                ('year', models.CharField(blank=True, max_length=10, null=True)),
+                ('episodes_count', models.IntegerField(blank=True, null=True)),
+                ('cover_image', models.URLField(blank=True, max_length=1024, null=True)),
+                ('plot', models.TextField(blank=True, null=True)),
+                ('studio', models.CharField(blank=True, max_length=255, null=True)),
+                ('synced_at', models.DateTimeField(auto_now=True, db_index=True)),
+            ],
+        ),
+    ]
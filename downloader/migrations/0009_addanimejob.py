@@ -0,0 +1,33 @@
+# Generated by Django 4.2.27 on 2026-10-18 22:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0008_catalogentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AddAnimeJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('title', models.CharField(max_length=255)),
+                ('payload', models.JSONField(default=dict)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='queued', max_length=20)),
+                ('num_episodes', models.IntegerField(blank=True, null=True)),
+                ('error_message', models.TextField(blank=True, null=True)),
+                ('dispatched_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('anime', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='add_jobs', to='downloader.anime')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.27 on 2026-10-18 22:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0009_addanimejob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='episode',
+            name='reserved_bytes',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='episode',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('waiting_for_space', 'Waiting for space'), ('downloading', 'Downloading'), ('completed', 'Completed'), ('failed', 'Failed'), ('skipped', 'Skipped'), ('cancelled', 'Cancelled')], default='pending', max_length=20),
+        ),
+    ]
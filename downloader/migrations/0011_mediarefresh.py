@@ -0,0 +1,22 @@
+# Generated by Django 4.2.27 on 2026-10-18 22:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0010_episode_reserved_bytes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaRefresh',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=1024, unique=True)),
+                ('first_event_at', models.DateTimeField()),
+                ('due_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.27 on 2026-10-18 22:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0011_mediarefresh'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='addanimejob',
+            name='traceparent',
+            field=models.CharField(blank=True, default='', max_length=55),
+        ),
+        migrations.AddField(
+            model_name='downloadintent',
+            name='traceparent',
+            field=models.CharField(blank=True, default='', max_length=55),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.27 on 2026-10-18 22:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0012_traceparent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DownloadAttempt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField(db_index=True)),
+                ('bytes', models.BigIntegerField(default=0)),
+                ('average_speed', models.FloatField(blank=True, null=True)),
+                ('peak_speed', models.FloatField(blank=True, null=True)),
+                ('host', models.CharField(blank=True, default='', max_length=255)),
+                ('ttfb_ms', models.IntegerField(blank=True, null=True)),
+                ('outcome', models.CharField(choices=[('completed', 'Completed'), ('failed', 'Failed'), ('cancelled', 'Cancelled'), ('skipped', 'Skipped'), ('waiting_for_space', 'Waiting for space'), ('requeued', 'Requeued')], max_length=20)),
+                ('error_class', models.CharField(blank=True, default='', max_length=255)),
+            ],
+            options={
+                'ordering': ['-finished_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='DownloadDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('host', models.CharField(blank=True, default='', max_length=255)),
+                ('attempts', models.IntegerField(default=0)),
+                ('completed', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0)),
+                ('bytes', models.BigIntegerField(default=0)),
+                ('transfer_seconds', models.FloatField(default=0)),
+                ('peak_speed', models.FloatField(default=0)),
+            ],
+            options={
+                'ordering': ['-day', 'host'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='downloaddailystats',
+            constraint=models.UniqueConstraint(fields=('day', 'host'), name='unique_daily_stats_per_host'),
+        ),
+        migrations.AddField(
+            model_name='downloadattempt',
+            name='episode',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='attempts', to='downloader.episode'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.27 on 2026-10-18 22:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0013_downloadattempt'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HostConcurrency',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('host', models.CharField(max_length=255, unique=True)),
+                ('limit', models.FloatField()),
+                ('throughput', models.FloatField(blank=True, null=True)),
+                ('ttfb_ms', models.FloatField(blank=True, null=True)),
+                ('baseline_throughput', models.FloatField(blank=True, null=True)),
+                ('samples_since_change', models.IntegerField(default=0)),
+                ('congestion_events', models.IntegerField(default=0)),
+                ('last_congestion_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['host'],
+            },
+        ),
+        migrations.AddField(
+            model_name='downloadattempt',
+            name='status_code',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='episode',
+            name='transfer_host',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.27 on 2026-10-18 22:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0014_host_concurrency'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='episode',
+            name='checksum',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='episode',
+            name='retries',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.27 on 2026-10-18 22:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0015_episode_checksum'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='anime',
+            name='airing_finished',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='anime',
+            name='last_checked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='anime',
+            name='next_check_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
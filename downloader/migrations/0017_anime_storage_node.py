@@ -0,0 +1,18 @@
+# Generated by Django 4.2.27 on 2026-10-18 22:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0016_anime_polling'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='anime',
+            name='storage_node',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.27 on 2026-10-18 23:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0017_anime_storage_node'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EpisodeListCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=512, unique=True)),
+                ('episodes', models.JSONField(default=list)),
+                ('genres', models.JSONField(default=list)),
+                ('fetched_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.27 on 2026-10-18 23:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0018_episode_list_cache'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='downloadattempt',
+            name='outcome',
+            field=models.CharField(choices=[('completed', 'Completed'), ('failed', 'Failed'), ('cancelled', 'Cancelled'), ('skipped', 'Skipped'), ('waiting_for_space', 'Waiting for space'), ('retried', 'Failed, retried'), ('requeued', 'Requeued')], max_length=20),
+        ),
+    ]
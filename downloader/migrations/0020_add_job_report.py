@@ -0,0 +1,18 @@
+# Generated by Django 4.2.27 on 2026-10-18 23:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0019_attempt_retried_outcome'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='addanimejob',
+            name='report',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.27 on 2026-10-18 23:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0020_add_job_report'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='anime',
+            name='moving',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.27 on 2026-10-18 23:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0021_anime_moving'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediarefresh',
+            name='server',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='mediarefresh',
+            name='path',
+            field=models.CharField(max_length=1024),
+        ),
+        migrations.AlterUniqueTogether(
+            name='mediarefresh',
+            unique_together={('path', 'server')},
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.27 on 2026-10-18 23:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0022_media_refresh_server'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='downloadintent',
+            name='not_before',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,142 @@
+import os
+import re
+import threading
+import time
+import urllib.parse
+from django.conf import settings
+
+# Path layout of AnimeUnity anime pages, used to recognize URLs stored under an old domain
+ANIME_PATH_RE = re.compile(r'^/anime/\d+-')
+
+
+def configured_mirrors():
+    return [url.rstrip('/') for url in getattr(settings, 'UPSTREAM_MIRRORS', ['https://www.animeunity.so'])]
+
+def probe_mirror(base_url):
+    """
+    Time a homepage request to a mirror.
+    Returns (healthy, latency in seconds).
+    """
+    import requests
+
+    timeout = getattr(settings, 'UPSTREAM_PROBE_TIMEOUT', 5)
+    start = time.monotonic()
+    try:
+        resp = requests.get(base_url, timeout=timeout, headers={'User-Agent': 'Mozilla/5.0'})
+    except Exception:
+        return False, None
+    # Cloudflare challenges (403) still prove the edge is up; the scraper gets past them
+    return resp.status_code < 500, time.monotonic() - start
+
+
+class MirrorMonitor:
+    """
+    Probe the configured upstream mirrors from a background thread and rank them,
+    healthy ones by latency first. Same per-process lifecycle as BrokerHealthMonitor.
+    """
+    def __init__(self, interval=None):
+        self.interval = interval
+        self._status = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def probe_all(self):
+        for base_url in configured_mirrors():
+            self._status[base_url] = probe_mirror(base_url)
+
+    def _run(self):
+        interval = self.interval or getattr(settings, 'UPSTREAM_PROBE_INTERVAL', 60)
+        while True:
+            self.probe_all()
+            time.sleep(interval)
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._status = {}
+            self._thread = threading.Thread(target=self._run, name='mirror-probe', daemon=True)
+            self._thread.start()
+
+    def candidates(self):
+        """
+        Mirrors in the order they should be tried. Unprobed mirrors keep their configured
+        order; mirrors known to be down are kept last as a final resort.
+        """
+        mirrors = configured_mirrors()
+        if len(mirrors) < 2:
+            return mirrors
+        if self._pid != os.getpid():
+            self.start()
+
+        def rank(item):
+            position, base_url = item
+            healthy, latency = self._status.get(base_url, (None, None))
+            if healthy is False:
+                return (2, position)
+            if latency is None:
+                return (1, position)
+            return (0, latency)
+
+        return [base_url for _, base_url in sorted(enumerate(mirrors), key=rank)]
+
+    def current(self):
+        return self.candidates()[0]
+
+    def mark_down(self, base_url, error=None):
+        """Record a failure seen by a caller until the next probe runs."""
+        print(f"Upstream mirror {base_url} failed: {error}")
+        self._status[base_url] = (False, None)
+
+    def status(self):
+        return {base_url: self._status.get(base_url, (None, None)) for base_url in configured_mirrors()}
+
+mirror_monitor = MirrorMonitor()
+
+def current_mirror():
+    return mirror_monitor.current()
+
+def upstream_url(path='', base_url=None):
+    return (base_url or current_mirror()) + path
+
+def is_upstream_url(url):
+    parsed = urllib.parse.urlsplit(url or '')
+    hosts = {urllib.parse.urlsplit(base_url).netloc for base_url in configured_mirrors()}
+    return parsed.netloc in hosts or bool(ANIME_PATH_RE.match(parsed.path))
+
+def rewrite_url(url, base_url=None):
+    """
+    Point an upstream URL (possibly stored under a retired domain) at `base_url`,
+    by default the mirror currently preferred. Other URLs are returned unchanged.
+    """
+    if not is_upstream_url(url):
+        return url
+    base = urllib.parse.urlsplit(base_url or current_mirror())
+    return urllib.parse.urlsplit(url)._replace(scheme=base.scheme, netloc=base.netloc).geturl()
+
+def is_mirror_failure(error):
+    """
+    False for errors that would happen on every mirror (e.g. 404 for a removed anime).
+    """
+    response = getattr(error, 'response', None)
+    if response is not None and 400 <= response.status_code < 500 and response.status_code not in (403, 429):
+        return False
+    return True
+
+def with_failover(fn):
+    """
+    Call fn(base_url) on each mirror in preference order until one succeeds.
+    Mirrors that fail are marked down so the next callers skip them.
+    """
+    last_error = None
+    for base_url in mirror_monitor.candidates():
+        try:
+            return fn(base_url)
+        except Exception as e:
+            if not is_mirror_failure(e):
+                raise
+            mirror_monitor.mark_down(base_url, e)
+            last_error = e
+    raise last_error
@@ -4,6 +4,9 @@ from django.dispatch import receiver
 from django.conf import settings
 from pathlib import Path
 import shutil
+import uuid
+from .mirrors import upstream_url
+from .utils import storage_node_dir
 
 class Anime(models.Model):
     STATUS_CHOICES = (
@@ -30,6 +33,17 @@ class Anime(models.Model):
     studio = models.CharField(max_length=255, null=True, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
 
+    # New-episode polling, scheduled from the show's release history (see polling.py)
+    next_check_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    last_checked_at = models.DateTimeField(null=True, blank=True)
+    airing_finished = models.BooleanField(default=False)
+
+    # Storage node whose disk holds the anime folder (STORAGE_NODES); its downloads run
+    # on that node's workers. Empty: stored directly in MEDIA_ROOT, downloaded by any worker.
+    storage_node = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+    # Set while the folder is being moved between nodes; its downloads are held back meanwhile
+    moving = models.BooleanField(default=False)
+
     def __str__(self):
         return self.title
 
@@ -62,6 +76,7 @@ class Anime(models.Model):
 class Episode(models.Model):
     STATUS_CHOICES = (
         ('pending', 'Pending'),
+        ('waiting_for_space', 'Waiting for space'),
         ('downloading', 'Downloading'),
         ('completed', 'Completed'),
         ('failed', 'Failed'),
@@ -77,6 +92,17 @@ class Episode(models.Model):
     progress = models.IntegerField(default=0)
     file_path = models.CharField(max_length=512, blank=True, null=True)
     error_message = models.TextField(blank=True, null=True)
+    # Ownership of a running download, renewed by the worker's heartbeat
+    worker_id = models.CharField(max_length=255, blank=True, null=True)
+    lease_expires_at = models.DateTimeField(blank=True, null=True)
+    # Disk space held for this download (its Content-Length) while downloading or waiting for space
+    reserved_bytes = models.BigIntegerField(blank=True, null=True)
+    # CDN host of a running transfer, counted against that host's concurrency limit
+    transfer_host = models.CharField(max_length=255, blank=True, null=True)
+    # SHA-256 of the file as downloaded (before faststart), to find duplicates in the library
+    checksum = models.CharField(max_length=64, blank=True, null=True, db_index=True)
+    # Immediate retries used after transfers cut short or corrupted, reset once it completes or fails
+    retries = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -87,11 +113,227 @@ class Episode(models.Model):
     def __str__(self):
         return f"{self.anime.title} - Episode {self.number}"
 
+class DownloadIntent(models.Model):
+    """
+    Outbox row recording that an episode must be handed to the download queue.
+    Written in the same transaction as the episode, deleted once dispatched.
+    """
+    episode = models.ForeignKey(Episode, on_delete=models.CASCADE, related_name='download_intents')
+    created_at = models.DateTimeField(auto_now_add=True)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True, null=True)
+    # Trace of the request that queued it, continued by the download task
+    traceparent = models.CharField(max_length=55, blank=True, default='')
+    # Held in the outbox until then (a download put back because its host had no free slot)
+    not_before = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f"Dispatch {self.episode}"
+
+class AddAnimeJob(models.Model):
+    """
+    Background job adding an anime to the library, so the web request returns immediately.
+    `payload` is either a search result dict, {"title": ..., "exact": true} to search first,
+    or {"items": [...], ...} for a bulk import whose per-item results end up in `report`.
+    """
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    title = models.CharField(max_length=255)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    anime = models.ForeignKey(Anime, on_delete=models.SET_NULL, null=True, blank=True, related_name='add_jobs')
+    num_episodes = models.IntegerField(null=True, blank=True)
+    error_message = models.TextField(blank=True, null=True)
+    report = models.JSONField(null=True, blank=True)
+    # Set once the job was handed to the broker, the dispatcher retries the others
+    dispatched_at = models.DateTimeField(null=True, blank=True)
+    traceparent = models.CharField(max_length=55, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Add {self.title} ({self.status})"
+
+    def to_dict(self):
+        data = {
+            'id': str(self.id),
+            'title': self.title,
+            'status': self.status,
+            'anime_id': self.anime_id,
+            'episodes': self.num_episodes,
+            'error_message': self.error_message,
+        }
+        if self.report is not None:
+            summary = {}
+            for entry in self.report:
+                summary[entry['status']] = summary.get(entry['status'], 0) + 1
+            data.update({'summary': summary, 'results': self.report})
+        return data
+
+class CatalogEntry(models.Model):
+    """
+    Local copy of an AnimeUnity catalog record, used to answer searches without upstream.
+    """
+    animeunity_id = models.IntegerField(unique=True)
+    slug = models.CharField(max_length=255)
+    title = models.CharField(max_length=255, null=True, blank=True)
+    title_eng = models.CharField(max_length=255, null=True, blank=True)
+    year = models.CharField(max_length=10, null=True, blank=True)
+    episodes_count = models.IntegerField(null=True, blank=True)
+    cover_image = models.URLField(null=True, blank=True, max_length=1024)
+    plot = models.TextField(null=True, blank=True)
+    studio = models.CharField(max_length=255, null=True, blank=True)
+    synced_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return self.title_eng or self.title or self.slug
+
+    def to_result(self):
+        """Same shape as the dicts returned by utils.search_anime."""
+        return {
+            'title': self.title_eng or self.title or 'Unknown Title',
+            'url': upstream_url(f"/anime/{self.animeunity_id}-{self.slug}"),
+            'cover_image': self.cover_image,
+            'id': self.animeunity_id,
+            'slug': self.slug,
+            'plot': self.plot,
+            'episodes_count': self.episodes_count,
+            'year': self.year,
+            'studio': self.studio,
+        }
+
+class MediaRefresh(models.Model):
+    """
+    Pending media-server refresh of one library directory. Completions push due_at
+    forward, so a batch of episodes ends up in a single refresh (see notifiers.py).
+    """
+    path = models.CharField(max_length=1024)
+    # URL of the only media server still to refresh (its last attempt failed); empty: all of them
+    server = models.CharField(max_length=255, blank=True, default='')
+    first_event_at = models.DateTimeField()
+    due_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ('path', 'server')
+
+    def __str__(self):
+        return self.path
+
+class EpisodeListCache(models.Model):
+    """
+    Episode list and genres scraped from an anime page ahead of an add (see prefetch.py).
+    Keyed by the page path, which is the same on every mirror.
+    """
+    path = models.CharField(max_length=512, unique=True)
+    episodes = models.JSONField(default=list)
+    genres = models.JSONField(default=list)
+    fetched_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.path
+
+class DownloadAttempt(models.Model):
+    """
+    One try at downloading an episode, written once when the attempt ends.
+    Speeds are in bytes per second.
+    """
+    OUTCOME_CHOICES = (
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),
+        ('skipped', 'Skipped'),
+        ('waiting_for_space', 'Waiting for space'),
+        ('retried', 'Failed, retried'),
+        ('requeued', 'Requeued'),
+    )
+
+    episode = models.ForeignKey(Episode, on_delete=models.SET_NULL, null=True, blank=True, related_name='attempts')
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField(db_index=True)
+    bytes = models.BigIntegerField(default=0)
+    average_speed = models.FloatField(null=True, blank=True)
+    peak_speed = models.FloatField(null=True, blank=True)
+    host = models.CharField(max_length=255, blank=True, default='')
+    ttfb_ms = models.IntegerField(null=True, blank=True)
+    status_code = models.IntegerField(null=True, blank=True)
+    outcome = models.CharField(max_length=20, choices=OUTCOME_CHOICES)
+    error_class = models.CharField(max_length=255, blank=True, default='')
+
+    class Meta:
+        ordering = ['-finished_at']
+
+    def __str__(self):
+        return f"{self.episode} {self.outcome} at {self.finished_at:%Y-%m-%d %H:%M}"
+
+class DownloadDailyStats(models.Model):
+    """
+    Per day and host rollup of DownloadAttempt, updated as attempts are recorded
+    so the analytics page never scans the attempts table.
+    """
+    day = models.DateField()
+    host = models.CharField(max_length=255, blank=True, default='')
+    attempts = models.IntegerField(default=0)
+    completed = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    bytes = models.BigIntegerField(default=0)
+    # Time spent receiving data, average speed is bytes / transfer_seconds
+    transfer_seconds = models.FloatField(default=0)
+    peak_speed = models.FloatField(default=0)
+
+    class Meta:
+        ordering = ['-day', 'host']
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'host'], name='unique_daily_stats_per_host'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.host or 'unknown host'}"
+
+class HostConcurrency(models.Model):
+    """
+    Learned number of simultaneous transfers for one CDN host, adjusted after every
+    attempt with additive increase / multiplicative decrease (see concurrency.py).
+    """
+    host = models.CharField(max_length=255, unique=True)
+    # Fractional so increases can be spread over a round of completions; floor() slots are used
+    limit = models.FloatField()
+    # Moving averages: aggregate bytes per second across the host's transfers, time to first byte
+    throughput = models.FloatField(null=True, blank=True)
+    ttfb_ms = models.FloatField(null=True, blank=True)
+    # Aggregate throughput when the limit was last raised, to detect increases that made things slower
+    baseline_throughput = models.FloatField(null=True, blank=True)
+    samples_since_change = models.IntegerField(default=0)
+    congestion_events = models.IntegerField(default=0)
+    last_congestion_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['host']
+
+    @property
+    def slots(self):
+        return int(self.limit)
+
+    def __str__(self):
+        return f"{self.host}: {self.slots} slots"
+
 @receiver(pre_delete, sender=Anime)
 def anime_delete_files(sender, instance, **kwargs):
     """Delete the anime folder when the Anime object is deleted."""
     if instance.directory_name:
-        anime_path = Path(settings.MEDIA_ROOT) / instance.directory_name
+        anime_path = Path(settings.MEDIA_ROOT) / storage_node_dir(instance.storage_node) / instance.directory_name
         if anime_path.exists() and anime_path.is_dir():
             print(f"Deleting anime directory: {anime_path}")
             shutil.rmtree(anime_path)
@@ -0,0 +1,159 @@
+import os
+import struct
+
+# Boxes whose payload is made of child boxes, on the path from moov down to stco/co64
+CONTAINER_BOXES = {b'moov', b'trak', b'mdia', b'minf', b'stbl', b'edts', b'dinf', b'mvex', b'moof', b'traf'}
+UINT32_MAX = 0xFFFFFFFF
+
+
+class MP4Error(Exception):
+    pass
+
+
+def read_top_level_boxes(f):
+    """
+    Return [(type, offset, size)] for the top-level boxes of an open MP4 file.
+    """
+    f.seek(0, os.SEEK_END)
+    file_size = f.tell()
+    boxes = []
+    offset = 0
+    while offset < file_size:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            raise MP4Error(f"Truncated box header at {offset}")
+        size, box_type = struct.unpack('>I4s', header)
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+        elif size == 0:
+            size = file_size - offset
+        if size < 8 or offset + size > file_size:
+            raise MP4Error(f"Invalid size for box {box_type!r} at {offset}")
+        boxes.append((box_type, offset, size))
+        offset += size
+    return boxes
+
+def _iter_children(data, start, end):
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header or offset + size > end:
+            raise MP4Error(f"Invalid size for box {box_type!r} inside moov")
+        yield box_type, offset, size, header
+        offset += size
+
+def _rewrite_box(data, offset, size, header, box_type, relocate, force_co64):
+    """
+    Return the new bytes for one box, recursing into containers and patching chunk offsets.
+    """
+    if box_type in CONTAINER_BOXES:
+        children = b''.join(
+            _rewrite_box(data, child_off, child_size, child_header, child_type, relocate, force_co64)
+            for child_type, child_off, child_size, child_header in _iter_children(data, offset + header, offset + size)
+        )
+        return struct.pack('>I4s', 8 + len(children), box_type) + children
+
+    if box_type in (b'stco', b'co64'):
+        version_flags, count = struct.unpack_from('>II', data, offset + header)
+        fmt = '>%dI' % count if box_type == b'stco' else '>%dQ' % count
+        entries = struct.unpack_from(fmt, data, offset + header + 8)
+        entries = [relocate(x) for x in entries]
+        if box_type == b'stco' and (force_co64 or any(x > UINT32_MAX for x in entries)):
+            box_type, fmt = b'co64', '>%dQ' % count
+        payload = struct.pack('>II', version_flags, count) + struct.pack(fmt, *entries)
+        return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+    return bytes(data[offset:offset + size])
+
+def build_moov(moov, relocate_by):
+    """
+    Rewrite a moov box so its chunk offsets account for moov moving `relocate_by(moov_size)`.
+    The size of the new moov depends on whether stco must grow to co64, so iterate to a fixed point.
+    """
+    size = len(moov)
+    force_co64 = False
+    for _ in range(3):
+        relocate = relocate_by(size)
+        new_moov = _rewrite_box(moov, 0, len(moov), 8, b'moov', relocate, force_co64)
+        if len(new_moov) == size:
+            return new_moov
+        # A stco was promoted to co64: the moov grew, recompute offsets with the new size
+        size = len(new_moov)
+        force_co64 = True
+    raise MP4Error("Could not settle moov size")
+
+def needs_faststart(path):
+    with open(path, 'rb') as f:
+        boxes = read_top_level_boxes(f)
+    types = [box_type for box_type, _, _ in boxes]
+    if b'moov' not in types or b'mdat' not in types:
+        return False
+    return types.index(b'moov') > types.index(b'mdat')
+
+def faststart(path, buffer_size=1024 * 1024):
+    """
+    Move the moov atom in front of mdat so players can start without reading the whole file.
+    The media data is streamed with a bounded buffer into a temp file next to the original,
+    which then atomically replaces it. Returns True if the file was rewritten.
+    """
+    with open(path, 'rb') as src:
+        boxes = read_top_level_boxes(src)
+        types = [box_type for box_type, _, _ in boxes]
+        if b'moov' not in types or b'mdat' not in types:
+            raise MP4Error("Not a progressive MP4 (missing moov or mdat)")
+        moov_index = types.index(b'moov')
+        mdat_index = types.index(b'mdat')
+        if moov_index < mdat_index:
+            return False
+
+        _, moov_offset, moov_size = boxes[moov_index]
+        src.seek(moov_offset)
+        moov = src.read(moov_size)
+        if moov[4:8] != b'moov' or struct.unpack('>I', moov[:4])[0] == 1:
+            # 64-bit moov headers do not happen in practice, keep the parser simple
+            raise MP4Error("Unsupported moov header")
+
+        insert_at = boxes[mdat_index][1]
+
+        def relocate_by(new_moov_size):
+            def relocate(x):
+                # Everything between the insertion point and the old moov shifts forward
+                if insert_at <= x < moov_offset:
+                    return x + new_moov_size
+                return x
+            return relocate
+
+        new_moov = build_moov(moov, relocate_by)
+
+        tmp_path = f"{path}.faststart"
+        try:
+            with open(tmp_path, 'wb') as dst:
+                for index, (box_type, offset, size) in enumerate(boxes):
+                    if index == mdat_index:
+                        dst.write(new_moov)
+                    if index == moov_index:
+                        continue
+                    src.seek(offset)
+                    _copy_range(src, dst, size, buffer_size)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+    return True
+
+def _copy_range(src, dst, length, buffer_size):
+    remaining = length
+    while remaining > 0:
+        chunk = src.read(min(buffer_size, remaining))
+        if not chunk:
+            raise MP4Error("Unexpected end of file while copying")
+        dst.write(chunk)
+        remaining -= len(chunk)
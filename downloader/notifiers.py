@@ -0,0 +1,143 @@
+from datetime import timedelta
+from pathlib import Path
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import MediaRefresh
+
+
+class MediaServerNotifier:
+    """
+    Asks a media server to rescan specific library directories.
+    `path_prefix` maps MEDIA_ROOT to the same folder as mounted on the media server.
+    """
+    def __init__(self, url, token=None, path_prefix=None, timeout=10, **options):
+        self.url = url.rstrip('/')
+        self.token = token
+        self.path_prefix = path_prefix
+        self.timeout = timeout
+        self.options = options
+
+    def server_path(self, path):
+        if not self.path_prefix:
+            return str(path)
+        rel_path = Path(path).relative_to(settings.MEDIA_ROOT)
+        return str(Path(self.path_prefix) / rel_path)
+
+    def refresh(self, paths):
+        raise NotImplementedError
+
+
+class JellyfinNotifier(MediaServerNotifier):
+    """Jellyfin/Emby: one Library/Media/Updated call covering every path."""
+    def refresh(self, paths):
+        import requests
+
+        resp = requests.post(
+            f"{self.url}/Library/Media/Updated",
+            json={'Updates': [{'Path': self.server_path(path), 'UpdateType': 'Created'} for path in paths]},
+            headers={'X-Emby-Token': self.token or ''},
+            timeout=self.timeout,
+        )
+        resp.raise_for_status()
+
+
+class PlexNotifier(MediaServerNotifier):
+    """Plex: partial scan of a library section, one call per path."""
+    def refresh(self, paths):
+        import requests
+
+        for path in paths:
+            resp = requests.get(
+                f"{self.url}/library/sections/{self.options.get('section', 1)}/refresh",
+                params={'path': self.server_path(path), 'X-Plex-Token': self.token or ''},
+                timeout=self.timeout,
+            )
+            resp.raise_for_status()
+
+
+class KodiNotifier(MediaServerNotifier):
+    """Kodi: JSON-RPC VideoLibrary.Scan of a directory, one call per path."""
+    def refresh(self, paths):
+        import requests
+
+        auth = (self.options['username'], self.options.get('password', '')) if self.options.get('username') else None
+        for path in paths:
+            resp = requests.post(
+                f"{self.url}/jsonrpc",
+                json={
+                    'jsonrpc': '2.0',
+                    'method': 'VideoLibrary.Scan',
+                    'params': {'directory': self.server_path(path).rstrip('/') + '/'},
+                    'id': 1,
+                },
+                auth=auth,
+                timeout=self.timeout,
+            )
+            resp.raise_for_status()
+
+
+NOTIFIER_TYPES = {
+    'jellyfin': JellyfinNotifier,
+    'emby': JellyfinNotifier,
+    'plex': PlexNotifier,
+    'kodi': KodiNotifier,
+}
+
+def get_notifiers():
+    """
+    Build the notifiers configured in settings.MEDIA_SERVERS.
+    """
+    notifiers = []
+    for config in getattr(settings, 'MEDIA_SERVERS', []):
+        config = dict(config)
+        notifier_class = NOTIFIER_TYPES[config.pop('type').lower()]
+        notifiers.append(notifier_class(**config))
+    return notifiers
+
+def schedule_refresh(path, server=''):
+    """
+    Record that `path` changed. Completions within MEDIA_REFRESH_WINDOW of each other
+    are coalesced into one refresh, delayed at most MEDIA_REFRESH_MAX_DELAY after the first.
+    With `server` (a media server URL) only that server is refreshed.
+    """
+    if not getattr(settings, 'MEDIA_SERVERS', []):
+        return
+    now = timezone.now()
+    window = timedelta(seconds=getattr(settings, 'MEDIA_REFRESH_WINDOW', 60))
+    max_delay = timedelta(seconds=getattr(settings, 'MEDIA_REFRESH_MAX_DELAY', 300))
+    with transaction.atomic():
+        refresh, created = MediaRefresh.objects.select_for_update().get_or_create(
+            path=str(path), server=server, defaults={'first_event_at': now, 'due_at': now + window}
+        )
+        if not created:
+            refresh.due_at = min(now + window, refresh.first_event_at + max_delay)
+            refresh.save(update_fields=['due_at'])
+
+def flush_refreshes(force=False):
+    """
+    Send one refresh per due directory (every pending one with `force`) to the
+    configured media servers it is pending for. Returns the list of refreshed paths.
+    """
+    with transaction.atomic():
+        pending = MediaRefresh.objects.select_for_update(skip_locked=True)
+        if not force:
+            pending = pending.filter(due_at__lte=timezone.now())
+        due = list(pending.values_list('id', 'path', 'server'))
+        MediaRefresh.objects.filter(id__in=[refresh_id for refresh_id, _, _ in due]).delete()
+
+    if not due:
+        return []
+
+    for notifier in get_notifiers():
+        paths = list(dict.fromkeys(path for _, path, server in due if server in ('', notifier.url)))
+        if not paths:
+            continue
+        try:
+            notifier.refresh(paths)
+        except Exception as e:
+            print(f"{notifier.__class__.__name__} refresh failed: {e}")
+            # Try again in the next window rather than losing the update, on this server only
+            for path in paths:
+                schedule_refresh(path, server=notifier.url)
+    return list(dict.fromkeys(path for _, path, _ in due))
@@ -0,0 +1,148 @@
+import os
+import shutil
+from pathlib import Path
+from django.conf import settings
+from django.db import transaction
+from .models import Anime, Episode
+from .utils import clean_filename, episode_relative_path, storage_node_dir
+
+
+def storage_nodes():
+    return list(getattr(settings, 'STORAGE_NODES', {}))
+
+def download_queue(node):
+    """
+    Celery queue of a node's download workers (`celery worker -Q downloads.<node>`).
+    Animes without a node go to the default queue, served by any worker.
+    """
+    return f"downloads.{node}" if node else None
+
+def postprocess_queue(node):
+    return f"postprocess.{node}" if node else 'postprocess'
+
+def anime_path(anime, node=None):
+    """Absolute path of the anime folder on `node` (default: where it is now)."""
+    node = anime.storage_node if node is None else node
+    return Path(settings.MEDIA_ROOT) / storage_node_dir(node) / (anime.directory_name or clean_filename(anime.title))
+
+def folder_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except FileNotFoundError:
+                continue
+    return total
+
+def choose_node():
+    """
+    Node for a new anime: STORAGE_NODE_DEFAULT if set, otherwise the one with the most free space.
+    """
+    nodes = storage_nodes()
+    if not nodes:
+        return None
+    default = getattr(settings, 'STORAGE_NODE_DEFAULT', None)
+    if default in nodes:
+        return default
+
+    def free_space(node):
+        path = Path(settings.MEDIA_ROOT) / storage_node_dir(node)
+        path.mkdir(parents=True, exist_ok=True)
+        return shutil.disk_usage(path).free
+
+    return max(nodes, key=free_space)
+
+def move_anime(anime, node):
+    """
+    Move the whole anime folder to `node` and point its episodes there.
+    Refused while one of its episodes is downloading. During the move the anime is flagged
+    `moving`: the outbox holds its downloads back and a worker that already got one puts
+    it back in the queue. The folder is copied under a temporary name and renamed into
+    place, and the node is switched only once it is there.
+    """
+    from .notifiers import schedule_refresh
+
+    if node not in storage_nodes():
+        raise ValueError(f"Unknown storage node: {node}")
+    with transaction.atomic():
+        anime = Anime.objects.select_for_update().get(id=anime.id)
+        if anime.storage_node == node:
+            return anime
+        if anime.moving:
+            raise RuntimeError(f"{anime.title} is already being moved")
+        if anime.episodes.filter(status='downloading').exists():
+            raise RuntimeError(f"{anime.title} has downloads running, try again later")
+        Anime.objects.filter(id=anime.id).update(moving=True)
+
+    try:
+        # A download claimed just before the flag was committed did not see it
+        if anime.episodes.filter(status='downloading').exists():
+            raise RuntimeError(f"{anime.title} has downloads running, try again later")
+        source, target = anime_path(anime), anime_path(anime, node)
+        if target.exists():
+            raise RuntimeError(f"{target} already exists")
+
+        if source.exists():
+            print(f"Moving {source} -> {target}")
+            temp = target.with_name(f".{target.name}.moving")
+            if temp.exists():
+                raise RuntimeError(f"{temp} left over from an interrupted move")
+            target.parent.mkdir(parents=True, exist_ok=True)
+            # A rename when both are on one filesystem, otherwise copy then delete
+            shutil.move(str(source), str(temp))
+            if target.exists():
+                # Never merge into (or nest inside) a folder that appeared meanwhile
+                shutil.move(str(temp), str(source))
+                raise RuntimeError(f"{target} appeared during the move")
+            os.rename(temp, target)
+
+        with transaction.atomic():
+            Anime.objects.filter(id=anime.id).update(storage_node=node, moving=False)
+            anime.storage_node = node
+            completed = list(anime.episodes.filter(status='completed').select_related('anime'))
+            for episode in completed:
+                episode.file_path = str(Path(settings.MEDIA_URL) / episode_relative_path(episode)).replace("\\", "/")
+            Episode.objects.bulk_update(completed, ['file_path'])
+    finally:
+        Anime.objects.filter(id=anime.id, moving=True).update(moving=False)
+
+    for path in (source, target):
+        try:
+            schedule_refresh(path)
+        except Exception as e:
+            print(f"Could not schedule media server refresh for {path}: {e}")
+    return anime
+
+def plan_rebalance(sizes=None):
+    """
+    Moves [(anime, from_node, to_node)] evening out the bytes stored on each node:
+    repeatedly the anime on the fullest node whose size best fits half the gap to the
+    emptiest one. Animes without a node are left where they are.
+    `sizes` maps anime id to bytes (measured on disk when not given).
+    """
+    nodes = storage_nodes()
+    animes = list(Anime.objects.filter(storage_node__in=nodes))
+    if sizes is None:
+        sizes = {anime.id: folder_size(anime_path(anime)) for anime in animes}
+    usage = {node: 0 for node in nodes}
+    placed = {node: [] for node in nodes}
+    for anime in animes:
+        usage[anime.storage_node] += sizes[anime.id]
+        placed[anime.storage_node].append(anime)
+
+    moves = []
+    while len(nodes) > 1:
+        fullest = max(nodes, key=usage.get)
+        emptiest = min(nodes, key=usage.get)
+        half_gap = (usage[fullest] - usage[emptiest]) / 2
+        candidates = [anime for anime in placed[fullest] if 0 < sizes[anime.id] <= half_gap]
+        if not candidates:
+            break
+        anime = max(candidates, key=lambda anime: sizes[anime.id])
+        placed[fullest].remove(anime)
+        placed[emptiest].append(anime)
+        usage[fullest] -= sizes[anime.id]
+        usage[emptiest] += sizes[anime.id]
+        moves.append((anime, fullest, emptiest))
+    return moves
@@ -0,0 +1,159 @@
+import statistics
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import Anime, Episode
+
+# Upstream "status" values of series that will not get new episodes
+FINISHED_STATUSES = {'terminato', 'finito', 'concluso', 'droppato'}
+# Episodes first seen closer together than this belong to the same release
+RELEASE_GAP = timedelta(hours=6)
+DAY = 24 * 3600
+WEEK = 7 * DAY
+
+
+def release_events(anime):
+    """
+    When new episodes of `anime` showed up, one time per release. The episodes' created_at
+    is when polling first saw them; the first group is the initial import, not a release.
+    """
+    events = []
+    for created_at in anime.episodes.order_by('created_at').values_list('created_at', flat=True):
+        if not events or created_at - events[-1] > RELEASE_GAP:
+            events.append(created_at)
+    return events[1:]
+
+def learn_cadence(events):
+    """
+    (interval, phase) in seconds: releases are expected at epoch times k * interval + phase.
+    The interval is the median gap between releases rounded to whole days (weekly when
+    only one release is known), the phase the circular median of the release times.
+    Returns None without any release.
+    """
+    if not events:
+        return None
+    gaps = [(b - a).total_seconds() for a, b in zip(events, events[1:])]
+    interval = statistics.median(gaps) if gaps else WEEK
+    interval = max(DAY, round(interval / DAY) * DAY)
+
+    offsets = [event.timestamp() % interval for event in events]
+
+    def spread(candidate):
+        return sum(min(abs(offset - candidate), interval - abs(offset - candidate)) for offset in offsets)
+
+    return interval, min(offsets, key=spread)
+
+def expected_release(cadence, moment):
+    """The first expected release at or after `moment`."""
+    interval, phase = cadence
+    timestamp = moment.timestamp()
+    k = -(-(timestamp - phase) // interval)
+    return datetime.fromtimestamp(k * interval + phase, tz=dt_timezone.utc)
+
+def next_check_at(anime, now=None, events=None):
+    """
+    When to look for new episodes of `anime` next (None: never, the series is finished).
+
+    With a known cadence, checks run every POLL_WINDOW_INTERVAL seconds from
+    POLL_WINDOW_BEFORE before to POLL_WINDOW_AFTER after each expected release, and not at
+    all in between. A show that missed POLL_STALE_RELEASES expected releases in a row, or
+    whose cadence is unknown, is checked after half the time it has been quiet
+    (so intervals grow exponentially), between POLL_MIN_BACKOFF and POLL_MAX_BACKOFF.
+    """
+    if anime.airing_finished:
+        return None
+    now = now or timezone.now()
+    events = release_events(anime) if events is None else events
+    before = timedelta(seconds=getattr(settings, 'POLL_WINDOW_BEFORE', 3600))
+    after = timedelta(seconds=getattr(settings, 'POLL_WINDOW_AFTER', 3 * 3600))
+    every = timedelta(seconds=getattr(settings, 'POLL_WINDOW_INTERVAL', 900))
+
+    cadence = learn_cadence(events)
+    if cadence:
+        interval = timedelta(seconds=cadence[0])
+        last_release = events[-1]
+        # The release whose window has not ended yet
+        expected = expected_release(cadence, now - after)
+        if last_release >= expected - before:
+            # Already found in this window: wait for the next one
+            expected += interval
+        missed = int((expected - before - last_release) / interval)
+        if missed < getattr(settings, 'POLL_STALE_RELEASES', 3):
+            window_start = expected - before
+            return window_start if now < window_start else now + every
+
+    quiet_since = events[-1] if events else anime.created_at
+    delay = (now - quiet_since) / 2
+    delay = max(timedelta(seconds=getattr(settings, 'POLL_MIN_BACKOFF', DAY)), delay)
+    delay = min(timedelta(seconds=getattr(settings, 'POLL_MAX_BACKOFF', 30 * DAY)), delay)
+    return now + delay
+
+def is_finished(info, episode_count):
+    status = (info.get('status') or '').strip().lower()
+    total = info.get('episodes_count') or 0
+    return status in FINISHED_STATUSES and episode_count >= total
+
+def check_anime(anime):
+    """
+    Look for new episodes of one anime, queue them and schedule its next check.
+    Returns the number of new episodes.
+    """
+    from .utils import get_episode_urls, rewrite_url, save_anime_metadata
+    from .dispatch import enqueue_episode_downloads
+
+    print(f"Checking {anime.title}...")
+    episodes_data, _, info = get_episode_urls(anime.source_url, with_info=True)
+
+    source_url = rewrite_url(anime.source_url)
+    if source_url != anime.source_url:
+        # Lazily move the stored URL to the preferred mirror
+        Anime.objects.filter(id=anime.id).update(source_url=source_url)
+
+    known = set(anime.episodes.values_list('number', flat=True))
+    new_episodes = [(str(ep_num), ep_url) for ep_num, ep_url in episodes_data if str(ep_num) not in known]
+    with transaction.atomic():
+        created = Episode.objects.bulk_create([
+            Episode(anime=anime, number=number, source_url=ep_url, status='pending')
+            for number, ep_url in new_episodes
+        ])
+        enqueue_episode_downloads([episode.id for episode in created])
+    for number, _ in new_episodes:
+        print(f"New episode found for {anime.title}: {number}")
+
+    anime.airing_finished = bool(episodes_data) and is_finished(info, len(episodes_data))
+    anime.last_checked_at = timezone.now()
+    anime.next_check_at = next_check_at(anime, now=anime.last_checked_at)
+    Anime.objects.filter(id=anime.id).update(
+        airing_finished=anime.airing_finished,
+        last_checked_at=anime.last_checked_at,
+        next_check_at=anime.next_check_at,
+    )
+
+    # Update anime status in case all episodes were already completed but status was weird
+    anime.update_status()
+
+    # Only rewrites metadata files whose content changed
+    save_anime_metadata(anime)
+    return len(created)
+
+def due_animes(now=None):
+    """Animes still airing whose next check is due (never checked ones first)."""
+    now = now or timezone.now()
+    return Anime.objects.filter(
+        Q(next_check_at__isnull=True) | Q(next_check_at__lte=now), airing_finished=False,
+    ).order_by(F('next_check_at').asc(nulls_first=True))
+
+def claim_check(anime, now=None):
+    """
+    Take the due check of `anime` for this tick. next_check_at is pushed one
+    POLL_WINDOW_INTERVAL ahead by a conditional UPDATE on the value that was read, so an
+    overlapping tick that read the same row gets False and skips it. The check then sets the
+    real next time; if its worker dies, the anime is due again after the interval.
+    """
+    now = now or timezone.now()
+    due = Q(next_check_at__isnull=True) if anime.next_check_at is None else Q(next_check_at=anime.next_check_at)
+    return Anime.objects.filter(due, id=anime.id).update(
+        next_check_at=now + timedelta(seconds=getattr(settings, 'POLL_WINDOW_INTERVAL', 900))
+    ) == 1
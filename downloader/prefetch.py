@@ -0,0 +1,112 @@
+import os
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from .models import Anime, EpisodeListCache
+
+
+def cache_key(url):
+    """Path of an anime page ("/anime/123-slug"): mirrors share it, the host differs."""
+    return urllib.parse.urlsplit(url).path.rstrip('/')
+
+def _ttl():
+    return timedelta(seconds=getattr(settings, 'EPISODE_PREFETCH_TTL', 1800))
+
+def cached_episode_list(url):
+    """
+    (episodes, genres) scraped from `url` less than EPISODE_PREFETCH_TTL seconds ago, or None.
+    """
+    entry = EpisodeListCache.objects.filter(
+        path=cache_key(url), fetched_at__gte=timezone.now() - _ttl()
+    ).first()
+    if not entry:
+        return None
+    return [tuple(episode) for episode in entry.episodes], entry.genres
+
+def store_episode_list(url, episodes, genres):
+    now = timezone.now()
+    EpisodeListCache.objects.update_or_create(
+        path=cache_key(url), defaults={'episodes': episodes, 'genres': genres, 'fetched_at': now}
+    )
+    # Expired entries are never read again
+    EpisodeListCache.objects.filter(fetched_at__lt=now - _ttl()).delete()
+
+def _lower_priority():
+    # Linux schedules threads individually: nice only the prefetch threads, not the web server
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+    except (AttributeError, OSError):
+        pass
+
+
+class EpisodeListPrefetcher:
+    """
+    Scrape the episode lists of the top search results in background threads, so adding
+    one of them finds its list in the cache. At most EPISODE_PREFETCH_CONCURRENCY pages are
+    fetched at once, at a lower CPU priority; results arriving while that many are
+    already waiting are dropped, since the prefetch is only a guess.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._pending = set()
+
+    def _pool(self):
+        # Threads do not survive fork (gunicorn/celery prefork), one pool per process
+        if self._executor is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._pending = set()
+            self._executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'EPISODE_PREFETCH_CONCURRENCY', 2),
+                thread_name_prefix='episode-prefetch',
+                initializer=_lower_priority,
+            )
+        return self._executor
+
+    def _fetch(self, url):
+        from .utils import get_episode_urls
+
+        key = cache_key(url)
+        try:
+            if Anime.objects.filter(source_url__endswith=key).exists() or cached_episode_list(url):
+                return
+            episodes, genres = get_episode_urls(url)
+            if episodes:
+                store_episode_list(url, episodes, genres)
+        except Exception as e:
+            print(f"Prefetch of {url} failed: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+            # Each pool thread opens its own DB connection, don't leak it
+            connection.close()
+
+    def prefetch(self, results):
+        """
+        Queue the first EPISODE_PREFETCH_TOP_N results. Never blocks and never touches
+        the database, so async views can call it directly. Returns the number queued.
+        """
+        top_n = getattr(settings, 'EPISODE_PREFETCH_TOP_N', 3)
+        concurrency = getattr(settings, 'EPISODE_PREFETCH_CONCURRENCY', 2)
+        if top_n <= 0 or concurrency <= 0:
+            return 0
+        queued = 0
+        with self._lock:
+            pool = self._pool()
+            for result in results[:top_n]:
+                url = result.get('url')
+                if not url or cache_key(url) in self._pending:
+                    continue
+                if len(self._pending) >= 2 * concurrency:
+                    break
+                self._pending.add(cache_key(url))
+                pool.submit(self._fetch, url)
+                queued += 1
+        return queued
+
+episode_prefetcher = EpisodeListPrefetcher()
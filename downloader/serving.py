@@ -0,0 +1,241 @@
+import asyncio
+import mimetypes
+import re
+import time
+import urllib.parse
+from pathlib import Path
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date, parse_http_date_safe
+from .models import Episode
+from .storage import staged_files
+from .utils import episode_relative_path
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 256 * 1024
+
+
+def library_path(episode):
+    """
+    Absolute path of a completed episode's file, checked to be inside MEDIA_ROOT.
+    Raises Http404 when there is nothing to serve.
+    """
+    if episode.status != 'completed' or not episode.file_path:
+        raise Http404("Episode is not downloaded")
+    media_root = Path(settings.MEDIA_ROOT).resolve()
+    rel_path = episode.file_path.removeprefix(settings.MEDIA_URL).lstrip('/')
+    path = (media_root / rel_path).resolve()
+    if not path.is_relative_to(media_root) or not path.is_file():
+        raise Http404("File not found")
+    return path
+
+def parse_range(header, size):
+    """
+    Parse a single-range Range header against a file of `size` bytes.
+    Returns (start, end) inclusive, None to serve the whole file (no, multiple or
+    malformed ranges) or False when the range cannot be satisfied.
+    """
+    match = RANGE_RE.match((header or '').strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None
+    else:
+        # Suffix range: the last N bytes
+        start, end = max(size - int(last), 0), size - 1
+    if start >= size or end < start:
+        return False
+    return start, end
+
+def read_chunks(path, start, length, waiter=None):
+    """
+    Yield `length` bytes from `start`. With a waiter the file may still be growing:
+    at its current end the reader waits for more until the waiter gives up.
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        waiting = True
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if chunk:
+                length -= len(chunk)
+                if waiter:
+                    waiter.reset()
+                yield chunk
+            elif waiting and waiter:
+                # One more read after giving up: the last bytes may land right before the download ends
+                waiting = waiter.wait()
+            else:
+                break
+
+async def aread_chunks(path, start, length, waiter=None):
+    # Reads happen in a thread so the event loop keeps serving other requests
+    f = await asyncio.to_thread(open, path, 'rb')
+    try:
+        await asyncio.to_thread(f.seek, start)
+        waiting = True
+        while length > 0:
+            chunk = await asyncio.to_thread(f.read, min(CHUNK_SIZE, length))
+            if chunk:
+                length -= len(chunk)
+                if waiter:
+                    waiter.reset()
+                yield chunk
+            elif waiting and waiter:
+                waiting = await waiter.await_more()
+            else:
+                break
+    finally:
+        f.close()
+
+def chunk_iterator(request, path, start, length, waiter=None):
+    """
+    Sync or async file iterator depending on the server: Django buffers a whole
+    response when it has to convert one kind into the other.
+    """
+    if isinstance(request, ASGIRequest):
+        return aread_chunks(path, start, length, waiter)
+    return read_chunks(path, start, length, waiter)
+
+def accel_response(path, content_type):
+    """
+    Hand the transfer to the front server. nginx maps MEDIA_ACCEL_PREFIX to MEDIA_ROOT
+    in an `internal` location; Apache/lighttpd read the absolute path from X-Sendfile.
+    Both handle Range themselves.
+    """
+    response = HttpResponse(content_type=content_type)
+    if settings.MEDIA_ACCEL == 'nginx':
+        rel_path = path.relative_to(Path(settings.MEDIA_ROOT).resolve()).as_posix()
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX.rstrip('/') + '/' + urllib.parse.quote(rel_path)
+    else:
+        response['X-Sendfile'] = str(path)
+    return response
+
+def serve_file(request, path):
+    """
+    Serve a library file: through the front server when MEDIA_ACCEL is set,
+    otherwise streamed from here with single-range (206) support.
+    """
+    content_type = mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+    if getattr(settings, 'MEDIA_ACCEL', ''):
+        response = accel_response(path, content_type)
+    else:
+        stat = path.stat()
+        size = stat.st_size
+        etag = f'"{stat.st_mtime_ns:x}-{size:x}"'
+        last_modified = http_date(stat.st_mtime)
+
+        byte_range = parse_range(request.headers.get('Range'), size)
+        if_range = request.headers.get('If-Range')
+        if byte_range and if_range and if_range != etag and parse_http_date_safe(if_range) != int(stat.st_mtime):
+            # The client's partial copy is of an older file: send all of it
+            byte_range = None
+
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        start, end = byte_range or (0, size - 1)
+        length = end - start + 1 if size else 0
+        response = StreamingHttpResponse(
+            chunk_iterator(request, path, start, length),
+            status=206 if byte_range else 200,
+            content_type=content_type,
+        )
+        response['Content-Length'] = str(length)
+        if byte_range:
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Accept-Ranges'] = 'bytes'
+        response['ETag'] = etag
+        response['Last-Modified'] = last_modified
+    response['Content-Disposition'] = f"inline; filename*=UTF-8''{urllib.parse.quote(path.name)}"
+    return response
+
+
+class DownloadWaiter:
+    """
+    Lets a reader at the end of an in-progress download wait for the next bytes:
+    polls every STREAM_POLL_INTERVAL seconds while the episode is still downloading,
+    for at most STREAM_STALL_TIMEOUT seconds without new data.
+    """
+    def __init__(self, episode_id):
+        self.episode_id = episode_id
+        self.poll = getattr(settings, 'STREAM_POLL_INTERVAL', 0.5)
+        self.timeout = getattr(settings, 'STREAM_STALL_TIMEOUT', 30)
+        self.idle_since = None
+
+    def reset(self):
+        self.idle_since = None
+
+    def _patient(self):
+        now = time.monotonic()
+        if self.idle_since is None:
+            self.idle_since = now
+        return now - self.idle_since < self.timeout
+
+    def _downloading(self):
+        return Episode.objects.filter(id=self.episode_id, status='downloading').exists()
+
+    def wait(self):
+        if not self._patient() or not self._downloading():
+            return False
+        time.sleep(self.poll)
+        return True
+
+    async def await_more(self):
+        if not self._patient() or not await sync_to_async(self._downloading)():
+            return False
+        await asyncio.sleep(self.poll)
+        return True
+
+def in_progress_path(episode):
+    """
+    Staging file of a running download. Raises Http404 when nothing is being written.
+    """
+    if episode.status != 'downloading':
+        raise Http404("Episode is not downloading")
+    staged = staged_files(Path(settings.MEDIA_ROOT) / episode_relative_path(episode))
+    if not staged:
+        raise Http404("Download has not started writing yet")
+    return staged[0]
+
+def serve_growing_file(request, episode, path):
+    """
+    Serve a file that is still being downloaded. The final length comes from the
+    Content-Length reserved for the download, so players see the full duration and
+    can seek; bytes not written yet are waited for (see DownloadWaiter).
+    Without a known length only a plain 200 stream from the start is possible.
+    """
+    content_type = mimetypes.guess_type(episode_relative_path(episode).name)[0] or 'application/octet-stream'
+    total = episode.reserved_bytes
+    waiter = DownloadWaiter(episode.id)
+
+    if not total:
+        response = StreamingHttpResponse(
+            chunk_iterator(request, path, 0, float('inf'), waiter), content_type=content_type,
+        )
+        response['Accept-Ranges'] = 'none'
+    else:
+        byte_range = parse_range(request.headers.get('Range'), total)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{total}'
+            return response
+        start, end = byte_range or (0, total - 1)
+        response = StreamingHttpResponse(
+            chunk_iterator(request, path, start, end - start + 1, waiter),
+            status=206 if byte_range else 200,
+            content_type=content_type,
+        )
+        response['Content-Length'] = str(end - start + 1)
+        if byte_range:
+            response['Content-Range'] = f'bytes {start}-{end}/{total}'
+        response['Accept-Ranges'] = 'bytes'
+    response['Cache-Control'] = 'no-store'
+    return response
@@ -0,0 +1,266 @@
+import fcntl
+import glob
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import Episode
+from .utils import storage_node_dir
+
+# Arbitrary key for the Postgres advisory lock serializing space admissions
+ADMISSION_LOCK_KEY = 0x616E696D
+
+
+def staging_path(final_path, attempt_id):
+    """
+    Where a download is written before promotion into MEDIA_ROOT.
+    With DOWNLOAD_STAGING_ROOT set it mirrors the library layout on the fast disk,
+    otherwise it is a hidden file next to the final one so media servers skip it.
+    The attempt id keeps two attempts of the same episode from sharing a file.
+    """
+    final_path = Path(final_path)
+    path = _staging_dir(final_path) / f".{final_path.name}.{attempt_id}.partial"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path
+
+def _staging_dir(final_path):
+    staging_root = getattr(settings, 'DOWNLOAD_STAGING_ROOT', None)
+    if staging_root:
+        return Path(staging_root) / final_path.parent.relative_to(settings.MEDIA_ROOT)
+    return final_path.parent
+
+def staged_files(final_path):
+    """
+    Staging files of running attempts for `final_path`, most recently written first.
+    """
+    final_path = Path(final_path)
+    files = []
+    for path in _staging_dir(final_path).glob(f".{glob.escape(final_path.name)}.*.partial"):
+        try:
+            files.append((path.stat().st_mtime, path))
+        except FileNotFoundError:
+            # Promoted or discarded meanwhile
+            continue
+    return [path for _, path in sorted(files, reverse=True)]
+
+class PromotionAborted(Exception):
+    """The download lost its claim while its promotion was waiting or copying."""
+
+
+def _keep_alive(staged_path, heartbeat):
+    """
+    Callable run while a promotion waits or copies: at most every DOWNLOAD_HEARTBEAT_SECONDS
+    it renews the download's lease through `heartbeat` and touches the staged file, so
+    neither the reaper nor cleanup_stale_staging take a slow promotion for a dead one.
+    """
+    every = getattr(settings, 'DOWNLOAD_HEARTBEAT_SECONDS', 30)
+    last_beat = time.monotonic()
+
+    def beat():
+        nonlocal last_beat
+        if time.monotonic() - last_beat < every:
+            return
+        last_beat = time.monotonic()
+        os.utime(staged_path)
+        if heartbeat and not heartbeat():
+            raise PromotionAborted(f"Lost the claim while promoting {staged_path}")
+
+    return beat
+
+@contextmanager
+def promotion_slot(on_wait=None):
+    """
+    Cross-process semaphore bounding concurrent promotions (PROMOTION_CONCURRENCY),
+    built from flock()ed slot files so it works across Celery prefork children.
+    `on_wait` is called on every round spent waiting for a free slot.
+    """
+    slots = getattr(settings, 'PROMOTION_CONCURRENCY', 2)
+    lock_dir = Path(getattr(settings, 'DOWNLOAD_STAGING_ROOT', None) or settings.MEDIA_ROOT) / '.promotion-slots'
+    lock_dir.mkdir(parents=True, exist_ok=True)
+
+    while True:
+        for slot in range(slots):
+            handle = open(lock_dir / f"slot-{slot}.lock", 'w')
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                handle.close()
+                continue
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+                handle.close()
+            return
+        if on_wait:
+            on_wait()
+        time.sleep(0.5)
+
+def same_device(path, other):
+    return os.stat(path).st_dev == os.stat(other).st_dev
+
+def promote_file(staged_path, final_path, heartbeat=None):
+    """
+    Move a finished download into the library without ever exposing a partial file.
+    Same filesystem: a single atomic rename. Across devices: copy with a large buffer to a
+    hidden temp name on the destination, then rename it into place.
+    `heartbeat` (returning False once the claim is lost) keeps the download's lease
+    while the copy waits for a slot or runs; PromotionAborted is raised if it fails.
+    """
+    staged_path, final_path = Path(staged_path), Path(final_path)
+    final_path.parent.mkdir(parents=True, exist_ok=True)
+
+    if same_device(staged_path, final_path.parent):
+        os.replace(staged_path, final_path)
+        return
+
+    buffer_size = getattr(settings, 'PROMOTION_BUFFER_SIZE', 16 * 1024 * 1024)
+    tmp_path = final_path.parent / f".{final_path.name}.promoting"
+    keep_alive = _keep_alive(staged_path, heartbeat)
+    with promotion_slot(on_wait=keep_alive):
+        try:
+            with open(staged_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+                while True:
+                    buffer = src.read(buffer_size)
+                    if not buffer:
+                        break
+                    dst.write(buffer)
+                    keep_alive()
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.replace(tmp_path, final_path)
+        except BaseException:
+            if tmp_path.exists():
+                tmp_path.unlink()
+            raise
+    staged_path.unlink()
+
+def discard_staged(staged_path):
+    try:
+        Path(staged_path).unlink()
+    except FileNotFoundError:
+        pass
+
+def cleanup_stale_staging(max_age):
+    """
+    Delete staged files nobody wrote to for `max_age` seconds (their worker died).
+    Only the dedicated staging root is scanned, never the library itself.
+    """
+    staging_root = getattr(settings, 'DOWNLOAD_STAGING_ROOT', None)
+    if not staging_root or not Path(staging_root).exists():
+        return 0
+    cutoff = time.time() - max_age
+    removed = 0
+    for path in Path(staging_root).rglob('*.partial'):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+def download_volumes(node=None):
+    """
+    Directories whose filesystems a download writes to: the library (the node's
+    directory of it, with storage nodes), plus the staging root.
+    """
+    paths = [Path(settings.MEDIA_ROOT) / storage_node_dir(node)]
+    staging_root = getattr(settings, 'DOWNLOAD_STAGING_ROOT', None)
+    if staging_root:
+        paths.append(Path(staging_root))
+    for path in paths:
+        path.mkdir(parents=True, exist_ok=True)
+    # One entry per device, so a shared filesystem is not counted twice
+    return list({os.stat(path).st_dev: path for path in paths}.values())
+
+def outstanding_reservations(exclude_id=None, node=None):
+    """
+    Bytes promised to running downloads on `node` that are not written to disk yet.
+    """
+    running = Episode.objects.filter(status='downloading', reserved_bytes__isnull=False, anime__storage_node=node)
+    if exclude_id:
+        running = running.exclude(id=exclude_id)
+    return sum(size * (100 - min(progress, 100)) // 100 for size, progress in running.values_list('reserved_bytes', 'progress'))
+
+def fits_on_disk(size, exclude_id=None, node=None):
+    """
+    Return (fits, message) for a download of `size` bytes to `node`, counting the safety
+    margin and the space already reserved by other running downloads.
+    """
+    margin = getattr(settings, 'DISK_SPACE_MARGIN', 1024 ** 3)
+    outstanding = outstanding_reservations(exclude_id=exclude_id, node=node)
+    for path in download_volumes(node):
+        available = shutil.disk_usage(path).free - outstanding - margin
+        if size > available:
+            return False, f"Needs {size // 1024 ** 2} MiB on {path}, {max(available, 0) // 1024 ** 2} MiB available"
+    return True, None
+
+@contextmanager
+def admission_lock():
+    """
+    Serialize admissions so two workers can't both take the last free gigabytes.
+    Postgres: transaction-scoped advisory lock. SQLite already serializes writers.
+    """
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", [ADMISSION_LOCK_KEY])
+        yield
+
+def reserve_space(episode_id, worker_id, size):
+    """
+    Admit a claimed download of `size` bytes (its Content-Length, 0 if unknown).
+    On success the reservation is recorded on the episode; otherwise the episode is
+    parked in waiting_for_space and released later by release_waiting_episodes.
+    Returns (admitted, message).
+    """
+    node = Episode.objects.filter(id=episode_id).values_list('anime__storage_node', flat=True).first()
+    with admission_lock():
+        fits, message = fits_on_disk(size, exclude_id=episode_id, node=node)
+        if fits:
+            Episode.objects.filter(id=episode_id, worker_id=worker_id).update(reserved_bytes=size or None)
+            return True, None
+        Episode.objects.filter(id=episode_id, worker_id=worker_id).update(
+            status='waiting_for_space',
+            reserved_bytes=size,
+            error_message=message,
+            worker_id=None,
+            lease_expires_at=None,
+            transfer_host=None,
+            progress=0,
+            updated_at=timezone.now(),
+        )
+        return False, message
+
+def release_waiting_episodes():
+    """
+    Move waiting_for_space episodes back to pending, oldest first, while they fit.
+    Returns the ids that were released (already queued through the outbox).
+    """
+    from .dispatch import enqueue_episode_downloads
+
+    released = []
+    with admission_lock():
+        margin = getattr(settings, 'DISK_SPACE_MARGIN', 1024 ** 3)
+        waiting = Episode.objects.filter(status='waiting_for_space').order_by('updated_at', 'id')
+        # Each storage node has its own disks and budget
+        for node in waiting.order_by().values_list('anime__storage_node', flat=True).distinct():
+            outstanding = outstanding_reservations(node=node)
+            available = min(shutil.disk_usage(path).free for path in download_volumes(node)) - outstanding - margin
+            for episode_id, size in waiting.filter(anime__storage_node=node).values_list('id', 'reserved_bytes'):
+                size = size or 0
+                if size > available:
+                    break
+                # Released episodes are not running yet, keep their size out of later ones' budget
+                available -= size
+                released.append(episode_id)
+
+        if released:
+            Episode.objects.filter(id__in=released).update(status='pending', error_message=None, reserved_bytes=None)
+            enqueue_episode_downloads(released)
+    return released
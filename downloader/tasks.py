@@ -1,26 +1,128 @@
 from celery import shared_task
-from .models import Episode
-from .utils import download_file, clean_filename, extract_download_url
+from celery.exceptions import SoftTimeLimitExceeded
+from celery.signals import worker_process_init
+from .models import Anime, Episode
+from .utils import download_file, clean_filename, extract_download_url, episode_relative_path, scraper_session
+from .metadata import write_episode_nfo
+from .notifiers import schedule_refresh
+from .mirrors import is_upstream_url, rewrite_url, with_failover
+from .tracing import traced_request, upstream_get
+from .analytics import AttemptRecorder
+from .concurrency import observe_attempt, wait_for_slot
+from .placement import postprocess_queue
+from .integrity import StreamVerifier, is_retryable
+from .storage import staging_path, promote_file, discard_staged, cleanup_stale_staging, reserve_space, PromotionAborted
 from pathlib import Path
-import cloudscraper
-from bs4 import BeautifulSoup
+from datetime import timedelta
+import os
+import socket
+import urllib.parse
+import time
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+@worker_process_init.connect
+def warm_up_worker(**kwargs):
+    """
+    Runs in every Celery child right after the fork: build the scraper session and solve
+    the Cloudflare challenge now rather than during the child's first download.
+    """
+    if getattr(settings, 'WORKER_WARMUP', True):
+        from .utils import warm_up_scraper
+        warm_up_scraper()
+
+def _lease_expiry():
+    return timezone.now() + timedelta(seconds=getattr(settings, 'DOWNLOAD_LEASE_SECONDS', 120))
+
+def claim_episode(episode_id, worker_id):
+    """
+    Atomically move a pending episode to downloading and record who owns it.
+    Returns True only for the single caller whose conditional UPDATE matched.
+    """
+    claimed = Episode.objects.filter(id=episode_id, status='pending').update(
+        status='downloading',
+        progress=0,
+        error_message=None,
+        worker_id=worker_id,
+        lease_expires_at=_lease_expiry(),
+        updated_at=timezone.now(),
+    )
+    return claimed == 1
+
+def heartbeat_episode(episode_id, worker_id, **fields):
+    """
+    Extend the lease (and optionally save progress) while we still own the episode.
+    Returns False when the claim was lost: cancelled, skipped or reaped.
+    """
+    updated = Episode.objects.filter(id=episode_id, status='downloading', worker_id=worker_id).update(
+        lease_expires_at=_lease_expiry(),
+        updated_at=timezone.now(),
+        **fields,
+    )
+    return updated == 1
+
+def release_episode(episode_id, worker_id, **fields):
+    """
+    Write the final state of an owned episode and drop the lease.
+    """
+    fields.setdefault('reserved_bytes', None)
+    fields.setdefault('transfer_host', None)
+    return Episode.objects.filter(id=episode_id, worker_id=worker_id).update(
+        worker_id=None,
+        lease_expires_at=None,
+        updated_at=timezone.now(),
+        **fields,
+    ) == 1
 
 @shared_task(bind=True)
 def download_episode_task(self, episode_id):
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{self.request.id}"
+    return download_episode(episode_id, worker_id, self.request.id or os.getpid())
+
+def download_episode(episode_id, worker_id, attempt_id, on_progress=None, slot_wait=0):
+    """
+    Claim, fetch and store one pending episode. Shared by the Celery task and
+    `manage.py fetch_anime`; `on_progress(episode, downloaded, total)` is called per chunk.
+    When the CDN host has no free transfer slot the episode is put back in the outbox for
+    HOST_SLOT_RETRY_DELAY seconds, after waiting up to `slot_wait` seconds for one.
+    Every claimed attempt is recorded as a DownloadAttempt when it ends and adjusts
+    the concurrency limit of the host it downloaded from.
+    Returns a short status message.
+    """
+    attempt = AttemptRecorder(episode_id)
+    try:
+        return _transfer_episode(episode_id, worker_id, attempt_id, on_progress, attempt, slot_wait)
+    finally:
+        record = attempt.save()
+        if record:
+            try:
+                observe_attempt(record)
+            except Exception as e:
+                print(f"Could not update concurrency limit for {record.host}: {e}")
+
+def _transfer_episode(episode_id, worker_id, attempt_id, on_progress, attempt, slot_wait=0):
+    staged_path = None
     try:
+        if not claim_episode(episode_id, worker_id):
+            episode = Episode.objects.filter(id=episode_id).first()
+            return f"Task {episode.status if episode else 'missing'}"
         episode = Episode.objects.get(id=episode_id)
-        if episode.status != 'pending':
-            return f"Task {episode.status}"
+        if episode.anime.moving:
+            # Its folder is being moved to another node (placement.move_anime): the outbox
+            # holds the episode back until the move is done
+            from .dispatch import enqueue_episode_downloads
+            with transaction.atomic():
+                if release_episode(episode.id, worker_id, status='pending'):
+                    enqueue_episode_downloads([episode.id])
+            return "Anime is being moved"
+        attempt.claimed = True
 
-        episode.status = 'downloading'
-        episode.progress = 0
-        episode.error_message = None  # Clear previous error
-        episode.save()
         episode.anime.update_status()
 
         # 1. Fetch the episode page to get the video URL (if not already known)
-        scraper = cloudscraper.create_scraper()
+        scraper = scraper_session()
         
         # If we just have the page URL, we need to extract the video URL
         if not episode.video_url:
@@ -29,17 +131,27 @@ def download_episode_task(self, episode_id):
                 # Based on the old code, we should fetch the embed URL first
                 # The episode ID is the last part of the source_url
                 episode_id_unity = episode.source_url.rstrip('/').split('/')[-1]
-                host = episode.source_url.split('//')[1].split('/')[0]
-                embed_api_url = f"https://{host}/embed-url/{episode_id_unity}"
-                
+
                 # Step A: Get the actual embed URL (e.g. vixcloud)
-                headers = {
-                    'Referer': episode.source_url,
-                    'X-Requested-With': 'XMLHttpRequest'
-                }
-                resp = scraper.get(embed_api_url, headers=headers)
-                resp.raise_for_status()
-                embed_url = resp.text.strip()
+                def fetch_embed_url(base_url):
+                    page_url = rewrite_url(episode.source_url, base_url)
+                    host = page_url.split('//')[1].split('/')[0]
+                    headers = {
+                        'Referer': page_url,
+                        'X-Requested-With': 'XMLHttpRequest'
+                    }
+                    resp = upstream_get(scraper, f"https://{host}/embed-url/{episode_id_unity}", 'upstream.embed_url', headers=headers)
+                    resp.raise_for_status()
+                    return page_url, host, resp.text.strip()
+
+                if is_upstream_url(episode.source_url):
+                    page_url, host, embed_url = with_failover(fetch_embed_url)
+                    if page_url != episode.source_url:
+                        # Lazily move the stored URL to the mirror that answered
+                        Episode.objects.filter(id=episode.id).update(source_url=page_url)
+                        episode.source_url = page_url
+                else:
+                    page_url, host, embed_url = fetch_embed_url(None)
                 
                 if not embed_url.startswith('http'):
                     # Fallback or error
@@ -49,13 +161,14 @@ def download_episode_task(self, episode_id):
                 # Step B: Fetch the embed page to get the final video URL (window.downloadUrl)
                 print(f"Fetching embed page: {embed_url}")
                 # Vixcloud might need referer too
-                resp = scraper.get(embed_url, headers={'Referer': f"https://{host}/"})
+                resp = upstream_get(scraper, embed_url, 'upstream.embed_page', headers={'Referer': f"https://{host}/"})
                 resp.raise_for_status()
                 
                 video_url = extract_download_url(resp.text)
                 
                 if not video_url:
                     # Try one more time with BeautifulSoup just in case regex on whole text failed
+                    from bs4 import BeautifulSoup
                     soup = BeautifulSoup(resp.text, 'html.parser')
                     for script in soup.find_all('script'):
                         if script.string:
@@ -67,129 +180,321 @@ def download_episode_task(self, episode_id):
                     raise Exception("Could not extract video URL from embed page")
                 
                 episode.video_url = video_url
-                episode.save()
+                if not heartbeat_episode(episode.id, worker_id, video_url=video_url):
+                    episode.anime.update_status()
+                    return "Task lost its claim"
             except Exception as e:
                 # If fetching/extraction fails
                 print(f"Extraction failed: {e}")
-                episode.status = 'failed'
-                episode.error_message = str(e)
-                episode.save()
+                attempt.error = e
+                release_episode(episode.id, worker_id, status='failed', error_message=str(e))
                 episode.anime.update_status()
                 return f"Failed: {e}"
         
         video_url = episode.video_url
 
         # 2. Prepare file path
-        anime_title = clean_filename(episode.anime.title)
-        season_dir = "Season 01"
-        if episode.number.isdigit():
-             ep_str = f"S01E{int(episode.number):02d}"
-        else:
-             ep_str = f"S01E{episode.number}"
-             
-        filename = f"{anime_title} - {ep_str}.mp4"
-        
-        save_dir = Path(settings.MEDIA_ROOT) / anime_title / season_dir
-        save_dir.mkdir(parents=True, exist_ok=True)
-        file_path = save_dir / filename
+        rel_path = episode_relative_path(episode)
+        file_path = Path(settings.MEDIA_ROOT) / rel_path
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+
+        # 3. Download with progress into a staging file, promoted into the library when complete
+        staged_path = staging_path(file_path, attempt_id)
+        print(f"Downloading to: {staged_path}")
+        heartbeat_every = getattr(settings, 'DOWNLOAD_HEARTBEAT_SECONDS', 30)
+        attempt.host = urllib.parse.urlsplit(video_url).netloc
 
-        # 3. Download with progress
-        print(f"Downloading to: {file_path}")
-        with scraper.get(video_url, stream=True) as r:
+        # Per-host concurrency: take one of the slots the controller currently allows
+        slot = wait_for_slot(episode.id, worker_id, attempt.host, lambda: heartbeat_episode(episode.id, worker_id), slot_wait)
+        if slot == 'lost':
+            episode.anime.update_status()
+            return "Task lost its claim"
+        if slot == 'timeout':
+            # Don't hold the worker: the outbox sends the episode again later
+            from .dispatch import enqueue_episode_downloads
+            with transaction.atomic():
+                if release_episode(episode.id, worker_id, status='pending', progress=0):
+                    enqueue_episode_downloads([episode.id], delay=getattr(settings, 'HOST_SLOT_RETRY_DELAY', 30))
+            episode.anime.update_status()
+            return f"Requeued: no free transfer slot on {attempt.host}"
+
+        with traced_request(scraper, 'GET', video_url, 'upstream.video', stream=True) as (r, video_span):
+            attempt.start_transfer(ttfb=r.elapsed.total_seconds(), status_code=r.status_code)
             r.raise_for_status()
             total_length = int(r.headers.get('content-length', 0))
+
+            # Admission control: hold the bytes we are about to write, or wait for space
+            admitted, message = reserve_space(episode.id, worker_id, total_length)
+            if not admitted:
+                print(f"Not enough space for episode {episode.number}: {message}")
+                episode.anime.update_status()
+                return f"Waiting for space: {message}"
+
             dl = 0
+            progress = 0
+            last_beat = time.monotonic()
+            # Length, checksum and MP4 structure are checked in the same pass as the write
+            verifier = StreamVerifier(total_length)
             
-            with open(file_path, 'wb') as f:
+            with open(staged_path, 'wb') as f:
                 for chunk in r.iter_content(chunk_size=8192):
                     if chunk:
                         dl += len(chunk)
                         f.write(chunk)
+                        verifier.update(chunk)
+                        attempt.update(dl)
+                        if on_progress:
+                            on_progress(episode, dl, total_length)
                         
                         if total_length > 0:
-                            progress = int(dl * 100 / total_length)
-                            if progress > episode.progress + 5 or progress == 100:
-                                # Refresh from DB to see if status changed (Cancel/Skip)
+                            new_progress = int(dl * 100 / total_length)
+                        else:
+                            new_progress = progress
+                        due = time.monotonic() - last_beat >= heartbeat_every
+                        if new_progress > progress + 5 or (new_progress == 100 and progress != 100) or due:
+                            progress = new_progress
+                            last_beat = time.monotonic()
+                            # Extends the lease; fails if the episode was cancelled, skipped or reaped
+                            if not heartbeat_episode(episode.id, worker_id, progress=progress):
                                 episode.refresh_from_db()
-                                if episode.status in ['cancelled', 'skipped']:
-                                    print(f"Download {episode.status} for {episode.number}")
-                                    f.close()
-                                    if file_path.exists():
-                                        file_path.unlink()
-                                    episode.anime.update_status()
-                                    return f"Task {episode.status}"
-                                
-                                episode.progress = progress
-                                episode.save()
+                                print(f"Download {episode.status} for {episode.number}")
+                                f.close()
+                                discard_staged(staged_path)
+                                episode.anime.update_status()
+                                return f"Task {episode.status}"
+            video_span.set(bytes=dl, content_length=total_length)
+            checksum = verifier.verify()
         
-        rel_path = Path(anime_title) / season_dir / filename
-        episode.file_path = str(Path(settings.MEDIA_URL) / rel_path).replace("\\", "/")
-        episode.status = 'completed'
-        episode.progress = 100
-        episode.save()
+        try:
+            promote_file(staged_path, file_path, heartbeat=lambda: heartbeat_episode(episode.id, worker_id))
+        except PromotionAborted:
+            discard_staged(staged_path)
+            episode.anime.update_status()
+            return "Task lost its claim"
+
+        release_episode(
+            episode.id, worker_id,
+            file_path=str(Path(settings.MEDIA_URL) / rel_path).replace("\\", "/"),
+            status='completed',
+            progress=100,
+            checksum=checksum,
+            retries=0,
+        )
         episode.anime.update_status()
+
+        try:
+            write_episode_nfo(episode)
+        except Exception as e:
+            print(f"Could not write NFO for episode {episode.id}: {e}")
+
+        try:
+            schedule_refresh(file_path.parent.parent)
+        except Exception as e:
+            print(f"Could not schedule media server refresh for episode {episode.id}: {e}")
+
+        if getattr(settings, 'MP4_FASTSTART', False):
+            try:
+                faststart_episode_task.apply_async(args=[episode.id], queue=postprocess_queue(episode.anime.storage_node))
+            except Exception as e:
+                print(f"Could not queue faststart for episode {episode.id}: {e}")
         
         return f"Downloaded Episode {episode.number}"
 
+    except SoftTimeLimitExceeded:
+        # Aborted by a batch action (control.abort_tasks), which already wrote the new status
+        print(f"Download of episode {episode_id} aborted")
+        if staged_path:
+            discard_staged(staged_path)
+        return "Task aborted"
+
     except Exception as e:
         print(f"Error downloading episode {episode_id}: {e}")
+        attempt.error = e
+        if staged_path:
+            discard_staged(staged_path)
         try:
-             episode = Episode.objects.get(id=episode_id)
-             episode.status = 'failed'
-             episode.error_message = str(e)
-             episode.save()
-             episode.anime.update_status()
+             retrying = retry_or_fail(episode_id, worker_id, e)
+             Episode.objects.get(id=episode_id).anime.update_status()
         except:
-            pass
-        return f"Failed: {e}"
+            retrying = False
+        return f"{'Retrying' if retrying else 'Failed'}: {e}"
+
+def retry_or_fail(episode_id, worker_id, error):
+    """
+    Put an owned episode straight back in the queue after a retryable failure (dropped
+    connection, truncated or corrupt body) while it has DOWNLOAD_RETRIES left,
+    otherwise mark it failed. Returns True when it was requeued.
+    """
+    from .dispatch import enqueue_episode_downloads
+
+    retries = Episode.objects.filter(id=episode_id).values_list('retries', flat=True).first()
+    if is_retryable(error) and retries is not None and retries < getattr(settings, 'DOWNLOAD_RETRIES', 2):
+        with transaction.atomic():
+            # The video URL is extracted again: its token may have expired meanwhile
+            if release_episode(episode_id, worker_id, status='pending', progress=0, video_url=None,
+                               error_message=str(error), retries=retries + 1):
+                enqueue_episode_downloads([episode_id])
+                return True
+    release_episode(episode_id, worker_id, status='failed', error_message=str(error), retries=0)
+    return False
+
+@shared_task
+def reap_stale_downloads_task():
+    """
+    Put episodes whose worker stopped renewing its lease back in the queue.
+    """
+    from .dispatch import enqueue_episode_downloads
+
+    now = timezone.now()
+    # Rows from before leases existed have no expiry, fall back to their last update
+    legacy_cutoff = now - timedelta(seconds=getattr(settings, 'DOWNLOAD_LEASE_SECONDS', 120))
+    with transaction.atomic():
+        stale = list(
+            Episode.objects.select_for_update(skip_locked=True)
+            .filter(status='downloading')
+            .filter(Q(lease_expires_at__lt=now) | Q(lease_expires_at__isnull=True, updated_at__lt=legacy_cutoff))
+            .values_list('id', 'anime_id')
+        )
+        stale_ids = [ep_id for ep_id, _ in stale]
+        if stale_ids:
+            Episode.objects.filter(id__in=stale_ids).update(
+                status='pending', progress=0, worker_id=None, lease_expires_at=None, transfer_host=None,
+                reserved_bytes=None, updated_at=now,
+            )
+            enqueue_episode_downloads(stale_ids)
+
+    for anime in Anime.objects.filter(id__in={anime_id for _, anime_id in stale}):
+        anime.update_status()
+
+    # Add jobs whose worker died mid-scrape go back to the dispatcher
+    from .models import AddAnimeJob
+    AddAnimeJob.objects.filter(
+        status='running', updated_at__lt=now - timedelta(seconds=getattr(settings, 'ADD_JOB_TIMEOUT', 900))
+    ).update(status='queued', dispatched_at=None, updated_at=now)
+
+    removed = cleanup_stale_staging(max_age=getattr(settings, 'DOWNLOAD_LEASE_SECONDS', 120) * 2)
+    if removed:
+        print(f"Removed {removed} abandoned staging files")
+
+    if stale_ids:
+        print(f"Re-queued {len(stale_ids)} stale downloads: {stale_ids}")
+    return f"Reaped {len(stale_ids)} stale downloads."
 
 @shared_task
 def check_for_new_episodes_task():
-    from .models import Anime, Episode
-    from .utils import get_episode_urls
-    
+    """
+    Check every anime now, finished ones included (the "check for new episodes" button).
+    """
+    from .polling import check_anime
+
     print("Checking for new episodes for all anime...")
     animes = Anime.objects.all()
     new_episodes_count = 0
     
     for anime in animes:
         try:
-            print(f"Checking {anime.title}...")
-            # get_episode_urls returns (episodes, genres)
-            episodes_data, _ = get_episode_urls(anime.source_url)
-            
-            for ep_num, ep_url in episodes_data:
-                # Check if episode already exists
-                if not Episode.objects.filter(anime=anime, number=str(ep_num)).exists():
-                    print(f"New episode found for {anime.title}: {ep_num}")
-                    new_ep = Episode.objects.create(
-                        anime=anime,
-                        number=str(ep_num),
-                        source_url=ep_url,
-                        status='pending'
-                    )
-                    download_episode_task.delay(new_ep.id)
-                    new_episodes_count += 1
-            
-            # Update anime status in case all episodes were already completed but status was weird
-            anime.update_status()
+            new_episodes_count += check_anime(anime)
         except Exception as e:
             print(f"Error checking {anime.title}: {e}")
             continue
     
     return f"Checked {animes.count()} anime. Found and queued {new_episodes_count} new episodes."
 
+@shared_task
+def poll_due_anime_task():
+    """
+    Check the animes whose next check is due; each check schedules the next one
+    around the show's expected release time. Ticks may overlap, each anime is claimed
+    by one of them (polling.claim_check).
+    """
+    from .polling import check_anime, claim_check, due_animes
+
+    checked = new_episodes_count = 0
+    for anime in due_animes():
+        if not claim_check(anime):
+            # An overlapping tick is checking it
+            continue
+        try:
+            new_episodes_count += check_anime(anime)
+        except Exception as e:
+            print(f"Error checking {anime.title}: {e}")
+            # Not on every tick while the error lasts
+            Anime.objects.filter(id=anime.id).update(
+                next_check_at=timezone.now() + timedelta(seconds=getattr(settings, 'POLL_WINDOW_INTERVAL', 900))
+            )
+        checked += 1
+    return f"Checked {checked} due anime. Found and queued {new_episodes_count} new episodes."
+
 @shared_task
 def retry_failed_episodes_task():
     from .models import Episode
+    from .dispatch import enqueue_episode_downloads
     
     failed_episodes = Episode.objects.filter(status='failed')
     count = failed_episodes.count()
     
     print(f"Retrying {count} failed episodes...")
-    for ep in failed_episodes:
-        ep.status = 'pending'
-        ep.save()
-        download_episode_task.delay(ep.id)
+    with transaction.atomic():
+        retry_ids = []
+        for ep in failed_episodes:
+            ep.status = 'pending'
+            ep.save()
+            retry_ids.append(ep.id)
+        enqueue_episode_downloads(retry_ids)
     
     return f"Retried {count} failed episodes."
+
+@shared_task
+def sync_catalog_task():
+    from .catalog import sync_catalog
+
+    stored = sync_catalog()
+    return f"Synced {stored} catalog entries."
+
+@shared_task
+def add_anime_task(job_id):
+    from .library import run_add_job
+
+    job = run_add_job(job_id)
+    if job is None:
+        return f"Job {job_id} already taken"
+    return f"Job {job_id} {job.status}"
+
+@shared_task
+def faststart_episode_task(episode_id):
+    """
+    Post-processing: move the moov atom of a finished episode to the front.
+    Routed to the 'postprocess' queue (the storage node's, see placement.postprocess_queue)
+    so the rewrite never competes with transfers.
+    """
+    from .mp4 import faststart
+
+    episode = Episode.objects.get(id=episode_id)
+    if episode.status != 'completed' or not episode.file_path:
+        return f"Episode {episode_id} not completed"
+
+    rel_path = Path(episode.file_path).relative_to(settings.MEDIA_URL)
+    file_path = Path(settings.MEDIA_ROOT) / rel_path
+    try:
+        rewritten = faststart(file_path)
+    except Exception as e:
+        # The file is still playable, just not optimized
+        print(f"Faststart failed for {file_path}: {e}")
+        return f"Faststart failed: {e}"
+    return f"Faststart {'applied' if rewritten else 'not needed'} for episode {episode_id}"
+
+@shared_task
+def release_waiting_episodes_task():
+    from .storage import release_waiting_episodes
+
+    released = release_waiting_episodes()
+    for anime in Anime.objects.filter(episodes__id__in=released).distinct():
+        anime.update_status()
+    return f"Released {len(released)} episodes waiting for space."
+
+@shared_task
+def flush_media_refreshes_task():
+    from .notifiers import flush_refreshes
+
+    paths = flush_refreshes()
+    return f"Refreshed {len(paths)} directories on media servers."
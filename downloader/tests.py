@@ -1,3 +1,870 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+from unittest import mock
+from django.utils import timezone
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, override_settings
+from .mp4 import faststart, needs_faststart, read_top_level_boxes
+from .metadata import build_tvshow_nfo, write_if_changed
+from .models import Anime, CatalogEntry, DownloadAttempt, DownloadDailyStats, DownloadIntent, Episode, EpisodeListCache, HostConcurrency, MediaRefresh
+from .analytics import AttemptRecorder
+from .concurrency import observe_attempt, try_acquire_slot, wait_for_slot
+from .dispatch import drain_outbox, enqueue_episode_downloads
+from .serving import parse_range, read_chunks, serve_file
+from .integrity import StreamVerifier, TransferIntegrityError, is_retryable
+from .control import apply_batch, running_task_ids
+from .library import bulk_import, resolve_item, run_add_job
+from .polling import claim_check, due_animes, is_finished, learn_cadence, next_check_at
+from .tasks import claim_episode, heartbeat_episode, reap_stale_downloads_task
+from .storage import PromotionAborted, promote_file, promotion_slot, release_waiting_episodes, reserve_space
+from .placement import download_queue, move_anime, plan_rebalance
+from .async_search import _inflight, coalesced_search_anime, find_anime_async
+from .catalog import catalog_index, find_anime, store_catalog_records
+from .prefetch import cached_episode_list, store_episode_list
+from .management.commands.loadtest_web import clear_library, percentile, seed_library
+from .mirrors import MirrorMonitor, rewrite_url
+from .tracing import activate, inject_traceparent, span
+from .notifiers import JellyfinNotifier, KodiNotifier, PlexNotifier, flush_refreshes, schedule_refresh
 
-# Create your tests here.
+
+def box(box_type, payload):
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+def chunk_offset_box(box_type, offsets):
+    fmt = '>%dI' % len(offsets) if box_type == b'stco' else '>%dQ' % len(offsets)
+    return box(box_type, struct.pack('>II', 0, len(offsets)) + struct.pack(fmt, *offsets))
+
+def build_mp4(chunks, offset_box=b'stco'):
+    """
+    Minimal progressive MP4 with moov at the end: ftyp, mdat holding `chunks`, moov whose
+    chunk offset table points at each chunk.
+    """
+    ftyp = box(b'ftyp', b'isom\x00\x00\x02\x00isomiso2mp41')
+    mdat_payload = b''.join(chunks)
+    mdat = box(b'mdat', mdat_payload)
+
+    offsets = []
+    position = len(ftyp) + 8
+    for chunk in chunks:
+        offsets.append(position)
+        position += len(chunk)
+
+    stbl = box(b'stbl', box(b'stsd', b'\x00' * 8) + chunk_offset_box(offset_box, offsets))
+    trak = box(b'trak', box(b'tkhd', b'\x00' * 84) + box(b'mdia', box(b'minf', stbl)))
+    moov = box(b'moov', box(b'mvhd', b'\x00' * 100) + trak)
+    return ftyp + mdat + moov
+
+def read_chunk_offsets(data):
+    """
+    Walk moov/trak/mdia/minf/stbl and return (box type, offsets) of the chunk offset table.
+    """
+    def children(start, end):
+        offset = start
+        while offset < end:
+            size, box_type = struct.unpack_from('>I4s', data, offset)
+            yield box_type, offset, size
+            offset += size
+
+    def find(start, end, path):
+        for box_type, offset, size in children(start, end):
+            if box_type == path[0]:
+                if len(path) == 1:
+                    return box_type, offset, size
+                return find(offset + 8, offset + size, path[1:])
+        return None
+
+    for name in (b'stco', b'co64'):
+        found = find(0, len(data), [b'moov', b'trak', b'mdia', b'minf', b'stbl', name])
+        if found:
+            box_type, offset, size = found
+            count = struct.unpack_from('>I', data, offset + 12)[0]
+            fmt = '>%dI' % count if box_type == b'stco' else '>%dQ' % count
+            return box_type, list(struct.unpack_from(fmt, data, offset + 16))
+    return None, []
+
+
+class FaststartTests(SimpleTestCase):
+    chunks = [b'A' * 1000, b'B' * 2500, b'C' * 700]
+
+    def write_fixture(self, data):
+        tmp = tempfile.NamedTemporaryFile(suffix='.mp4', delete=False)
+        tmp.write(data)
+        tmp.close()
+        self.addCleanup(Path(tmp.name).unlink)
+        return tmp.name
+
+    def assert_chunks_intact(self, data):
+        _, offsets = read_chunk_offsets(data)
+        for offset, chunk in zip(offsets, self.chunks):
+            self.assertEqual(data[offset:offset + len(chunk)], chunk)
+
+    def test_moves_moov_before_mdat_and_rewrites_stco(self):
+        original = build_mp4(self.chunks)
+        path = self.write_fixture(original)
+        self.assertTrue(needs_faststart(path))
+
+        self.assertTrue(faststart(path, buffer_size=512))
+
+        with open(path, 'rb') as f:
+            types = [box_type for box_type, _, _ in read_top_level_boxes(f)]
+        self.assertEqual(types, [b'ftyp', b'moov', b'mdat'])
+        data = Path(path).read_bytes()
+        self.assertEqual(len(data), len(original))
+        self.assertEqual(read_chunk_offsets(data)[0], b'stco')
+        self.assert_chunks_intact(data)
+        self.assertFalse(needs_faststart(path))
+
+    def test_rewrites_co64(self):
+        path = self.write_fixture(build_mp4(self.chunks, offset_box=b'co64'))
+        self.assertTrue(faststart(path))
+        data = Path(path).read_bytes()
+        self.assertEqual(read_chunk_offsets(data)[0], b'co64')
+        self.assert_chunks_intact(data)
+
+    def test_already_faststart_is_left_alone(self):
+        path = self.write_fixture(build_mp4(self.chunks))
+        faststart(path)
+        before = Path(path).read_bytes()
+        self.assertFalse(faststart(path))
+        self.assertEqual(Path(path).read_bytes(), before)
+
+
+class MetadataTests(SimpleTestCase):
+    def test_tvshow_nfo_is_escaped(self):
+        anime = Anime(title='Tom & Jerry <Special>', plot='A "cat" & a mouse', genres='Action, Sci & Fi')
+        root = ET.fromstring(build_tvshow_nfo(anime))
+        self.assertEqual(root.findtext('title'), 'Tom & Jerry <Special>')
+        self.assertEqual([g.text for g in root.findall('genre')], ['Action', 'Sci & Fi'])
+
+    def test_write_if_changed_leaves_identical_files_alone(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'tvshow.nfo'
+            self.assertTrue(write_if_changed(path, b'one'))
+            os.utime(path, (0, 0))
+            self.assertFalse(write_if_changed(path, b'one'))
+            self.assertEqual(path.stat().st_mtime, 0)
+            self.assertTrue(write_if_changed(path, b'two'))
+            self.assertEqual(path.read_bytes(), b'two')
+            self.assertEqual(path.stat().st_mode & 0o777, 0o644)
+            self.assertEqual(os.listdir(tmp), ['tvshow.nfo'])
+
+
+class StubMediaServer(BaseHTTPRequestHandler):
+    """Records every request it receives in `server.received`."""
+    def handle_request(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        self.server.received.append((self.command, self.path, dict(self.headers), body))
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    do_GET = do_POST = handle_request
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(MEDIA_ROOT='/app/media')
+class NotifierTests(SimpleTestCase):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), StubMediaServer)
+        self.server.received = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def test_jellyfin_batches_paths_in_one_call(self):
+        notifier = JellyfinNotifier(self.url, token='secret', path_prefix='/data/anime')
+        notifier.refresh(['/app/media/Naruto', '/app/media/Bleach'])
+
+        self.assertEqual(len(self.server.received), 1)
+        method, path, headers, body = self.server.received[0]
+        self.assertEqual((method, path), ('POST', '/Library/Media/Updated'))
+        self.assertEqual(headers['X-Emby-Token'], 'secret')
+        updates = json.loads(body)['Updates']
+        self.assertEqual([u['Path'] for u in updates], ['/data/anime/Naruto', '/data/anime/Bleach'])
+
+    def test_plex_refreshes_section_path(self):
+        PlexNotifier(self.url, token='secret', section='3').refresh(['/app/media/Naruto'])
+        method, path, _, _ = self.server.received[0]
+        self.assertEqual(method, 'GET')
+        self.assertTrue(path.startswith('/library/sections/3/refresh?'))
+        self.assertIn('path=%2Fapp%2Fmedia%2FNaruto', path)
+
+    def test_kodi_scans_directory(self):
+        KodiNotifier(self.url).refresh(['/app/media/Naruto'])
+        method, path, _, body = self.server.received[0]
+        self.assertEqual((method, path), ('POST', '/jsonrpc'))
+        payload = json.loads(body)
+        self.assertEqual(payload['method'], 'VideoLibrary.Scan')
+        self.assertEqual(payload['params'], {'directory': '/app/media/Naruto/'})
+
+
+
+@override_settings(MEDIA_ROOT='/app/media')
+class RefreshQueueTests(TestCase):
+    def test_failed_server_alone_is_refreshed_again(self):
+        server = HTTPServer(('127.0.0.1', 0), StubMediaServer)
+        server.received = []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        working, down = f"http://127.0.0.1:{server.server_port}", 'http://127.0.0.1:1'
+
+        with self.settings(MEDIA_SERVERS=[{'type': 'kodi', 'url': working}, {'type': 'kodi', 'url': down, 'timeout': 1}]):
+            schedule_refresh('/app/media/Naruto')
+            self.assertEqual(flush_refreshes(force=True), ['/app/media/Naruto'])
+            self.assertEqual(list(MediaRefresh.objects.values_list('path', 'server')), [('/app/media/Naruto', down)])
+
+            flush_refreshes(force=True)
+        # The working server was not asked twice
+        self.assertEqual(len(server.received), 1)
+
+@override_settings(UPSTREAM_MIRRORS=['https://a.example', 'https://b.example', 'https://c.example'])
+class MirrorTests(SimpleTestCase):
+    def monitor(self, status):
+        monitor = MirrorMonitor()
+        # Pretend the probe thread already ran in this process
+        monitor._pid = os.getpid()
+        monitor._status = status
+        return monitor
+
+    def test_fastest_healthy_mirror_first_and_down_ones_last(self):
+        monitor = self.monitor({
+            'https://a.example': (False, None),
+            'https://b.example': (True, 0.8),
+            'https://c.example': (True, 0.2),
+        })
+        self.assertEqual(monitor.candidates(), ['https://c.example', 'https://b.example', 'https://a.example'])
+        monitor.mark_down('https://c.example', 'timeout')
+        self.assertEqual(monitor.current(), 'https://b.example')
+
+    def test_rewrite_url_moves_upstream_urls_only(self):
+        self.assertEqual(
+            rewrite_url('https://www.animeunity.so/anime/123-naruto/456', 'https://b.example'),
+            'https://b.example/anime/123-naruto/456',
+        )
+        self.assertEqual(
+            rewrite_url('https://a.example/anime/123-naruto', 'https://b.example'),
+            'https://b.example/anime/123-naruto',
+        )
+        self.assertEqual(rewrite_url('http://example.com/ep1', 'https://b.example'), 'http://example.com/ep1')
+
+
+class TracingTests(SimpleTestCase):
+    def read_spans(self, path):
+        with open(path) as f:
+            return {record['name']: record for record in map(json.loads, f)}
+
+    def test_spans_share_trace_across_outbox_and_publish(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'traces.jsonl')
+            with override_settings(TRACE_EXPORT_PATH=path, TRACE_SAMPLE_RATE=1):
+                with span('http.request') as request_span:
+                    stored = f"00-{request_span.context.trace_id}-{request_span.context.span_id}-01"
+                    with span('upstream.livesearch') as child:
+                        child.set(bytes=42)
+
+                # Later, in the dispatcher: the stored traceparent goes into the message headers
+                headers = {}
+                with activate(stored):
+                    inject_traceparent(headers=headers)
+                with span('task.download_episode_task', traceparent=headers['traceparent']):
+                    pass
+
+            spans = self.read_spans(path)
+            root = spans['http.request']
+            self.assertIsNone(root['parent_id'])
+            self.assertEqual(spans['upstream.livesearch']['parent_id'], root['span_id'])
+            self.assertEqual(spans['upstream.livesearch']['attributes'], {'bytes': 42})
+            self.assertEqual(spans['task.download_episode_task']['parent_id'], root['span_id'])
+            self.assertEqual({record['trace_id'] for record in spans.values()}, {root['trace_id']})
+
+    def test_unsampled_traces_are_not_exported(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'traces.jsonl')
+            with override_settings(TRACE_EXPORT_PATH=path, TRACE_SAMPLE_RATE=0):
+                with span('http.request'):
+                    with span('upstream.homepage'):
+                        pass
+            self.assertFalse(os.path.exists(path))
+
+
+@override_settings(HOST_CONCURRENCY_INITIAL=2, HOST_CONCURRENCY_MIN=1, HOST_CONCURRENCY_MAX=4, HOST_CONCURRENCY_COOLDOWN=30)
+class ConcurrencyTests(TestCase):
+    host = 'cdn.example'
+
+    def attempt(self, **fields):
+        fields.setdefault('outcome', 'completed')
+        return DownloadAttempt(host=self.host, average_speed=1000, ttfb_ms=100, **fields)
+
+    def test_slots_limit_running_transfers(self):
+        anime = Anime.objects.create(title='Test', source_url='http://example.com/anime/1')
+        episodes = [
+            anime.episodes.create(number=str(n), source_url=f'http://example.com/{n}', status='downloading',
+                                  worker_id=f'w{n}', lease_expires_at=timezone.now() + timedelta(minutes=1))
+            for n in range(3)
+        ]
+        admitted = [try_acquire_slot(ep.id, ep.worker_id, self.host) for ep in episodes]
+        self.assertEqual(admitted, [True, True, False])
+
+    def test_full_host_puts_the_download_back_without_waiting(self):
+        anime = Anime.objects.create(title='Test', source_url='http://example.com/anime/1')
+        running, waiting = [
+            anime.episodes.create(number=str(n), source_url=f'http://example.com/{n}', status='downloading',
+                                  worker_id=f'w{n}', lease_expires_at=timezone.now() + timedelta(minutes=1))
+            for n in range(2)
+        ]
+        HostConcurrency.objects.create(host=self.host, limit=1)
+        self.assertTrue(try_acquire_slot(running.id, 'w0', self.host))
+
+        started = time.monotonic()
+        self.assertEqual(wait_for_slot(waiting.id, 'w1', self.host, lambda: True), 'timeout')
+        self.assertLess(time.monotonic() - started, 1)
+
+        # Sent again by the dispatcher once the delay has passed
+        enqueue_episode_downloads([waiting.id], delay=30)
+        self.assertEqual(drain_outbox(), 0)
+        self.assertIsNotNone(DownloadIntent.objects.get(episode_id=waiting.id).not_before)
+
+    def test_additive_increase_and_multiplicative_decrease(self):
+        # Not saturated (nothing else running, limit 2): no reason to grow
+        self.assertEqual(observe_attempt(self.attempt()).limit, 2)
+
+        state = observe_attempt(self.attempt(status_code=429, outcome='failed'))
+        self.assertEqual(state.slots, 1)
+        # A burst of errors within the cooldown counts once
+        state = observe_attempt(self.attempt(error_class='ReadTimeout', outcome='failed'))
+        self.assertEqual((state.slots, state.congestion_events), (1, 1))
+
+        # At limit 1 every completion saturates the host: +1 per round
+        state = observe_attempt(self.attempt())
+        self.assertEqual(state.slots, 2)
+
+        # Episode-specific errors are no signal
+        self.assertIsNone(observe_attempt(self.attempt(status_code=404, outcome='failed')))
+
+    def test_retried_transport_error_shrinks_limit(self):
+        class ReadTimeout(Exception):
+            pass
+
+        anime = Anime.objects.create(title='Test', source_url='http://example.com/anime/1')
+        # retry_or_fail already put the episode back in the queue
+        episode = anime.episodes.create(number='1', source_url='http://example.com/1', status='pending')
+        recorder = AttemptRecorder(episode.id)
+        recorder.claimed = True
+        recorder.host = self.host
+        recorder.error = ReadTimeout('read timed out')
+        attempt = recorder.save()
+
+        self.assertEqual(attempt.outcome, 'retried')
+        self.assertEqual(observe_attempt(attempt).slots, 1)
+        self.assertEqual(DownloadDailyStats.objects.get(host=self.host).failed, 1)
+
+
+
+
+
+@override_settings(PROMOTION_BUFFER_SIZE=4, DOWNLOAD_HEARTBEAT_SECONDS=0, DOWNLOAD_STAGING_ROOT=None)
+class PromotionTests(SimpleTestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(self.settings(MEDIA_ROOT=media_root.name))
+        self.staged = Path(media_root.name) / 'staging' / '.ep.mp4.1.partial'
+        self.final = Path(media_root.name) / 'library' / 'ep.mp4'
+        self.staged.parent.mkdir()
+        self.staged.write_bytes(b'0123456789')
+        # Staging and library on different devices
+        self.enterContext(mock.patch('downloader.storage.same_device', return_value=False))
+
+    def test_cross_device_copy_keeps_the_lease(self):
+        beats = []
+        promote_file(self.staged, self.final, heartbeat=lambda: beats.append(1) or True)
+        self.assertEqual(self.final.read_bytes(), b'0123456789')
+        self.assertFalse(self.staged.exists())
+        # Renewed between the buffers of the copy
+        self.assertEqual(len(beats), 3)
+
+    def test_lost_claim_aborts_the_copy(self):
+        with self.assertRaises(PromotionAborted):
+            promote_file(self.staged, self.final, heartbeat=lambda: False)
+        self.assertFalse(self.final.exists())
+        self.assertEqual(list(self.final.parent.iterdir()), [])
+
+    @override_settings(PROMOTION_CONCURRENCY=1)
+    def test_waiting_for_a_slot_keeps_the_lease(self):
+        with promotion_slot():
+            with self.assertRaises(PromotionAborted):
+                promote_file(self.staged, self.final, heartbeat=lambda: False)
+        self.assertFalse(self.final.exists())
+        # The slot is free again
+        promote_file(self.staged, self.final)
+        self.assertEqual(self.final.read_bytes(), b'0123456789')
+
+class LeaseTests(TestCase):
+    def setUp(self):
+        self.anime = Anime.objects.create(title='Test', source_url='http://example.com/anime/1')
+        self.episode = self.anime.episodes.create(number='1', source_url='http://example.com/1', status='pending')
+
+    def test_second_claim_is_rejected(self):
+        self.assertTrue(claim_episode(self.episode.id, 'w1'))
+        self.assertFalse(claim_episode(self.episode.id, 'w2'))
+        self.assertEqual(Episode.objects.get(id=self.episode.id).worker_id, 'w1')
+
+    def test_heartbeat_after_losing_the_lease_fails(self):
+        claim_episode(self.episode.id, 'w1')
+        self.assertTrue(heartbeat_episode(self.episode.id, 'w1', progress=10))
+        # Reaped and claimed again by another worker
+        Episode.objects.filter(id=self.episode.id).update(status='pending', worker_id=None)
+        claim_episode(self.episode.id, 'w2')
+
+        self.assertFalse(heartbeat_episode(self.episode.id, 'w1', progress=50))
+        episode = Episode.objects.get(id=self.episode.id)
+        self.assertEqual((episode.worker_id, episode.progress), ('w2', 0))
+
+    def test_reaper_resets_only_expired_leases(self):
+        alive = self.anime.episodes.create(number='2', source_url='http://example.com/2', status='pending')
+        claim_episode(self.episode.id, 'w1')
+        claim_episode(alive.id, 'w2')
+        Episode.objects.filter(id=self.episode.id).update(
+            lease_expires_at=timezone.now() - timedelta(seconds=1), transfer_host='cdn.example', reserved_bytes=1000,
+        )
+
+        reap_stale_downloads_task()
+
+        expired = Episode.objects.get(id=self.episode.id)
+        self.assertEqual(expired.status, 'pending')
+        self.assertIsNone(expired.worker_id)
+        self.assertIsNone(expired.transfer_host)
+        self.assertIsNone(expired.reserved_bytes)
+        alive.refresh_from_db()
+        self.assertEqual((alive.status, alive.worker_id), ('downloading', 'w2'))
+        self.assertEqual(list(DownloadIntent.objects.values_list('episode_id', flat=True)), [self.episode.id])
+
+@override_settings(DISK_SPACE_MARGIN=0, DOWNLOAD_STAGING_ROOT=None)
+class StorageAdmissionTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(self.settings(MEDIA_ROOT=media_root.name))
+        self.enterContext(mock.patch('downloader.storage.shutil.disk_usage', return_value=mock.Mock(free=100)))
+        self.anime = Anime.objects.create(title='Test', source_url='http://example.com/anime/1')
+
+    def test_download_that_does_not_fit_is_parked(self):
+        episode = self.anime.episodes.create(number='1', source_url='http://example.com/1', status='downloading',
+                                             worker_id='w1', transfer_host='cdn.example',
+                                             lease_expires_at=timezone.now() + timedelta(minutes=1))
+        parked_since = timezone.now()
+
+        admitted, message = reserve_space(episode.id, 'w1', 150)
+
+        self.assertFalse(admitted)
+        episode.refresh_from_db()
+        self.assertEqual((episode.status, episode.reserved_bytes, episode.error_message), ('waiting_for_space', 150, message))
+        self.assertIsNone(episode.worker_id)
+        self.assertIsNone(episode.transfer_host)
+        self.assertGreaterEqual(episode.updated_at, parked_since)
+
+    def test_waiting_episodes_are_released_oldest_first(self):
+        now = timezone.now()
+        newer, older = [
+            self.anime.episodes.create(number=str(n), source_url=f'http://example.com/{n}', status='waiting_for_space', reserved_bytes=60)
+            for n in range(2)
+        ]
+        Episode.objects.filter(id=newer.id).update(updated_at=now)
+        Episode.objects.filter(id=older.id).update(updated_at=now - timedelta(hours=1))
+
+        # Room for one of them only
+        self.assertEqual(release_waiting_episodes(), [older.id])
+        self.assertEqual(Episode.objects.get(id=older.id).status, 'pending')
+        self.assertEqual(Episode.objects.get(id=newer.id).status, 'waiting_for_space')
+        self.assertEqual(list(DownloadIntent.objects.values_list('episode_id', flat=True)), [older.id])
+
+class ServingTests(SimpleTestCase):
+    def test_parse_range(self):
+        self.assertEqual(parse_range('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(parse_range('bytes=900-', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=-100', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=500-5000', 1000), (500, 999))
+        self.assertIs(parse_range('bytes=1000-', 1000), False)
+        self.assertIsNone(parse_range('bytes=0-1,5-6', 1000))
+        self.assertIsNone(parse_range(None, 1000))
+
+    @override_settings(MEDIA_ACCEL='')
+    def test_range_request_gets_partial_content(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'ep.mp4'
+            path.write_bytes(bytes(range(256)) * 4)
+            request = RequestFactory().get('/', HTTP_RANGE='bytes=10-19')
+            response = serve_file(request, path)
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+            self.assertEqual(b''.join(response.streaming_content), bytes(range(10, 20)))
+
+            response = serve_file(RequestFactory().get('/', HTTP_RANGE='bytes=2000-'), path)
+            self.assertEqual(response.status_code, 416)
+
+    def test_reader_waits_for_growing_file(self):
+        class AppendOnce:
+            """Stands in for DownloadWaiter: the download writes the rest while we wait."""
+            def __init__(self, path):
+                self.path, self.waits = path, 0
+            def reset(self):
+                pass
+            def wait(self):
+                self.waits += 1
+                if self.waits > 1:
+                    return False
+                with open(self.path, 'ab') as f:
+                    f.write(b'world')
+                return True
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'ep.mp4.partial'
+            path.write_bytes(b'hello ')
+            self.assertEqual(b''.join(read_chunks(path, 0, 11, AppendOnce(path))), b'hello world')
+            # The download ended short: the reader stops instead of waiting forever
+            self.assertEqual(b''.join(read_chunks(path, 6, 100, AppendOnce(path))), b'worldworld')
+
+    @override_settings(MEDIA_ACCEL='nginx', MEDIA_ACCEL_PREFIX='/protected-media/')
+    def test_accel_redirect(self):
+        with tempfile.TemporaryDirectory() as tmp, override_settings(MEDIA_ROOT=tmp):
+            path = Path(tmp).resolve() / 'My Show' / 'ep 1.mp4'
+            path.parent.mkdir()
+            path.write_bytes(b'x')
+            response = serve_file(RequestFactory().get('/'), path)
+            self.assertEqual(response['X-Accel-Redirect'], '/protected-media/My%20Show/ep%201.mp4')
+            self.assertEqual(response.content, b'')
+
+
+class IntegrityTests(SimpleTestCase):
+    def feed(self, data, expected_length=None, chunk_size=7):
+        verifier = StreamVerifier(expected_length)
+        for i in range(0, len(data), chunk_size):
+            verifier.update(data[i:i + chunk_size])
+        return verifier
+
+    def test_complete_mp4_passes_with_checksum(self):
+        data = build_mp4([b'A' * 1000, b'B' * 300])
+        # A 64-bit box header split across chunks must be followed too
+        large = struct.pack('>I4sQ', 1, b'free', 16 + 5) + b'xxxxx'
+        data += large
+        for chunk_size in (1, 7, 8192):
+            verifier = self.feed(data, len(data), chunk_size)
+            self.assertEqual(verifier.verify(), hashlib.sha256(data).hexdigest())
+            self.assertEqual(verifier.boxes.types, [b'ftyp', b'mdat', b'moov', b'free'])
+
+    def test_trailing_box_running_to_end_of_file(self):
+        data = box(b'ftyp', b'isom') + box(b'moov', b'm' * 40) + struct.pack('>I4s', 0, b'mdat') + b'v' * 100
+        verifier = self.feed(data, len(data), chunk_size=20)
+        self.assertEqual(verifier.verify(), hashlib.sha256(data).hexdigest())
+        self.assertEqual(verifier.boxes.types, [b'ftyp', b'moov', b'mdat'])
+
+    def test_truncated_and_invalid_bodies_fail(self):
+        data = build_mp4([b'A' * 1000])
+        with self.assertRaisesRegex(TransferIntegrityError, 'Received'):
+            self.feed(data[:-10], len(data)).verify()
+        # Without a Content-Length the box structure still reveals the cut
+        with self.assertRaisesRegex(TransferIntegrityError, 'Truncated'):
+            self.feed(data[:-10]).verify()
+        with self.assertRaisesRegex(TransferIntegrityError, 'no moov'):
+            self.feed(box(b'ftyp', b'isom') + box(b'mdat', b'x' * 50)).verify()
+        with self.assertRaisesRegex(TransferIntegrityError, 'no ftyp, moov'):
+            self.feed(box(b'html', b'<html>Access denied</html>')).verify()
+
+    def test_retryable_classification(self):
+        self.assertTrue(is_retryable(TransferIntegrityError('short')))
+        self.assertTrue(is_retryable(type('ChunkedEncodingError', (Exception,), {})()))
+        self.assertFalse(is_retryable(ValueError('bad episode')))
+
+
+class BatchControlTests(TestCase):
+    def setUp(self):
+        self.anime = Anime.objects.create(title='Batch', source_url='http://example.com/anime/1')
+        self.other = Anime.objects.create(title='Other', source_url='http://example.com/anime/2')
+        self.episodes = {
+            status: self.anime.episodes.create(number=str(n), source_url=f'http://example.com/{n}', status=status)
+            for n, status in enumerate(['pending', 'downloading', 'completed', 'failed'])
+        }
+        self.other_episode = self.other.episodes.create(number='1', source_url='http://example.com/o1', status='pending')
+
+    def test_cancel_whole_anime_plus_single_episode(self):
+        downloading = self.episodes['downloading']
+        Episode.objects.filter(id=downloading.id).update(worker_id='host:1:ce5f9b2c-6d4e-4a8b-9f3e-2b1c0a9d8e7f')
+        result = apply_batch('cancel', episode_ids=[self.other_episode.id], anime_ids=[self.anime.id])
+        self.assertEqual(result['updated'], 3)
+        statuses = dict(Episode.objects.values_list('id', 'status'))
+        self.assertEqual(statuses[self.episodes['pending'].id], 'cancelled')
+        self.assertEqual(statuses[downloading.id], 'cancelled')
+        self.assertEqual(statuses[self.episodes['completed'].id], 'completed')
+        self.assertEqual(statuses[self.episodes['failed'].id], 'failed')
+        self.assertEqual(statuses[self.other_episode.id], 'cancelled')
+        # The running download lost its claim, so it cannot write its own final state over ours
+        self.assertIsNone(Episode.objects.get(id=downloading.id).worker_id)
+
+    def test_resume_requeues_through_outbox(self):
+        result = apply_batch('retry', anime_ids=[self.anime.id])
+        self.assertEqual(result, {'updated': 1, 'revoked': 0})
+        self.assertEqual(Episode.objects.get(id=self.episodes['failed'].id).status, 'pending')
+        self.assertEqual(list(DownloadIntent.objects.values_list('episode_id', flat=True)), [self.episodes['failed'].id])
+
+    def test_single_episode_cancel_applies_to_any_status(self):
+        failed = self.episodes['failed']
+        self.assertEqual(self.client.post(f'/api/episode/{failed.id}/cancel/').status_code, 200)
+        self.assertEqual(Episode.objects.get(id=failed.id).status, 'cancelled')
+
+    def test_batch_api_accepts_scripted_clients(self):
+        client = Client(enforce_csrf_checks=True)
+        response = client.post('/api/batch/', json.dumps({'action': 'skip', 'episode_ids': [self.other_episode.id]}),
+                               content_type='application/json')
+        self.assertEqual(response.json(), {'status': 'ok', 'updated': 1, 'revoked': 0})
+
+    def test_only_celery_task_ids_are_revoked(self):
+        self.assertEqual(
+            running_task_ids(['host:1:ce5f9b2c-6d4e-4a8b-9f3e-2b1c0a9d8e7f', 'host:2:fetch-12', None]),
+            ['ce5f9b2c-6d4e-4a8b-9f3e-2b1c0a9d8e7f'],
+        )
+
+
+class PollingTests(SimpleTestCase):
+    # Four Sunday releases, found at 14:00 UTC
+    releases = [datetime(2024, 3, 3, 14, tzinfo=dt_timezone.utc) + timedelta(weeks=n) for n in range(4)]
+
+    def anime(self, **fields):
+        return Anime(title='Weekly', created_at=self.releases[0] - timedelta(weeks=1), **fields)
+
+    def test_weekly_cadence_is_learned(self):
+        interval, phase = learn_cadence(self.releases)
+        self.assertEqual(interval, 7 * 24 * 3600)
+        self.assertEqual(phase, self.releases[-1].timestamp() % interval)
+
+    def test_checks_wait_for_the_release_window(self):
+        tuesday = self.releases[-1] + timedelta(days=2)
+        self.assertEqual(
+            next_check_at(self.anime(), now=tuesday, events=self.releases),
+            self.releases[-1] + timedelta(weeks=1, hours=-1),
+        )
+        in_window = self.releases[-1] + timedelta(weeks=1, minutes=30)
+        self.assertEqual(
+            next_check_at(self.anime(), now=in_window, events=self.releases),
+            in_window + timedelta(minutes=15),
+        )
+
+    def test_stale_shows_back_off(self):
+        now = self.releases[-1] + timedelta(weeks=4)
+        self.assertEqual(next_check_at(self.anime(), now=now, events=self.releases), now + timedelta(weeks=2))
+        much_later = self.releases[-1] + timedelta(weeks=20)
+        self.assertEqual(next_check_at(self.anime(), now=much_later, events=self.releases), much_later + timedelta(days=30))
+
+    def test_finished_series_are_not_polled(self):
+        self.assertTrue(is_finished({'status': 'Terminato', 'episodes_count': 12}, 12))
+        self.assertFalse(is_finished({'status': 'Terminato', 'episodes_count': 12}, 11))
+        self.assertFalse(is_finished({'status': 'In Corso', 'episodes_count': 0}, 4))
+        self.assertIsNone(next_check_at(self.anime(airing_finished=True), events=self.releases))
+
+
+
+class PollClaimTests(TestCase):
+    def test_overlapping_ticks_check_each_anime_once(self):
+        Anime.objects.create(title='Airing', source_url='http://example.com/anime/1', next_check_at=timezone.now() - timedelta(minutes=1))
+        # Both ticks read the row before either claimed it
+        first, second = list(due_animes()), list(due_animes())
+
+        self.assertTrue(claim_check(first[0]))
+        self.assertFalse(claim_check(second[0]))
+        self.assertEqual(list(due_animes()), [])
+
+@override_settings(STORAGE_NODES={'nas1': 'disk1', 'nas2': 'disk2'}, MEDIA_SERVERS=[])
+class PlacementTests(TestCase):
+    def test_downloads_are_routed_to_the_owning_node(self):
+        self.assertEqual(download_queue('nas1'), 'downloads.nas1')
+        self.assertIsNone(download_queue(None))
+
+    def test_rebalance_moves_the_best_fitting_anime(self):
+        animes = [
+            Anime.objects.create(title=f'A{n}', source_url=f'http://example.com/anime/{n}', storage_node=node)
+            for n, node in enumerate(['nas1', 'nas1', 'nas1', 'nas2'])
+        ]
+        sizes = {animes[0].id: 50, animes[1].id: 30, animes[2].id: 20, animes[3].id: 10}
+        moves = plan_rebalance(sizes)
+        self.assertEqual([(anime.title, source, target) for anime, source, target in moves], [('A1', 'nas1', 'nas2')])
+
+    def test_move_anime_moves_folder_and_file_paths(self):
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            anime = Anime.objects.create(title='Show', directory_name='Show', source_url='http://example.com/anime/1', storage_node='nas1')
+            episode = anime.episodes.create(number='1', source_url='http://example.com/1', status='completed')
+            video = Path(media_root) / 'disk1' / 'Show' / 'Season 01' / 'Show - S01E01.mp4'
+            video.parent.mkdir(parents=True)
+            video.write_bytes(b'video')
+
+            move_anime(anime, 'nas2')
+
+            self.assertEqual((Path(media_root) / 'disk2' / 'Show' / 'Season 01' / 'Show - S01E01.mp4').read_bytes(), b'video')
+            self.assertFalse((Path(media_root) / 'disk1' / 'Show').exists())
+            episode.refresh_from_db()
+            self.assertTrue(episode.file_path.endswith('disk2/Show/Season 01/Show - S01E01.mp4'))
+
+    def test_move_anime_never_nests_into_a_target_created_meanwhile(self):
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            anime = Anime.objects.create(title='Show', directory_name='Show', source_url='http://example.com/anime/1', storage_node='nas1')
+            video = Path(media_root) / 'disk1' / 'Show' / 'Show - S01E01.mp4'
+            video.parent.mkdir(parents=True)
+            video.write_bytes(b'video')
+            target = Path(media_root) / 'disk2' / 'Show'
+            real_move = shutil.move
+
+            def move_racing_a_download(source, destination):
+                real_move(source, destination)
+                # A download for the new node creates the folder while the copy runs
+                target.mkdir(parents=True, exist_ok=True)
+
+            with mock.patch('downloader.placement.shutil.move', side_effect=move_racing_a_download):
+                with self.assertRaises(RuntimeError):
+                    move_anime(anime, 'nas2')
+
+            self.assertEqual(video.read_bytes(), b'video')
+            self.assertEqual(list(target.iterdir()), [])
+            anime.refresh_from_db()
+            self.assertEqual(anime.storage_node, 'nas1')
+            self.assertFalse(anime.moving)
+
+
+
+class CatalogTests(TestCase):
+    record = {'id': 12, 'slug': 'frieren', 'title': 'Sousou no Frieren', 'title_eng': 'Frieren', 'date': '2023', 'episodes_count': '28'}
+
+    def test_unchanged_records_leave_the_index_alone(self):
+        self.assertEqual(store_catalog_records([self.record]), 1)
+        synced_at = CatalogEntry.objects.get().synced_at
+        catalog_index._checked_at = 1
+
+        self.assertEqual(store_catalog_records([self.record]), 0)
+        self.assertEqual(CatalogEntry.objects.get().synced_at, synced_at)
+        self.assertEqual(catalog_index._checked_at, 1)
+
+        self.assertEqual(store_catalog_records([dict(self.record, plot='An elf mage')]), 1)
+        self.assertEqual(catalog_index._checked_at, 0)
+        self.assertEqual(CatalogEntry.objects.get().plot, 'An elf mage')
+
+    @override_settings(UPSTREAM_TIMEOUT=3)
+    def test_livesearch_is_bounded(self):
+        def timing_out(session, url, name, **kwargs):
+            self.assertEqual(kwargs['timeout'], 3)
+            raise TimeoutError('read timed out')
+
+        local = ([{'title': 'Frieren'}], 0.2)
+        with mock.patch('downloader.catalog.search_catalog', return_value=local), \
+                mock.patch('downloader.utils.animeunity_session', return_value=(None, {})), \
+                mock.patch('downloader.utils.upstream_post', side_effect=timing_out) as post:
+            self.assertEqual(find_anime('frieren'), local[0])
+        self.assertEqual(post.call_count, 1)
+
+    @override_settings(CATALOG_UPSTREAM_DEADLINE=0.05)
+    async def test_hanging_upstream_serves_local_results(self):
+        hang = asyncio.Event()
+
+        async def hanging_search(query):
+            await hang.wait()
+
+        local = ([{'title': 'Frieren'}], 0.2)
+        with mock.patch('downloader.async_search.search_catalog', return_value=local), \
+                mock.patch('downloader.async_search.async_search_anime', side_effect=hanging_search):
+            self.assertEqual(await find_anime_async('frieren'), local[0])
+            # The shared search is still running for the catalog
+            self.assertEqual(len(_inflight), 1)
+            hang.set()
+            await asyncio.gather(*_inflight.values())
+        self.assertEqual(_inflight, {})
+
+
+class CoalescedSearchTests(SimpleTestCase):
+    async def test_concurrent_callers_share_one_upstream_search(self):
+        release = asyncio.Event()
+
+        async def upstream(query):
+            await release.wait()
+            return [{'title': 'Frieren'}]
+
+        with mock.patch('downloader.async_search.async_search_anime', side_effect=upstream) as search:
+            callers = [asyncio.ensure_future(coalesced_search_anime(query)) for query in ['Frieren'] * 5 + ['frieren!']]
+            await asyncio.sleep(0)
+            release.set()
+            results = await asyncio.gather(*callers)
+        self.assertEqual(search.call_count, 1)
+        self.assertEqual(results, [[{'title': 'Frieren'}]] * 6)
+        self.assertEqual(_inflight, {})
+
+    async def test_failed_search_is_not_cached(self):
+        with mock.patch('downloader.async_search.async_search_anime', side_effect=RuntimeError('upstream down')):
+            with self.assertRaises(RuntimeError):
+                await coalesced_search_anime('frieren')
+        self.assertEqual(_inflight, {})
+        with mock.patch('downloader.async_search.async_search_anime', return_value=[]) as search:
+            self.assertEqual(await coalesced_search_anime('frieren'), [])
+        self.assertEqual(search.call_count, 1)
+
+class PrefetchCacheTests(TestCase):
+    def test_fresh_entries_are_shared_between_mirrors(self):
+        store_episode_list('https://www.animeunity.so/anime/12-frieren', [(1, 'https://www.animeunity.so/anime/12-frieren/100')], ['Fantasy'])
+        self.assertEqual(
+            cached_episode_list('https://www.animeunity.to/anime/12-frieren'),
+            ([(1, 'https://www.animeunity.so/anime/12-frieren/100')], ['Fantasy']),
+        )
+        self.assertIsNone(cached_episode_list('https://www.animeunity.so/anime/13-other'))
+
+    @override_settings(EPISODE_PREFETCH_TTL=60)
+    def test_expired_entries_are_ignored(self):
+        store_episode_list('https://www.animeunity.so/anime/12-frieren', [(1, 'u')], [])
+        EpisodeListCache.objects.update(fetched_at=timezone.now() - timedelta(seconds=61))
+        self.assertIsNone(cached_episode_list('https://www.animeunity.so/anime/12-frieren'))
+
+
+class LoadtestTests(TestCase):
+    def test_seeded_library_is_reproducible_and_removable(self):
+        seed_library(3, 5, seed=1)
+        first = list(Episode.objects.order_by('anime__title', 'id').values_list('status', 'progress'))
+        seed_library(3, 5, seed=1)
+        self.assertEqual(list(Episode.objects.order_by('anime__title', 'id').values_list('status', 'progress')), first)
+        self.assertEqual(Anime.objects.count(), 3)
+        clear_library()
+        self.assertFalse(Anime.objects.exists())
+
+    def test_nearest_rank_percentiles(self):
+        values = list(range(1, 101))
+        self.assertEqual([percentile(values, p) for p in (50, 95, 99)], [50, 95, 99])
+        self.assertEqual(percentile([7], 99), 7)
+
+
+class BulkImportTests(TestCase):
+    def test_url_missing_from_catalog_resolves_from_its_id_and_slug(self):
+        result, confidence = resolve_item('https://www.animeunity.so/anime/4321-sousou-no-frieren')
+        self.assertEqual((result['id'], result['slug'], result['title'], confidence), (4321, 'sousou-no-frieren', 'Sousou No Frieren', 1.0))
+
+    def test_id_missing_from_catalog_is_reported_as_such(self):
+        report = bulk_import(['4321'], dry_run=True)
+        self.assertEqual(report[0]['status'], 'not_in_catalog')
+        self.assertIn('sync_catalog', report[0]['error'])
+
+    def test_import_runs_as_background_job(self):
+        response = self.client.post(
+            '/api/import/', json.dumps({'items': ['https://www.animeunity.so/anime/4321-sousou-no-frieren'], 'dry_run': True}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 202)
+        job = run_add_job(response.json()['job_id'])
+        self.assertEqual(job.status, 'completed')
+        self.assertEqual(job.to_dict()['summary'], {'matched': 1})
@@ -0,0 +1,253 @@
+import contextvars
+import json
+import os
+import random
+import secrets
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from celery.signals import before_task_publish, task_prerun, task_postrun
+from django.conf import settings
+from django.urls import Resolver404, resolve
+from django.utils.decorators import sync_and_async_middleware
+
+# What travels between processes: W3C-style "00-<trace_id>-<span_id>-<01 if sampled else 00>"
+SpanContext = namedtuple('SpanContext', ['trace_id', 'span_id', 'sampled'])
+
+# Frequent polling endpoints, not worth a trace
+UNTRACED_URL_NAMES = {'queue_status', 'api_job_status'}
+
+_current = contextvars.ContextVar('downloader_trace', default=None)
+
+
+def tracing_enabled():
+    return bool(getattr(settings, 'TRACE_EXPORT_PATH', None))
+
+def format_traceparent(context):
+    return f"00-{context.trace_id}-{context.span_id}-{'01' if context.sampled else '00'}"
+
+def parse_traceparent(value):
+    try:
+        _, trace_id, span_id, flags = (value or '').split('-')
+    except ValueError:
+        return None
+    if len(trace_id) != 32 or len(span_id) != 16:
+        return None
+    return SpanContext(trace_id, span_id, flags == '01')
+
+def current_traceparent():
+    """
+    The traceparent to hand to work started from here ('' outside a trace).
+    """
+    context = _current.get()
+    return format_traceparent(context) if context else ''
+
+def current_trace_id():
+    context = _current.get()
+    return context.trace_id if context else None
+
+
+class JsonLinesExporter:
+    """
+    Append finished spans as JSON lines. Each span is one O_APPEND write, so web,
+    dispatcher and worker processes can share the file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def export(self, record):
+        line = (json.dumps(record, default=str) + '\n').encode('utf-8')
+        with self._lock:
+            if self._fd is None or self._pid != os.getpid():
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                self._pid = os.getpid()
+            os.write(self._fd, line)
+
+_exporters = {}
+
+def get_exporter():
+    path = settings.TRACE_EXPORT_PATH
+    if path not in _exporters:
+        _exporters[path] = JsonLinesExporter(path)
+    return _exporters[path]
+
+
+class Span:
+    """
+    A timed operation. Attributes set with .set() (status, bytes, url...) are exported with it.
+    """
+    def __init__(self, name, parent=None, **attributes):
+        if parent:
+            self.context = SpanContext(parent.trace_id, secrets.token_hex(8), parent.sampled)
+            self.parent_id = parent.span_id
+        else:
+            # New trace: the sampling decision is made once here and inherited by every child
+            sampled = random.random() < getattr(settings, 'TRACE_SAMPLE_RATE', 0.1)
+            self.context = SpanContext(secrets.token_hex(16), secrets.token_hex(8), sampled)
+            self.parent_id = None
+        self.name = name
+        self.attributes = attributes
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self, error=None):
+        if not self.context.sampled:
+            return
+        get_exporter().export({
+            'trace_id': self.context.trace_id,
+            'span_id': self.context.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': self.started_at,
+            'duration_ms': round((time.perf_counter() - self._start) * 1000, 3),
+            'status': 'error' if error else 'ok',
+            'error': str(error) if error else None,
+            'pid': os.getpid(),
+            'attributes': self.attributes,
+        })
+
+
+class NoopSpan:
+    def set(self, **attributes):
+        pass
+
+NOOP_SPAN = NoopSpan()
+
+@contextmanager
+def span(name, traceparent=None, **attributes):
+    """
+    Time the enclosed block as a child of the current span (or of `traceparent`),
+    starting a new trace when there is neither.
+    """
+    if not tracing_enabled():
+        yield NOOP_SPAN
+        return
+    parent = parse_traceparent(traceparent) if traceparent else _current.get()
+    current = Span(name, parent, **attributes)
+    token = _current.set(current.context)
+    try:
+        yield current
+    except BaseException as e:
+        current.finish(error=e)
+        raise
+    else:
+        current.finish()
+    finally:
+        _current.reset(token)
+
+@contextmanager
+def activate(traceparent):
+    """
+    Make a stored traceparent current, e.g. to dispatch an outbox row within its trace.
+    """
+    context = parse_traceparent(traceparent)
+    if not context:
+        yield
+        return
+    token = _current.set(context)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+@contextmanager
+def traced_request(session, method, url, name, **kwargs):
+    """
+    Perform an upstream HTTP request inside a span recording status and size.
+    Streamed responses are yielded open; set the `bytes` attribute on the span when done.
+    """
+    with span(name, url=url, method=method.upper()) as current:
+        resp = session.request(method, url, **kwargs)
+        current.set(status_code=resp.status_code)
+        if not kwargs.get('stream'):
+            current.set(bytes=len(resp.content))
+        try:
+            yield resp, current
+        finally:
+            if kwargs.get('stream'):
+                resp.close()
+
+def upstream_get(session, url, name, **kwargs):
+    with traced_request(session, 'GET', url, name, **kwargs) as (resp, _):
+        return resp
+
+def upstream_post(session, url, name, **kwargs):
+    with traced_request(session, 'POST', url, name, **kwargs) as (resp, _):
+        return resp
+
+
+@sync_and_async_middleware
+def tracing_middleware(get_response):
+    """
+    Root span per web request, so adds and downloads started by a view share its trace id.
+    """
+    def should_trace(request):
+        if not tracing_enabled():
+            return False
+        try:
+            return resolve(request.path_info).url_name not in UNTRACED_URL_NAMES
+        except Resolver404:
+            return False
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            if not should_trace(request):
+                return await get_response(request)
+            with span('http.request', method=request.method, path=request.path) as current:
+                response = await get_response(request)
+                current.set(status_code=response.status_code)
+            return response
+        markcoroutinefunction(middleware)
+    else:
+        def middleware(request):
+            if not should_trace(request):
+                return get_response(request)
+            with span('http.request', method=request.method, path=request.path) as current:
+                response = get_response(request)
+                current.set(status_code=response.status_code)
+            return response
+    return middleware
+
+
+# Celery propagation: the publisher puts the current traceparent in the message headers,
+# the worker opens a task span under it.
+_task_spans = {}
+
+@before_task_publish.connect
+def inject_traceparent(headers=None, **kwargs):
+    traceparent = current_traceparent()
+    if traceparent and headers is not None:
+        headers['traceparent'] = traceparent
+
+@task_prerun.connect
+def start_task_span(task_id=None, task=None, **kwargs):
+    if not tracing_enabled():
+        return
+    request = task.request
+    traceparent = getattr(request, 'traceparent', None) or (getattr(request, 'headers', None) or {}).get('traceparent')
+    parent = parse_traceparent(traceparent) or _current.get()
+    current = Span(f"task.{task.name.rsplit('.', 1)[-1]}", parent, task_id=task_id, args=list(kwargs.get('args') or []))
+    _task_spans[task_id] = (current, _current.set(current.context))
+
+@task_postrun.connect
+def finish_task_span(task_id=None, state=None, retval=None, **kwargs):
+    entry = _task_spans.pop(task_id, None)
+    if not entry:
+        return
+    current, token = entry
+    current.set(state=state, result=str(retval)[:200])
+    current.finish(error=retval if state == 'FAILURE' else None)
+    try:
+        _current.reset(token)
+    except ValueError:
+        # Reset from another context (e.g. eager task run in a different thread)
+        _current.set(None)
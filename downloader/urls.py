@@ -6,7 +6,10 @@ urlpatterns = [
     path('queue/', views.QueueView.as_view(), name='queue'),
     path('api/queue/status/', views.QueueStatusView.as_view(), name='queue_status'),
     path('downloaded/', views.DownloadedView.as_view(), name='downloaded'),
+    path('analytics/', views.AnalyticsView.as_view(), name='analytics'),
     path('anime/<int:anime_id>/', views.AnimeDetailView.as_view(), name='anime_detail'),
+    path('episode/<int:episode_id>/file/', views.EpisodeFileView.as_view(), name='episode_file'),
+    path('episode/<int:episode_id>/stream/', views.EpisodeStreamView.as_view(), name='episode_stream'),
     path('download/<int:episode_id>/', views.download_episode_view, name='download_episode'),
     
     # Cancel/Skip API
@@ -19,10 +22,14 @@ urlpatterns = [
     path('api/episode/<int:episode_id>/skip/', views.SkipEpisodeView.as_view(), name='skip_episode'),
     path('api/episode/<int:episode_id>/resume/', views.ResumeEpisodeView.as_view(), name='resume_episode'),
     path('api/episode/<int:episode_id>/retry/', views.ResumeEpisodeView.as_view(), name='retry_episode'),
+    path('api/batch/', views.ApiBatchView.as_view(), name='api_batch'),
 
     # New Search/Download API
     path('api/search/', views.ApiSearchView.as_view(), name='api_search'),
     path('api/download/', views.ApiDownloadView.as_view(), name='api_download'),
+    path('api/import/', views.ApiBulkImportView.as_view(), name='api_bulk_import'),
+    path('api/jobs/<uuid:job_id>/', views.ApiJobStatusView.as_view(), name='api_job_status'),
+    path('api/hosts/', views.ApiHostLimitsView.as_view(), name='api_host_limits'),
     # Manual Trigger API/Actions
     path('manual/check-new/', views.ManualCheckNewEpisodesView.as_view(), name='manual_check_new'),
     path('manual/retry-failed/', views.ManualRetryFailedEpisodesView.as_view(), name='manual_retry_failed'),
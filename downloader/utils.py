@@ -1,15 +1,16 @@
-import requests
-from bs4 import BeautifulSoup
 import re
 import os
-import cloudscraper
 import urllib.parse
 import json
 import socket
+import threading
+import time
 from django.conf import settings
 from pathlib import Path
+from .mirrors import current_mirror, is_upstream_url, rewrite_url, upstream_url, with_failover
+from .tracing import upstream_get, upstream_post
 
-def check_broker_status():
+def probe_broker():
     """
     Check if the Redis broker is reachable to avoid blocking on .delay()
     Returns (True, None) if reachable, (False, "Error message") otherwise.
@@ -35,6 +36,51 @@ def check_broker_status():
             return False, str(e)
     return True, None # Not redis or no URL, assume OK or handled elsewhere
 
+class BrokerHealthMonitor:
+    """
+    Probe the broker from a background thread and keep the last result,
+    so request handlers read a cached status instead of opening a socket.
+    """
+    def __init__(self, interval=None):
+        self.interval = interval
+        self._status = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _run(self):
+        interval = self.interval or getattr(settings, 'BROKER_HEALTH_INTERVAL', 5)
+        while True:
+            time.sleep(interval)
+            self._status = probe_broker()
+
+    def start(self):
+        # Threads do not survive fork (gunicorn/celery prefork), restart per process
+        with self._lock:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._status = probe_broker()
+            self._thread = threading.Thread(target=self._run, name='broker-health', daemon=True)
+            self._thread.start()
+
+    def status(self):
+        if self._pid != os.getpid() or self._status is None:
+            self.start()
+        return self._status
+
+    def mark_down(self, error):
+        """Record a failure seen by a caller until the next probe runs."""
+        self._status = (False, str(error))
+
+broker_monitor = BrokerHealthMonitor()
+
+def check_broker_status():
+    """
+    Return the cached broker status as (ok, error_message).
+    """
+    return broker_monitor.status()
+
 def clean_filename(name):
     """
     Remove illegal characters from filename.
@@ -52,57 +98,118 @@ def extract_download_url(html_content):
         return match.group(1)
     return None
 
-def search_anime(query):
+def animeunity_headers(base_url=None):
     """
-    Search anime on AnimeUnity using cloudscraper.
+    Browser-like headers expected by the AnimeUnity JSON endpoints of `base_url`
+    (the preferred mirror by default).
     """
-    scraper = cloudscraper.create_scraper()
-    headers = {
+    base_url = base_url or current_mirror()
+    return {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36',
         'Accept': 'application/json, text/plain, */*',
         'Content-Type': 'application/json;charset=UTF-8',
-        'Origin': 'https://www.animeunity.so',
-        'Referer': 'https://www.animeunity.so/',
+        'Origin': base_url,
+        'Referer': f"{base_url}/",
         'X-Requested-With': 'XMLHttpRequest',
     }
 
+def csrf_headers(homepage_html, xsrf_cookie):
+    """
+    Build the CSRF headers from the homepage <meta> token and the XSRF-TOKEN cookie.
+    """
+    headers = {}
+    meta_match = re.search(r'<meta name="csrf-token" content="([^"]+)"', homepage_html)
+    meta_token = meta_match.group(1) if meta_match else None
+
+    if xsrf_cookie:
+        headers['x-xsrf-token'] = urllib.parse.unquote(xsrf_cookie)
+        headers['x-csrf-token'] = headers['x-xsrf-token']
+    if meta_token:
+        headers['X-CSRF-TOKEN'] = meta_token
+    return headers
+
+_scrapers = threading.local()
+
+def scraper_session():
+    """
+    The cloudscraper session of the current thread, created on first use.
+    Reusing it keeps the Cloudflare clearance cookies between requests.
+    cloudscraper is imported here so web processes that never scrape don't pay for it.
+    """
+    scraper = getattr(_scrapers, 'session', None)
+    if scraper is None or getattr(_scrapers, 'pid', None) != os.getpid():
+        import cloudscraper
+        scraper = cloudscraper.create_scraper()
+        _scrapers.session, _scrapers.pid = scraper, os.getpid()
+    return scraper
+
+def warm_up_scraper():
+    """
+    Import the scraping stack and pass the Cloudflare challenge of the preferred mirror
+    on this thread's session, so the first real request doesn't pay for either.
+    """
+    import bs4  # noqa: F401
+
+    scraper = scraper_session()
     try:
-        # 1. Hit homepage for cookies/CSRF
-        resp = scraper.get('https://www.animeunity.so', headers=headers)
-        resp.raise_for_status()
+        upstream_get(scraper, current_mirror(), 'upstream.homepage', headers=animeunity_headers(), timeout=getattr(settings, 'UPSTREAM_TIMEOUT', 15))
+    except Exception as e:
+        print(f"Scraper warm-up failed: {e}")
+
+def animeunity_session(base_url=None):
+    """
+    Prime the thread's cloudscraper session with the AnimeUnity cookies and CSRF headers
+    needed by its JSON endpoints. Returns (scraper, headers).
+    """
+    base_url = base_url or current_mirror()
+    scraper = scraper_session()
+    headers = animeunity_headers(base_url)
+
+    # Hit homepage for cookies/CSRF
+    resp = upstream_get(scraper, base_url, 'upstream.homepage', headers=headers, timeout=getattr(settings, 'UPSTREAM_TIMEOUT', 15))
+    resp.raise_for_status()
 
-        xsrf_cookie = scraper.cookies.get('XSRF-TOKEN')
-        meta_match = re.search(r'<meta name="csrf-token" content="([^"]+)"', resp.text)
-        meta_token = meta_match.group(1) if meta_match else None
+    headers.update(csrf_headers(resp.text, scraper.cookies.get('XSRF-TOKEN')))
+    return scraper, headers
 
-        if xsrf_cookie:
-            headers['x-xsrf-token'] = urllib.parse.unquote(xsrf_cookie)
-            headers['x-csrf-token'] = headers['x-xsrf-token']
-        if meta_token:
-            headers['X-CSRF-TOKEN'] = meta_token
+def parse_anime_record(record, base_url=None):
+    """
+    Convert an AnimeUnity JSON record into the result dict used across the app.
+    """
+    # Construct URL: <mirror>/anime/ID-SLUG
+    anime_url = upstream_url(f"/anime/{record['id']}-{record['slug']}", base_url)
+    return {
+        'title': record.get('title_eng') or record.get('title') or 'Unknown Title',
+        'url': anime_url,
+        'cover_image': record.get('imageurl'),
+        'id': record['id'],
+        'slug': record['slug'],
+        'plot': record.get('plot'),
+        'episodes_count': record.get('episodes_count'),
+        'year': record.get('date'),
+        'studio': record.get('studio'),
+    }
 
-        # 2. Search
-        search_url = 'https://www.animeunity.so/livesearch'
-        payload = {"title": query}
-        res = scraper.post(search_url, json=payload, headers=headers)
+def search_anime(query):
+    """
+    Search anime on AnimeUnity using cloudscraper.
+    """
+    def search(base_url):
+        scraper, headers = animeunity_session(base_url)
+        res = upstream_post(
+            scraper, f"{base_url}/livesearch", 'upstream.livesearch',
+            json={"title": query}, headers=headers, timeout=getattr(settings, 'UPSTREAM_TIMEOUT', 15),
+        )
         res.raise_for_status()
-        
-        data = res.json()
-        results = []
-        for record in data.get('records', []):
-            # Construct URL: https://www.animeunity.so/anime/ID-SLUG
-            anime_url = f"https://www.animeunity.so/anime/{record['id']}-{record['slug']}"
-            results.append({
-                'title': record.get('title_eng') or record.get('title') or 'Unknown Title',
-                'url': anime_url,
-                'cover_image': record.get('imageurl'),
-                'id': record['id'],
-                'slug': record['slug'],
-                'plot': record.get('plot'),
-                'episodes_count': record.get('episodes_count'),
-                'year': record.get('date'),
-                'studio': record.get('studio'),
-            })
+        return base_url, res.json().get('records', [])
+
+    try:
+        base_url, records = with_failover(search)
+        results = [parse_anime_record(record, base_url) for record in records]
+
+        # Remember what upstream told us so the next lookup is a local hit
+        from .catalog import store_catalog_records
+        store_catalog_records(records)
         return results
 
     except Exception as e:
@@ -136,20 +243,34 @@ def get_video_stream_url_mock(episode_url):
     # TODO: Implement extraction logic
     return "http://commondatastorage.googleapis.com/gtv-videos-bucket/sample/BigBuckBunny.mp4"
 
-def get_episode_urls(anime_url):
+def get_episode_urls(anime_url, with_info=False):
     """
     Scrape the anime details page to parse the <video-player> tag for episodes.
     Returns a list of tuples: (episode_number, episode_url)
+    With with_info, also the upstream airing info: {'status': ..., 'episodes_count': ...}
     """
-    scraper = cloudscraper.create_scraper()
+    from bs4 import BeautifulSoup
+
+    scraper = scraper_session()
     print(f"Scraping episodes from: {anime_url}")
-    try:
-        resp = scraper.get(anime_url)
+
+    def fetch_page(base_url):
+        resp = upstream_get(scraper, rewrite_url(anime_url, base_url), 'upstream.anime_page', timeout=getattr(settings, 'UPSTREAM_TIMEOUT', 15))
         resp.raise_for_status()
+        return base_url, resp
+
+    try:
+        if is_upstream_url(anime_url):
+            # Stored URLs may point at a retired or slow domain, use the preferred mirror
+            base_url, resp = with_failover(fetch_page)
+            anime_url = rewrite_url(anime_url, base_url)
+        else:
+            base_url, resp = fetch_page(None)
         soup = BeautifulSoup(resp.text, 'html.parser')
 
         episodes = []
         genres = []
+        info = {}
         
         # Genres are often in specific tags or script data
         # From browser research, they are visible on the page.
@@ -172,11 +293,13 @@ def get_episode_urls(anime_url):
                 except:
                     pass
             
+            info = {'status': anime_data.get('status'), 'episodes_count': anime_data.get('episodes_count')}
+
             # Construct base URL if we have ID and slug, otherwise use provided URL
             if anime_data.get('id') and anime_data.get('slug'):
-                base_url = f"https://www.animeunity.so/anime/{anime_data['id']}-{anime_data['slug']}"
+                anime_base_url = upstream_url(f"/anime/{anime_data['id']}-{anime_data['slug']}", base_url)
             else:
-                base_url = anime_url
+                anime_base_url = anime_url
             
             # 2. Get Episodes
             if player.get('episodes'):
@@ -188,7 +311,7 @@ def get_episode_urls(anime_url):
                         id = ep.get('id')
                         if num:
                             # Construct the watch link: .../ep-{number}
-                            ep_url = f"{base_url}/{id}"
+                            ep_url = f"{anime_base_url}/{id}"
                             episodes.append((int(num), ep_url))
                 except Exception as e:
                     print(f"Error parsing episodes JSON: {e}")
@@ -203,16 +326,22 @@ def get_episode_urls(anime_url):
         episodes.sort(key=sort_key)
         
         print(f"Found {len(episodes)} episodes and genres: {genres}")
+        if with_info:
+            return episodes, genres, info
         return episodes, genres
 
     except Exception as e:
         print(f"Error scraping episodes: {e}")
+        if with_info:
+            return [], [], {}
         return [], []
 
 def download_file(url, file_path):
     """
     Download file from url to file_path with streaming.
     """
+    import requests
+
     with requests.get(url, stream=True) as r:
         r.raise_for_status()
         with open(file_path, 'wb') as f:
@@ -220,45 +349,32 @@ def download_file(url, file_path):
                 f.write(chunk)
     return file_path
 
-def save_anime_metadata(anime):
+def storage_node_dir(node):
     """
-    Save tvshow.nfo and poster.jpg for the anime.
+    Library directory of a storage node relative to MEDIA_ROOT ('' for no node,
+    i.e. animes stored directly in MEDIA_ROOT).
     """
-    if not anime.directory_name:
-        anime.directory_name = clean_filename(anime.title)
-        anime.save()
+    if not node:
+        return Path('')
+    return Path(getattr(settings, 'STORAGE_NODES', {}).get(node) or node)
 
-    anime_path = Path(settings.MEDIA_ROOT) / anime.directory_name
-    anime_path.mkdir(parents=True, exist_ok=True)
+def episode_relative_path(episode):
+    """
+    Library path of an episode's video relative to MEDIA_ROOT:
+    "<Title>/Season 01/<Title> - S01E05.mp4", under the anime's storage node directory if any.
+    """
+    anime_title = clean_filename(episode.anime.title)
+    season_dir = "Season 01"
+    if episode.number.isdigit():
+         ep_str = f"S01E{int(episode.number):02d}"
+    else:
+         ep_str = f"S01E{episode.number}"
+    return storage_node_dir(episode.anime.storage_node) / anime_title / season_dir / f"{anime_title} - {ep_str}.mp4"
 
-    # 1. Save tvshow.nfo
-    nfo_path = anime_path / "tvshow.nfo"
-    
-    genres_xml = ""
-    if anime.genres:
-        for g in anime.genres.split(','):
-            genres_xml += f"  <genre>{g.strip()}</genre>\n"
-
-    nfo_content = f"""<?xml version="1.0" encoding="UTF-8" standalone="yes" ?>
-<tvshow>
-  <title>{anime.title}</title>
-  <plot>{anime.plot or ""}</plot>
-  <year>{anime.year or ""}</year>
-{genres_xml}  <studio>{anime.studio or ""}</studio>
-</tvshow>"""
-
-    with open(nfo_path, "w", encoding="utf-8") as f:
-        f.write(nfo_content)
-    
-    # 2. Save poster.jpg
-    if anime.cover_image:
-        poster_path = anime_path / "poster.jpg"
-        try:
-            scraper = cloudscraper.create_scraper()
-            resp = scraper.get(anime.cover_image)
-            resp.raise_for_status()
-            with open(poster_path, 'wb') as f:
-                f.write(resp.content)
-            print(f"Saved poster to {poster_path}")
-        except Exception as e:
-            print(f"Failed to save poster: {e}")
+def save_anime_metadata(anime):
+    """
+    Save tvshow.nfo, poster.jpg and the NFOs of downloaded episodes for the anime.
+    Files whose content didn't change are left untouched.
+    """
+    from .metadata import write_anime_metadata
+    return write_anime_metadata(anime)
@@ -1,124 +1,84 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.views import View
-from .models import Anime, Episode
+from .models import Anime, Episode, AddAnimeJob
 from .forms import AnimeAddForm
 from .utils import get_anime_info_mock, clean_filename, search_anime, get_episode_urls, check_broker_status
-from .tasks import download_episode_task, check_for_new_episodes_task, retry_failed_episodes_task
+from .tasks import check_for_new_episodes_task, retry_failed_episodes_task
+from .dispatch import enqueue_episode_downloads, enqueue_add_job
+from .async_search import find_anime_async
+from .prefetch import episode_prefetcher
+from .control import ACTIONS, apply_batch
+from .analytics import analytics_summary
+from .concurrency import host_limits
+from .serving import in_progress_path, library_path, serve_file, serve_growing_file
+from django.conf import settings
+from django.db import transaction
 from django.db.models import Q
 from django.contrib import messages
 from django.http import JsonResponse
+from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 import json
+from asgiref.sync import sync_to_async
 
 
 class AnimeSearchView(View):
-    def get(self, request):
+    # Async so the upstream round trip doesn't hold a worker thread under ASGI.
+    # Django needs all handlers of a view to be async, DB/session work runs in sync helpers.
+    async def get(self, request):
         query = request.GET.get('q')
         results = []
         if query:
-            results = search_anime(query)
+            results = await find_anime_async(query)
+            # The user will likely add one of the first results: scrape their episodes now
+            episode_prefetcher.prefetch(results)
+        return await sync_to_async(self.render_results)(request, query, results)
+
+    async def post(self, request):
+        return await sync_to_async(self.add_result)(request)
+
+    def render_results(self, request, query, results):
+        # Show jobs started from this session, keep tracking only the unfinished ones
+        add_jobs = list(AddAnimeJob.objects.filter(id__in=request.session.get('add_jobs', [])))
+        request.session['add_jobs'] = [str(job.id) for job in add_jobs if job.status in ['queued', 'running']]
         
-        return render(request, 'downloader/search.html', {'results': results, 'query': query})
+        return render(request, 'downloader/search.html', {'results': results, 'query': query, 'add_jobs': add_jobs})
 
-    def post(self, request):
+    def add_result(self, request):
         # Allow adding from the search result (simulated by passing URL)
         url = request.POST.get('url')
         title = request.POST.get('title')
-        cover_image = request.POST.get('cover_image')
-        plot = request.POST.get('plot')
-        animeunity_id = request.POST.get('id')
-        slug = request.POST.get('slug')
-        episodes_count = request.POST.get('episodes_count')
-        year = request.POST.get('year')
-        studio = request.POST.get('studio')
 
         if url:
-             # Mock scraping logic from previous Add view
-            try:
-                # 1. Check broker status first
-                broker_ok, broker_err = check_broker_status()
-                # broker_ok = True
-                if not broker_ok:
-                    messages.warning(request, f"Queue service (Redis) is offline. Episodes added to library but downloads won't start automatically.")
-
-                # We trust the search result data for now
-                defaults = {
-                    'title': title,
-                    'directory_name': clean_filename(title),
-                    'cover_image': cover_image,
-                    'plot': plot,
-                    'slug': slug,
-                    'year': year,
-                    'studio': studio
-                }
-                if animeunity_id:
-                    defaults['animeunity_id'] = animeunity_id
-                
-                # Update status based on existence
-                # But initial status is pending.
-                
-                anime, created = Anime.objects.update_or_create(
-                    source_url=url,
-                    defaults=defaults
-                )
-                
-                # Determine how many episodes to create
-                num_episodes = 1
-                if episodes_count and episodes_count.isdigit():
-                    num_episodes = int(episodes_count)
-
-                # From the url scrape the episode urls with bs4
-                episodes_urls, genres = get_episode_urls(url)
-                
-                if genres:
-                    anime.genres = ",".join(genres)
-                    anime.save()
-
-                # Save metadata files (nfo and poster)
-                from .utils import save_anime_metadata
-                save_anime_metadata(anime)
-
-                num_episodes = len(episodes_urls)
-
-                # Create episodes
-                for ep_num, ep_url in episodes_urls:
-                    episode, created = Episode.objects.get_or_create(
-                        anime=anime,
-                        number=str(ep_num),
-                        defaults={'source_url': ep_url}
-                    )
-
-                    if episode.status != 'completed':
-                        episode.status = 'pending'
-                        episode.save()
-                    
-                for ep_num, ep_url in episodes_urls:
-                    episode = Episode.objects.get(anime=anime, number=str(ep_num))
-                    # Trigger download if it's new or pending AND broker is OK
-                    if episode.status == 'pending' and broker_ok:
-                        print(f"Triggering download for episode {episode.number}")
-                        download_episode_task.delay(episode.id)
-                
-                # Update anime status initially
-                anime.update_status()
-
-                messages.success(request, f"Added '{title}' to queue with {num_episodes} episodes.")
-                
-                # Redirect back to search, preserving query if possible
-                query = request.GET.get('q') # Since form action="" commonly preserves GET params in URL, we might grab it?
-                # Actually request.GET might be empty if the form submit didn't include it in action URL explicitly or browser didn't keep it.
-                # But let's check: <form action=""> usually submits to current URL. if current URL is /?q=foo, it submits POST to /?q=foo.
-                # So request.GET['q'] should exist.
-                if query:
-                    return redirect(f'/?q={query}')
-                return redirect('search')
-
-            except Exception as e:
-                # In a real app, handle error
-                print(f"Error adding anime: {e}")
-                messages.error(request, f"Error adding anime: {e}")
-                pass
+            broker_ok, broker_err = check_broker_status()
+            if not broker_ok:
+                messages.warning(request, f"Queue service (Redis) is offline. '{title}' will be added once it is back.")
+
+            # We trust the search result data for now, scraping happens in the background job
+            result = {
+                'url': url,
+                'title': title,
+                'cover_image': request.POST.get('cover_image'),
+                'plot': request.POST.get('plot'),
+                'id': request.POST.get('id'),
+                'slug': request.POST.get('slug'),
+                'year': request.POST.get('year'),
+                'studio': request.POST.get('studio'),
+            }
+            with transaction.atomic():
+                job = enqueue_add_job(result, title)
+
+            # Remember the job so the search page can show its progress
+            request.session['add_jobs'] = request.session.get('add_jobs', []) + [str(job.id)]
+            
+            # Redirect back to search, preserving query if possible
+            query = request.GET.get('q') # Since form action="" commonly preserves GET params in URL, we might grab it?
+            # Actually request.GET might be empty if the form submit didn't include it in action URL explicitly or browser didn't keep it.
+            # But let's check: <form action=""> usually submits to current URL. if current URL is /?q=foo, it submits POST to /?q=foo.
+            # So request.GET['q'] should exist.
+            if query:
+                return redirect(f'/?q={query}')
         return redirect('search')
 
 class QueueView(View):
@@ -155,6 +115,32 @@ class DownloadedView(View):
         episodes = Episode.objects.filter(status='completed').order_by('-updated_at')
         return render(request, 'downloader/downloaded.html', {'episodes': episodes})
 
+class EpisodeFileView(View):
+    def get(self, request, episode_id):
+        episode = get_object_or_404(Episode, pk=episode_id)
+        return serve_file(request, library_path(episode))
+
+class EpisodeStreamView(View):
+    """
+    Watch an episode while it downloads; once completed this is the regular file.
+    """
+    def get(self, request, episode_id):
+        episode = get_object_or_404(Episode, pk=episode_id)
+        if episode.status == 'completed':
+            return redirect('episode_file', episode_id=episode.id)
+        return serve_growing_file(request, episode, in_progress_path(episode))
+
+class AnalyticsView(View):
+    def get(self, request):
+        try:
+            days = min(max(int(request.GET.get('days', 30)), 1), 365)
+        except ValueError:
+            days = 30
+        summary = analytics_summary(days)
+        summary['day_choices'] = [7, 30, 90, 365]
+        summary['host_limits'] = host_limits()
+        return render(request, 'downloader/analytics.html', summary)
+
 class AnimeDetailView(View): 
     def get(self, request, anime_id):
         anime = get_object_or_404(Anime, pk=anime_id)
@@ -163,86 +149,73 @@ class AnimeDetailView(View):
 
 def download_episode_view(request, episode_id):
     broker_ok, broker_err = check_broker_status()
-    if broker_ok:
-        download_episode_task.delay(episode_id)
-    else:
-        messages.error(request, f"Cannot start download: Queue service (Redis) is offline.")
+    with transaction.atomic():
+        enqueue_episode_downloads([episode_id])
+    if not broker_ok:
+        messages.warning(request, f"Queue service (Redis) is offline. Download will start once it is back.")
     return redirect(request.META.get('HTTP_REFERER', 'queue'))
 
 class CancelAnimeView(View):
     def post(self, request, anime_id):
         anime = get_object_or_404(Anime, pk=anime_id)
-        # Cancel all episodes that are not completed or failed
-        episodes = anime.episodes.exclude(status__in=['completed', 'failed'])
-        episodes.update(status='cancelled')
-        anime.update_status()
+        apply_batch('cancel', anime_ids=[anime.id])
         return JsonResponse({'status': 'ok'})
 
 class SkipAnimeView(View):
     def post(self, request, anime_id):
         anime = get_object_or_404(Anime, pk=anime_id)
-        # Skip all episodes that are not completed or failed
-        episodes = anime.episodes.exclude(status__in=['completed', 'failed'])
-        episodes.update(status='skipped')
-        anime.update_status()
+        apply_batch('skip', anime_ids=[anime.id])
         return JsonResponse({'status': 'ok'})
 
 class CancelEpisodeView(View):
     def post(self, request, episode_id):
         episode = get_object_or_404(Episode, pk=episode_id)
-        episode.status = 'cancelled'
-        episode.save()
-        episode.anime.update_status()
+        apply_batch('cancel', episode_ids=[episode.id], force=True)
         return JsonResponse({'status': 'ok'})
 
 class SkipEpisodeView(View):
     def post(self, request, episode_id):
         episode = get_object_or_404(Episode, pk=episode_id)
-        episode.status = 'skipped'
-        episode.save()
-        episode.anime.update_status()
+        apply_batch('skip', episode_ids=[episode.id], force=True)
         return JsonResponse({'status': 'ok'})
 
 class ResumeEpisodeView(View):
     def post(self, request, episode_id):
         episode = get_object_or_404(Episode, pk=episode_id)
-        episode.status = 'pending'
-        episode.progress = 0
-        episode.error_message = None
-        episode.save()
-        episode.anime.update_status()
-        
-        broker_ok, _ = check_broker_status()
-        if broker_ok:
-            download_episode_task.delay(episode.id)
-            
+        apply_batch('resume', episode_ids=[episode.id])
         return JsonResponse({'status': 'ok'})
 
 class ResumeAnimeView(View):
     def post(self, request, anime_id):
         anime = get_object_or_404(Anime, pk=anime_id)
-        # Find all episodes that are either cancelled, skipped or failed
-        episodes_to_resume = anime.episodes.filter(status__in=['cancelled', 'skipped', 'failed'])
-        
-        broker_ok, _ = check_broker_status()
-        
-        for episode in episodes_to_resume:
-            episode.status = 'pending'
-            episode.progress = 0
-            episode.error_message = None
-            episode.save()
-            if broker_ok:
-                download_episode_task.delay(episode.id)
-        
-        anime.update_status()
+        apply_batch('resume', anime_ids=[anime.id])
         return JsonResponse({'status': 'ok'})
 
+@method_decorator(csrf_exempt, name='dispatch')
+class ApiBatchView(View):
+    """
+    POST {"action": "cancel"|"skip"|"resume"|"retry", "episode_ids": [...], "anime_ids": [...]}
+    """
+    def post(self, request):
+        try:
+            data = json.loads(request.body)
+            action = data.get('action')
+            episode_ids = [int(i) for i in data.get('episode_ids') or []]
+            anime_ids = [int(i) for i in data.get('anime_ids') or []]
+        except (json.JSONDecodeError, TypeError, ValueError, AttributeError):
+            return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
+        if action not in ACTIONS:
+            return JsonResponse({'status': 'error', 'message': f'Unknown action: {action}'}, status=400)
+        result = apply_batch(action, episode_ids=episode_ids, anime_ids=anime_ids)
+        return JsonResponse({'status': 'ok', **result})
+
 class ApiSearchView(View):
-    def get(self, request):
+    async def get(self, request):
         query = request.GET.get('q')
         results = []
         if query:
-            results = search_anime(query)
+            results = await find_anime_async(query)
+            episode_prefetcher.prefetch(results)
         return JsonResponse({'results': results})
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -257,85 +230,60 @@ class ApiDownloadView(View):
         if not title_to_match:
             return JsonResponse({'status': 'error', 'message': 'Title is required'}, status=400)
 
-        # 1. Search for the anime
-        results = search_anime(title_to_match)
-        
-        # 2. Find exact match
-        match = None
-        for res in results:
-            if res['title'].lower() == title_to_match.lower():
-                match = res
-                break
-        
-        if not match:
-            return JsonResponse({'status': 'error', 'message': f'No exact match found for "{title_to_match}"'}, status=404)
-
-        # 3. Add to library (reuse logic from AnimeSearchView)
-        url = match['url']
-        title = match['title']
-        cover_image = match['cover_image']
-        plot = match['plot']
-        animeunity_id = match['id']
-        slug = match['slug']
-        episodes_count = match['episodes_count']
-        year = match['year']
-        studio = match['studio']
+        # Search, exact match and scraping all happen in the background job
+        with transaction.atomic():
+            job = enqueue_add_job({'title': title_to_match, 'exact': True}, title_to_match)
+
+        return JsonResponse({
+            'status': 'accepted',
+            'message': f'Adding "{title_to_match}" in the background.',
+            'job_id': str(job.id),
+            'status_url': reverse('api_job_status', args=[job.id]),
+        }, status=202)
+
+class ApiJobStatusView(View):
+    def get(self, request, job_id):
+        job = get_object_or_404(AddAnimeJob, pk=job_id)
+        return JsonResponse(job.to_dict())
+
+class ApiHostLimitsView(View):
+    def get(self, request):
+        return JsonResponse({'hosts': host_limits()})
 
+@method_decorator(csrf_exempt, name='dispatch')
+class ApiBulkImportView(View):
+    def post(self, request):
         try:
-            broker_ok, broker_err = check_broker_status()
-            
-            defaults = {
-                'title': title,
-                'directory_name': clean_filename(title),
-                'cover_image': cover_image,
-                'plot': plot,
-                'slug': slug,
-                'year': year,
-                'studio': studio
-            }
-            if animeunity_id:
-                defaults['animeunity_id'] = animeunity_id
-            
-            anime, created = Anime.objects.update_or_create(
-                source_url=url,
-                defaults=defaults
-            )
-            
-            episodes_urls, genres = get_episode_urls(url)
-            
-            if genres:
-                anime.genres = ",".join(genres)
-                anime.save()
-
-            from .utils import save_anime_metadata
-            save_anime_metadata(anime)
-
-            for ep_num, ep_url in episodes_urls:
-                episode, _ = Episode.objects.get_or_create(
-                    anime=anime,
-                    number=str(ep_num),
-                    defaults={'source_url': ep_url}
-                )
-                if episode.status != 'completed':
-                    episode.status = 'pending'
-                    episode.save()
-            
-            if broker_ok:
-                for ep_num, ep_url in episodes_urls:
-                    episode = Episode.objects.get(anime=anime, number=str(ep_num))
-                    if episode.status == 'pending':
-                        download_episode_task.delay(episode.id)
-            
-            anime.update_status()
-            
-            return JsonResponse({
-                'status': 'ok', 
-                'message': f'Added "{title}" to queue with {len(episodes_urls)} episodes.',
-                'anime_id': anime.id
-            })
+            data = json.loads(request.body)
+        except json.JSONDecodeError:
+            return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
 
-        except Exception as e:
-            return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+        # Accept either {"items": [...]} or a bare list of titles / AnimeUnity IDs
+        items = data.get('items') if isinstance(data, dict) else data
+        if not isinstance(items, list) or not items:
+            return JsonResponse({'status': 'error', 'message': 'A non-empty list of items is required'}, status=400)
+
+        max_items = getattr(settings, 'BULK_IMPORT_MAX_ITEMS', 500)
+        if len(items) > max_items:
+            return JsonResponse({'status': 'error', 'message': f'At most {max_items} items per request'}, status=400)
+
+        options = data if isinstance(data, dict) else {}
+        try:
+            min_confidence = float(options['min_confidence']) if 'min_confidence' in options else None
+        except (TypeError, ValueError):
+            return JsonResponse({'status': 'error', 'message': 'min_confidence must be a number'}, status=400)
+
+        # Hundreds of upstream scrapes: run them in the background like single adds
+        payload = {'items': items, 'min_confidence': min_confidence, 'dry_run': bool(options.get('dry_run'))}
+        with transaction.atomic():
+            job = enqueue_add_job(payload, f"Bulk import ({len(items)} items)")
+
+        return JsonResponse({
+            'status': 'accepted',
+            'message': f'Importing {len(items)} items in the background.',
+            'job_id': str(job.id),
+            'status_url': reverse('api_job_status', args=[job.id]),
+        }, status=202)
 
 class DeleteAnimeView(View):
     def post(self, request, anime_id):